@@ -123,6 +123,67 @@ DEFAULT_PUBLICATION_PERIOD = "ALL"
 
 DB_ITEM_OF_INTEREST_WIDTH = 255 # database col for logging query/item of interest
 
+# opasCentralDB connection pool (process wide, shared by all opasCentralDB instances)
+DB_POOL_SIZE = 10 # idle connections kept open for reuse
+DB_POOL_MAX_OVERFLOW = 10 # extra connections allowed under load (closed when returned)
+DB_POOL_CHECKOUT_TIMEOUT = 30 # seconds to wait for a free connection before giving up
+DB_POOL_RECYCLE_SECONDS = 3600 # close connections older than this (stay well below MySQL wait_timeout)
+DB_POOL_PING_AFTER_SECONDS = 60 # health check (ping) idle connections older than this before reuse
+DB_STREAM_FETCH_SIZE = 1000 # rows fetched at a time from a server side (unbuffered) cursor, e.g., streamed report downloads
+
+# write-behind queue for endpoint and document view logging (api_session_endpoints, api_docviews)
+DB_LOG_WRITE_BEHIND = True # False to write log records synchronously in the request
+DB_LOG_QUEUE_MAX = 20000 # records waiting to be written; when full, apply the queue full policy
+DB_LOG_QUEUE_FULL_POLICY = "drop" # "drop" the new record, or "block" the caller (up to DB_LOG_QUEUE_BLOCK_TIMEOUT)
+DB_LOG_QUEUE_BLOCK_TIMEOUT = 2 # seconds, for the block policy; the record is dropped after that
+DB_LOG_BATCH_SIZE = 200 # write when this many records are waiting...
+DB_LOG_FLUSH_SECONDS = 2 # ...or when the oldest waiting record is this old
+
+# in-process caches (see opasCacheSupport)
+CACHE_SHARED_BACKEND_URL = None # e.g., "redis://localhost:6379/0" to share caches across server workers (requires redis package)
+SESSION_CACHE_TTL = 60 # seconds a session's info is reused before checking the DB/PaDS again
+SESSION_CACHE_MAX_ENTRIES = 20000
+PERMIT_CACHE_TTL = 120 # seconds a PaDS permit decision (for abstract/list views) is reused for the session
+PERMIT_CACHE_MAX_ENTRIES = 50000
+PERMIT_CACHE_YEAR_BAND = 1 # documents whose years fall in the same band (of this many years) share a permit decision
+SEARCH_CACHE_TTL = 600 # seconds search results (without per-user access info) are reused; 0 to turn off the search cache
+SEARCH_CACHE_MAX_ENTRIES = 2000
+METADATA_CACHE_TTL = 86400 # seconds metadata (volume, contents and source lists) is reused; it's recomputed anyway when the docs index version changes. 0 to turn off
+METADATA_CACHE_MAX_ENTRIES = 5000
+METADATA_CACHE_PREWARM = True # at server startup, load the journal list and the journal volume lists into the metadata cache (in the background)
+STATS_SNAPSHOT_TTL = 7 * 86400 # seconds the database statistics snapshot is kept (it's recomputed anyway when the docs index version changes)
+TERM_COUNT_CACHE_TTL = 86400 # seconds term counts are reused (they're recounted anyway when the docs index version changes); 0 to turn off
+TERM_COUNT_CACHE_MAX_ENTRIES = 20000
+TERM_COUNT_MAX_CONCURRENCY = 8 # Solr term count requests run at once (get_term_counts; the async version is limited by SOLR_ASYNC_POOL_SIZE)
+GLOSSARY_INDEX_CHECK_INTERVAL = 60 # seconds between checks of the glossary core index version; the in-memory glossary is reloaded when it changes
+GLOSSARY_INDEX_PAGE_SIZE = 1000 # glossary core records per request when loading the in-memory glossary
+GLOSSARY_INDEX_PRELOAD = True # at server startup, load the in-memory glossary (in the background)
+TERM_DICTIONARY_FIELDS = {"docs": ["text", "title", "art_kwds_str", "art_authors", "art_authors_mast"], "authors": ["authors"]} # fields with an in-process term dictionary (WordWheel, get_term_index); others use Solr
+TERM_DICTIONARY_CHECK_INTERVAL = 60 # seconds between checks of a core's index version; its term dictionaries are rebuilt (in the background) when it changes
+TERM_DICTIONARY_EXPORT_PAGE_SIZE = 50000 # terms per Solr request when building a term dictionary
+TERM_DICTIONARY_BLOCK_SIZE = 16 # terms per front coded block (larger is smaller, but slower to search)
+TERM_DICTIONARY_PRELOAD = True # at server startup, build the term dictionaries (in the background)
+NAV_INDEX_CHECK_INTERVAL = 60 # seconds between checks of the docs core index version; the next/previous navigation index is updated when it changes
+NAV_INDEX_EXPORT_PAGE_SIZE = 10000 # documents per Solr request when building the navigation index
+NAV_INDEX_MAX_INCREMENTAL_VOLUMES = 500 # if more volumes changed, rebuild the whole navigation index rather than update it
+NAV_INDEX_FULL_REBUILD_INTERVAL = 86400 # seconds; rebuilt from all documents at least this often (volumes removed from the core are only dropped then)
+NAV_INDEX_PRELOAD = True # at server startup, build the navigation index (in the background)
+RENDER_CACHE_TTL = 86400 # seconds a rendered document is kept (the key includes file_last_modified, so updates aren't missed)
+RENDER_CACHE_MAX_ENTRIES = 2000
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024 # total size of the rendered documents kept (local memory backend)
+SOLR_INDEX_VERSION_CHECK_INTERVAL = 10 # seconds between checks of the Solr index version; caches keyed on it are cleared when it changes
+
+# PaDS (authserver) http client
+PADS_HTTP_POOL_SIZE = 20 # pooled keep-alive connections to PaDS
+PADS_PERMIT_FANOUT_WORKERS = 8 # concurrent permit requests when checking a page of search results
+
+# asyncio Solr client (opasSolrAsync) used by the async endpoints
+SOLR_ASYNC_POOL_SIZE = 20 # pooled keep-alive connections to Solr (per core)
+SOLR_ASYNC_CONNECT_TIMEOUT = 5 # seconds
+SOLR_ASYNC_TIMEOUT = 60 # seconds to wait for Solr to answer a query (same as pysolr's default)
+SOLR_ASYNC_RETRIES = 2 # retries after a connection error, timeout, or 502/503/504 from Solr
+SOLR_ASYNC_RETRY_BACKOFF = 0.25 # seconds before the first retry, doubled for each one after
+
 SOLR_KWIC_MAX_ANALYZED_CHARS = 25200000 # kwic (and highlighting) wont show any hits past this.
 SOLR_FULL_TEXT_MAX_ANALYZED_CHARS = 25200000 # full-text markup won't show matches beyond this.
 SOLR_HIGHLIGHT_RETURN_FRAGMENT_SIZE = 25200000 # to get a complete document from SOLR, with highlights, needs to be large.  SummaryFields do not have highlighting.
@@ -203,6 +264,7 @@ DESCRIPTION_CLIENT_ID = "Numeric ID assigned to a client app by Opas Administrat
 DESCRIPTION_CLIENT_SESSION = "Client session GUID"
 DESCRIPTION_CORE = "The preset name for the specif core to use (e.g., docs, authors, etc.)"
 DESCRIPTION_DOWNLOAD = "Download a CSV with the current return set of the statistical table" 
+DESCRIPTION_DOWNLOADFORMAT = "Format of the download: csv (default) or ndjson (one JSON object per line)"
 DESCRIPTION_DAYSBACK = "Number of days to look back to assess what's new"
 DESCRIPTION_DOCDOWNLOADFORMAT = f"The format of the downloaded document data.  One of: {list_values(VALS_DOWNLOADFORMAT)}"
 DESCRIPTION_DOCIDORPARTIAL = "The document ID (e.g., IJP.077.0217A) or a partial ID (e.g., IJP.077,  no wildcard) for which to return data (only one ID for full-text documents)"
@@ -280,6 +342,7 @@ TITLE_CLIENT_SESSION = "GUID/UUID for client session"
 TITLE_CORE = "Core to use"
 TITLE_DAYSBACK = "Days Back"
 TITLE_DOWNLOAD = "Download response as CSV"
+TITLE_DOWNLOADFORMAT = "Download format"
 TITLE_DOCUMENT_CONCORDANCE_ID = "Paragraph language ID"
 TITLE_DOCUMENT_CONCORDANCE_RX = "Paragraph language IDs"
 TITLE_DOCUMENT_ID = "Document ID (e.g., IJP.077.0217A)"
@@ -404,6 +467,19 @@ ACCESS_ABSTRACT_RESTRICTED_MESSAGE = "You must be a registered user to view abst
 # temp directory used for generated downloads
 TEMPDIRECTORY = tempfile.gettempdir()
 
+# rendered downloads (PDF, EPUB, HTML), see opasDownloadSupport
+DOWNLOAD_CACHE_PATH = os.path.join(TEMPDIRECTORY, "opasDownloads") # rendered files, by art_id, format and file_last_modified
+DOWNLOAD_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024 # least recently used files are removed when the cache is larger than this
+DOWNLOAD_CACHE_MIN_AGE = 120 # seconds; files used more recently than this are never removed (they may still be streaming)
+DOWNLOAD_RENDER_WORKERS = 2 # processes rendering downloads (PDF conversion in particular is CPU bound)
+DOWNLOAD_RENDER_TIMEOUT = 300 # seconds a request waits for its download to be rendered
+
+# image manifest (image id to file, see opasFileSupport.ImageManifest) for the Documents/Image endpoint
+IMAGE_MANIFEST_REFRESH_INTERVAL = 3600 # seconds between listings of the image folder (in the background)
+IMAGE_MANIFEST_MISS_TTL = 60 # seconds an image id that wasn't found isn't looked up again
+IMAGE_STREAM_CHUNK_SIZE = 64 * 1024 # bytes per chunk when streaming an image
+IMAGE_CACHE_MAX_AGE = 86400 # seconds clients may use an image without revalidating (Cache-Control max-age)
+
 VIEW_MOSTVIEWED_DOWNLOAD_COLUMNS = "textref, lastweek, lastmonth, last6months, last12months, lastcalyear"
 VIEW_MOSTCITED_DOWNLOAD_COLUMNS = "art_citeas_text, count5, count10, count20, countAll"
 
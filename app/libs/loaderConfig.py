@@ -11,3 +11,22 @@ SRC_CODES_TO_INCLUDE_PARAS = ["GW", "SE"]
 # for these codes, do not create update notifications
 DATA_UPDATE_PREPUBLICATION_CODES_TO_IGNORE = ["EGG", "NODO"] # examples, no update notifications for these codes.
 
+
+# Parallel load (--workers N)
+PARALLEL_LOAD_BATCH_SIZE = 50 # articles per batch of Solr adds and MySQL inserts in the writer stage
+PARALLEL_LOAD_PENDING_PER_WORKER = 4 # articles a worker process can have built ahead of the writer stage
+
+# Bulk inserts (api_biblioxml, api_articles)
+DB_INSERT_CHUNK_SIZE = 500 # rows per executemany (sent as one multi-row statement)
+BIBLIO_MAX_PENDING_ROWS = 20000 # references collected before they're written, even if before the next commit
+
+# Solr adds (docs, authors, glossary cores)
+SOLR_BATCH_MAX_DOCS = 1000 # documents per add, counting nested child (paragraph) documents
+SOLR_BATCH_MAX_BYTES = 16 * 1024 * 1024 # approximate bytes per add
+SOLR_COMMIT_WITHIN = 60000 # ms; Solr commits adds within this time (commitWithin), rather than explicit commits during the load
+SOLR_BATCH_RETRIES = 3 # retries for a failed add, before adding the documents one at a time
+SOLR_BATCH_RETRY_BACKOFF = 2 # seconds, doubled for each retry
+
+# Incremental load checks
+SOLR_EXPORT_PAGE_SIZE = 10000 # rows per page (cursorMark) when exporting field values for all documents from Solr
+LOAD_MANIFEST_PATH = "opasDataLoader_manifest.sqlite" # local manifest of loaded files (size, modification time, content hash)
@@ -459,6 +459,8 @@ class ServerStatusContent(BaseModel):
     source_count: dict = Schema(None, title="")
     description_html: str = Schema(None, title="")
     source_count_html: str = Schema(None, title="")
+    snapshot_time: str = Schema(None, title="When these counts were computed (UTC)")
+    index_version: str = Schema(None, title="Version of the text server (docs) index the counts were computed from")
 
 class ServerStatusItem(BaseModel):
     db_server_ok: bool = Schema(None, title="Database server is online")
@@ -58,14 +58,17 @@ sys.path.append('./libs/configLib')
 import http.cookies
 import re
 import secrets
+import threading
 import socket, struct
 from collections import OrderedDict
 from urllib.parse import unquote
 import json
+import csv
 from xml.sax import SAXParseException
 
 from starlette.responses import JSONResponse, Response
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import Response
 import starlette.status as httpCodes
 
@@ -100,7 +103,7 @@ from localsecrets import TIME_FORMAT_STR
 # from opasConfig import OPASSESSIONID
 # import configLib.opasCoreConfig as opasCoreConfig
 from stdMessageLib import COPYRIGHT_PAGE_HTML  # copyright page text to be inserted in ePubs and PDFs
-from configLib.opasCoreConfig import solr_docs, solr_authors, solr_gloss, solr_docs_term_search, solr_authors_term_search
+from configLib.opasCoreConfig import solr_docs, solr_authors, solr_gloss, solr_authors_term_search
 from configLib.opasCoreConfig import solr_docs2, solr_authors2, solr_gloss2
 
 from configLib.opasCoreConfig import EXTENDED_CORES
@@ -125,14 +128,16 @@ from xhtml2pdf import pisa             # for HTML 2 PDF conversion
 # note: documents and documentList share the same internals, except the first level json label (documents vs documentlist)
 import models
 
-import opasXMLHelper as opasxmllib
 import opasQueryHelper
 import opasGenSupportLib as opasgenlib
 import opasCentralDBLib
 import schemaMap
 import opasDocPermissions as opasDocPerm
 import opasPySolrLib
+import opasGlossarySupport
 from opasPySolrLib import search_text, search_text_qs
+from opasCacheSupport import session_cache
+import opasCacheSupport
 
 # count_anchors = 0
 
@@ -267,10 +272,20 @@ def get_session_info(request: Request,
            ii) It saves the session
         b) If it's there already: (Repeatable, quickest path)
            i) Done, returns it.  No update.  
+
+     3) Resolved session info is kept in the session cache (opasCacheSupport.session_cache) for
+        a short time (opasConfig.SESSION_CACHE_TTL), so repeated requests in a session don't go to the
+        DB or authserver.  The cache entry is invalidated on login, logout, and session updates.
+        A copy is returned, since callers may update it for the request.
     """
     ocd = opasCentralDBLib.opasCentralDB()
     if session_id is not None and session_id != opasConfig.NO_SESSION_ID:
         ts = time.time()
+        session_info = session_cache.get(session_id)
+        if session_info is not None:
+            logger.debug(f"Session {session_id} found in session cache.")
+            return ocd, session_info.copy()
+
         session_info = ocd.get_session_from_db(session_id)
         if session_info is None:
             logger.info(f"Session {session_id} not found.  Getting from authserver (will save on server)")
@@ -292,6 +307,8 @@ def get_session_info(request: Request,
             logger.debug(f"Get/Save session info response time: {time.time() - ts}")
         
         logger.info("getSessionInfo: %s", session_info)
+        if session_info is not None:
+            session_cache.set(session_id, session_info.copy())
         
     else:
         logger.debug("No SessionID; Default session info returned (Not Logged In)")
@@ -1182,15 +1199,45 @@ def database_who_cited( publication_period: int=None,   # Limit the considered p
     #return ret_val
 
 #-----------------------------------------------------------------------------
+database_statistics_lock = threading.Lock()
+
 def metadata_get_database_statistics(session_info=None):
     """
     Return counts for the annual summary (or load checks)
 
+    The counts are a snapshot, computed once per version of the docs index (the first time
+      they're requested after it changes) and returned from opasCacheSupport.stats_cache after
+      that.  snapshot_time and index_version in the return say how fresh they are.
+
     >>> results = metadata_get_database_statistics()
     >>> results.article_count > 135000
     True
+    >>> metadata_get_database_statistics().snapshot_time == results.snapshot_time
+    True
+    """
+    index_version = opasPySolrLib.get_docs_index_version()
+    if index_version is None: # unknown, so there's no way to tell if a snapshot is current
+        return compute_database_statistics(session_info)
+
+    cache_key = f"database_statistics.{index_version}"
+    ret_val = opasCacheSupport.stats_cache.get(cache_key)
+    if ret_val is None:
+        # one thread computes it; any others requesting it meanwhile wait for that
+        with database_statistics_lock:
+            ret_val = opasCacheSupport.stats_cache.get(cache_key)
+            if ret_val is None:
+                ret_val = compute_database_statistics(session_info)
+                ret_val.index_version = index_version
+                opasCacheSupport.stats_cache.set(cache_key, ret_val)
+
+    return ret_val
+
+def compute_database_statistics(session_info=None):
+    """
+    Compute the counts for metadata_get_database_statistics (three faceted searches plus the volume list)
     """
     content = models.ServerStatusContent()
+    content.snapshot_time = datetime.utcfromtimestamp(time.time()).strftime(TIME_FORMAT_STR)
     
     # data = metadata_get_volumes(source_code="IJPSP")
     documentList, ret_status = search_text(query=f"art_id:*", 
@@ -1291,6 +1338,34 @@ There are over
     #return total_count, source_info_dblist, ret_val, return_status
 
 #-----------------------------------------------------------------------------
+def metadata_prewarm():
+    """
+    Load the journal list and the volume lists for the journals into the metadata cache
+      (opasPySolrLib.metadata_cached), so the browse pages don't wait on the facet pivot queries.
+      Same arguments as the Journals and Volumes endpoints use, so they get the cached returns.
+    """
+    ts = time.time()
+    count = 0
+    try:
+        journals = metadata_get_source_info(src_type="Journal", src_code="*", src_name=None, limit=opasConfig.DEFAULT_LIMIT_FOR_METADATA_LISTS, offset=0)
+        count += 1
+        opasPySolrLib.metadata_get_volumes(None, source_type=None)
+        count += 1
+        for journal in journals.sourceInfo.responseSet:
+            if journal.PEPCode is not None:
+                opasPySolrLib.metadata_get_volumes(journal.PEPCode.upper(), source_type=None)
+                count += 1
+    except Exception as e:
+        logger.warning(f"Metadata prewarm stopped after {count} lists: {e}")
+    else:
+        logger.info(f"Metadata prewarm loaded {count} lists in {time.time() - ts:.2f} secs")
+
+def metadata_prewarm_in_background():
+    if opasConfig.METADATA_CACHE_PREWARM:
+        threading.Thread(target=metadata_prewarm, name="MetadataPrewarm", daemon=True).start()
+
+#-----------------------------------------------------------------------------
+@opasPySolrLib.metadata_cached
 def metadata_get_source_info(src_type=None, # opasConfig.VALS_PRODUCT_TYPES
                              src_code=None,
                              src_name=None, 
@@ -1832,6 +1907,9 @@ def documents_get_glossary_entry(term_id,
     """
     ret_val = {}
 
+    # served from the in-memory glossary (opasGlossarySupport); the Solr queries below are used only if it isn't available
+    glossary_entries = opasGlossarySupport.glossary_index.find(term_id, term_id_type)
+
     # Name and Group are strings, and case sensitive, so search, as submitted, and uppercase as well
     if term_id_type == "Name":
         # 2020-11-11 use text field instead
@@ -1844,11 +1922,9 @@ def documents_get_glossary_entry(term_id,
         #qstr = f'group_name:("{term_id}" || "{term_id.upper()}" || "{term_id.lower()}")'
         # hybrid search both if needed! 2021-01-27
         qstr = f'group_name:("{term_id}" || "{term_id.upper()}" || "{term_id.lower()}")'
-        count = opasPySolrLib.get_match_count(solr_gloss2, query=qstr)
-        if count == 0:
+        if glossary_entries is None and opasPySolrLib.get_match_count(solr_gloss2, query=qstr) == 0:
             # no match, look in the group terms for a match
             qstr = f'group_name_terms:("{term_id}")'
-            count = opasPySolrLib.get_match_count(solr_gloss2, query=qstr)
         
     else: # default is term ID
         term_id = term_id.upper()
@@ -1879,45 +1955,22 @@ def documents_get_glossary_entry(term_id,
         "facet.mincount": 1
     }
     
-    try:
-        results = solr_gloss2.search(qstr, **args)
-    except Exception as e:
-        err = f"Solr query failed {e}"
-        logger.error(err)
-        raise Exception(err)
+    if glossary_entries is None:
+        try:
+            results = solr_gloss2.search(qstr, **args)
+        except Exception as e:
+            err = f"Solr query failed {e}"
+            logger.error(err)
+            raise Exception(err)
+        else:
+            glossary_entries = results.docs
            
     document_item_list = []
     count = 0
     last_group = None
     try:
-        for result in results.docs:
-            document = result.get("text", None)
+        for result in glossary_entries:
             documentListItem = copy.deepcopy(gloss_template)
-            if not documentListItem.accessLimited:
-                try:
-                    if retFormat == "HTML":
-                        document = opasxmllib.xml_str_to_html(document)
-                    elif retFormat == "TEXTONLY":
-                        document = opasxmllib.xml_elem_or_str_to_text(document)
-                    else: # XML
-                        document = document
-                except Exception as e:
-                    logger.warning(f"Error converting glossary content: {term_id} ({e})")
-            else:
-                try:
-                    if retFormat == "HTML":
-                        document = opasxmllib.xml_str_to_html(document, transformer_name=opasConfig.XSLT_XMLTOHTML_GLOSSARY_EXCERPT)
-                    elif retFormat == "TEXTONLY":
-                        document = opasxmllib.xml_elem_or_str_to_text(document)
-                    else: # XML
-                        document = document                   
-                except ValidationError as e:
-                    logger.error(e.json())  
-                except Exception as e:
-                    warning = f"Error getting contents of Glossary entry {term_id}"
-                    logger.warning(warning)
-                    document = warning
-                
             documentListItem.groupID = result.get("group_id", None)
             # if using document, getting the individual items in a group is redundant.
             #  so in that case, don't add them.  Only return unique groups.
@@ -1925,7 +1978,6 @@ def documents_get_glossary_entry(term_id,
                 last_group = documentListItem.groupID
                 documentListItem.term = result.get("term", None)
                 documentListItem.termID = result.get("term_id")
-                # documentListItem.document = document 
                 documentListItem.document = result.get("text")
                 documentListItem.groupName = result.get("group_name", None)
                 documentListItem.groupTermCount = result.get("group_term_count", None)
@@ -1986,99 +2038,28 @@ def get_term_count_list(term, term_field="text_xml", limit=opasConfig.DEFAULT_LI
     Returns a list of matching terms, and the number of articles with that term.
 
     Args:
-        term (str): Term or comma separated list of terms to return data on.
+        term (str): Term or comma separated list of terms to return data on (or a list of them).
         term_field (str): the text field to look in
-        limit (int, optional): Paging mechanism, return is limited to this number of items.
-        offset (int, optional): Paging mechanism, start with this item in limited return set, 0 is first item.
-        term_order (str, optional): Return the list in this order, per Solr documentation.  Defaults to "index", which is the Solr determined indexing order.
+        limit (int, optional): Not used; the counts are for the terms requested (kept for compatibility).
+        offset (int, optional): Not used (kept for compatibility).
+        term_order (str, optional): Not used (kept for compatibility).
+        wildcard_match_limit (int, optional): number of the most frequent matches returned for each wildcard term
 
     Returns:
-        list of dicts with term, count and status var ret_status
-
-        return ret_val, ret_status
+        dict of term: count (see opasPySolrLib.get_term_counts, which batches the Solr requests), or models.ErrorReturn
 
     Docstring Tests:    
         >>> resp = get_term_count_list("Jealousy")
 
     """
-    ret_val = {}
-    ret_status = (200, "OK", "") # default is like HTTP_200_OK
-
-    #  see if there is a wildcard
-    if "," in term: 
-        # It's a comma separated list!
-        try:
-            results = solr_docs_term_search( terms_fl=term_field,
-                                             terms_list=term.lower(),
-                                             terms_sort=term_order,  # index or count
-                                             terms_mincount="1",
-                                             #terms_ttf=True, 
-                                             terms_limit=limit
-                                             )
-        except Exception as e:
-            # ret_status = (e.httpcode, e.reason, e.body) # default is like HTTP_200_OK
-            ret_val = models.ErrorReturn(httpcode=e.httpcode, error="Search syntax error (Solr)", error_description=f"There's an error in your search input.")
-        else:
-            try:
-                ret_val = results.terms.get(term_field, {})
-            except Exception as e:
-                logger.debug(f"get_term_count_list error: {e}")
-
-    elif isinstance(term, list):
-        for term_list_component in term:
-            try:
-                ret_val.update(get_term_count_list(term_list_component))
-            except Exception as e:
-                logger.debug(f"get_term_count_list error: {e}")
-
-    elif re.match(".*[\*\?\.].*", term):
-        # make sure legit
-        # do subs to make wildcard * into zero or more regex character, and ? to zero or one
-        term = re.sub("(?P<lead>[^\.])(?P<wildc>[\*\?])", "\g<lead>.\g<wildc>", term)
-        try:
-            re.compile(term)
-            is_valid = True
-        except:
-            is_valid = False
-
-        # #TODO test is_valid below
-        try:
-            results = solr_docs_term_search(terms_fl=term_field,
-                                            terms_limit=wildcard_match_limit,
-                                            terms_regex=term.lower(), # + ".*",
-                                            terms_mincount="1",
-                                            terms_sort="count"  # wildcard, pick highest
-                                            )
-        except solr.SolrException as e:
-            # ret_status = (e.httpcode, e.reason, e.body) # default is like HTTP_200_OK
-            ret_val = models.ErrorReturn(httpcode=e.httpcode, error="Search syntax error (Solr)", error_description=f"There's an error in your search input.")
-
-        try:
-            ret_val = results.terms.get(term_field, {})
-            term_wild = term.replace(".", "")
-            ret_val = {f"{key}({term_wild})": value for (key, value) in ret_val.items()}
-            ret_val.update({f"Total({term_wild})>=":sum(x for x in ret_val.values())})
-
-        except Exception as e:
-            logger.debug(f"get_term_count_list error: {e}")
+    if isinstance(term, list):
+        term_specs = [(term_field, n) for n in term]
     else:
-        # Note: we need an exact match here.
-        try:
-            results = solr_docs_term_search( terms_fl=term_field,
-                                             terms_prefix=term.lower(),
-                                             terms_sort=term_order,  # index or count
-                                             terms_mincount="1",
-                                             #terms_ttf=True, 
-                                             terms_limit=1 # only one response needed
-                                             )
-        except solr.SolrException as e:
-            # ret_status = (e.httpcode, e.reason, e.body) # default is like HTTP_200_OK
-            ret_val = models.ErrorReturn(httpcode=e.httpcode, error="Search syntax error (Solr)", error_description=f"There's an error in your search input.")
-        else:
-            try:
-                ret_val = results.terms.get(term_field, {})
-            except Exception as e:
-                logger.debug(f"get_term_count_list error: {e}")
+        term_specs = [(term_field, term)]
+
+    ret_val = opasPySolrLib.get_term_counts(term_specs, wildcard_match_limit=wildcard_match_limit)
+    if not isinstance(ret_val, models.ErrorReturn):
+        ret_val = ret_val.get(term_field, {})
 
     return ret_val
 
@@ -2115,6 +2096,52 @@ def save_opas_session_cookie(request: Request, response: Response, session_id):
     return ret_val
     
 
+#================================================================================================================
+REPORT_DOWNLOAD_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def report_rows_to_text(rows, ret_format="csv", header=None):
+    """
+    Format a batch of report rows for a download: CSV lines (rows are tuples) or
+      NDJSON, one JSON object per line (rows are dicts; values json can't represent, e.g., dates, as strings)
+
+    >>> report_rows_to_text([("nrs", None, 3), ("a,b", "x", 4)], header=["user id", "session id", "count"])
+    'user id,session id,count\\nnrs,,3\\n"a,b",x,4\\n'
+    >>> report_rows_to_text([{"user": "nrs", "last_update": datetime(2021, 3, 1, 10, 5)}], ret_format="ndjson")
+    '{"user": "nrs", "last_update": "2021-03-01 10:05:00"}\\n'
+    """
+    if ret_format == "ndjson":
+        ret_val = "".join([json.dumps(row, default=str) + "\n" for row in rows])
+    else:
+        stream = StringIO()
+        writer = csv.writer(stream, lineterminator="\n")
+        if header is not None:
+            writer.writerow(header)
+        writer.writerows(rows)
+        ret_val = stream.getvalue()
+
+    return ret_val
+
+async def report_download_stream_async(ocd, select, ret_format="csv", header=None, fetch_size=opasConfig.DB_STREAM_FETCH_SIZE):
+    """
+    Async generator of a report download (for a StreamingResponse), in chunks of fetch_size rows.
+
+    The rows are read from a server side cursor (ocd.iter_select), a batch at a time in the
+      threadpool, so memory use doesn't depend on the size of the report, and the event loop isn't
+      held up by the database.
+    """
+    batches = ocd.iter_select(select, dict_rows=(ret_format == "ndjson"), fetch_size=fetch_size)
+    try:
+        if ret_format != "ndjson" and header is not None:
+            yield report_rows_to_text([], ret_format=ret_format, header=header)
+        while True:
+            rows = await run_in_threadpool(next, batches, None)
+            if rows is None:
+                break
+            yield report_rows_to_text(rows, ret_format=ret_format)
+    finally:
+        # returns the connection (closes it, if the client went away before the end)
+        await run_in_threadpool(batches.close)
+
 #================================================================================================================
 def search_stats_for_download(solr_query_spec: models.SolrQuerySpec,
                               limit=None,
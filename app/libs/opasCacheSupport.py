@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasCacheSupport
+
+In-process caches for the server, so repeated requests don't have to go back to the database,
+  the auth server (PaDS), or Solr every time.
+
+An OpasCache has a time to live (TTL) for entries, and stores them in a backend:
+
+   LocalCacheBackend - (default) thread safe, in memory, LRU eviction by entry count (and optionally, total size)
+   RedisCacheBackend - optional (requires the redis package); shared across server workers
+
+Keys for the Redis backend must be strings; session related caches use keys starting with
+  the session_id so they can be invalidated with delete_prefix.
+
+>>> cache = OpasCache("doctest", ttl=60, max_entries=2)
+>>> cache.set("a", 1)
+>>> cache.set("b", 2)
+>>> cache.get("a")
+1
+>>> cache.set("c", 3) # evicts b, the least recently used
+>>> cache.get("b") is None
+True
+>>> cache.stats()["hits"], cache.stats()["misses"]
+(1, 1)
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+sys.path.append('../config')
+
+import opasConfig
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class LocalCacheBackend(object):
+    """
+    Thread safe in-memory store with per entry expiration and LRU eviction.
+
+    With max_bytes, the total size of the values (per sys.getsizeof, exact for strings) is
+      limited too; values larger than a quarter of max_bytes aren't stored.
+
+    >>> backend = LocalCacheBackend(max_entries=10, max_bytes=sys.getsizeof("a" * 100) * 4)
+    >>> for n in range(5): backend.set(n, str(n) * 100) # the fifth evicts 0, the least recently used
+    >>> backend.get(0) is None, len(backend)
+    (True, 4)
+    >>> backend.set(5, "x" * 200) # too big
+    >>> backend.get(5) is None
+    True
+    """
+    def __init__(self, max_entries=1000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict() # key -> (expires, value, size)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.size_bytes = 0
+
+    def _remove(self, key):
+        # caller holds the lock
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    def get(self, key):
+        ret_val = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value, size = entry
+                if expires is not None and expires < time.time():
+                    self._remove(key)
+                else:
+                    self._data.move_to_end(key)
+                    ret_val = value
+
+        return ret_val
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        size = sys.getsizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes / 4:
+                return # too big to be worth the room
+
+            self._data[key] = (expires, value, size)
+            self.size_bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if str(key).startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+class RedisCacheBackend(object):
+    """
+    Store shared by all server workers (processes) in a Redis server, e.g., redis://localhost:6379/0
+
+    Values are pickled.  Redis does its own expiration and (if configured with maxmemory) eviction.
+    """
+    def __init__(self, url, prefix="opas"):
+        if redis is None:
+            raise ImportError("RedisCacheBackend requires the redis package")
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self.evictions = 0
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key):
+        ret_val = None
+        value = self._redis.get(self._key(key))
+        if value is not None:
+            ret_val = pickle.loads(value)
+        return ret_val
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self._key(key), pickle.dumps(value), ex=int(ttl) if ttl is not None else None)
+
+    def delete(self, key):
+        self._redis.delete(self._key(key))
+
+    def delete_prefix(self, prefix):
+        for key in self._redis.scan_iter(match=self._key(f"{prefix}*")):
+            self._redis.delete(key)
+
+    def clear(self):
+        self.delete_prefix("")
+
+    def __len__(self):
+        return sum(1 for key in self._redis.scan_iter(match=self._key("*")))
+
+def get_cache_backend(name, max_entries=1000, backend_url=None, max_bytes=None):
+    """
+    Return the configured backend: Redis if a backend_url is configured (and the redis package
+      is available), otherwise local memory (max_bytes applies only to that).
+    """
+    ret_val = None
+    if backend_url is not None:
+        try:
+            ret_val = RedisCacheBackend(backend_url, prefix=f"opas:{name}")
+        except Exception as e:
+            logger.error(f"Cache {name}: can't use shared backend {backend_url} ({e}). Using local memory.")
+
+    if ret_val is None:
+        ret_val = LocalCacheBackend(max_entries=max_entries, max_bytes=max_bytes)
+
+    return ret_val
+
+class OpasCache(object):
+    """
+    Cache with a TTL for entries, and hit/miss counters, in front of a backend.
+    """
+    def __init__(self, name, ttl=60, max_entries=1000, backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.backend = backend if backend is not None else LocalCacheBackend(max_entries=max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the value for key, or None if it's not there (or expired)
+        """
+        try:
+            ret_val = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Cache {self.name}: get error ({e})")
+            ret_val = None
+
+        if ret_val is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return ret_val
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(key, value, ttl=ttl if ttl is not None else self.ttl)
+        except Exception as e:
+            logger.error(f"Cache {self.name}: set error ({e})")
+
+    def delete(self, key):
+        """
+        Explicitly invalidate an entry
+        """
+        if key is not None:
+            try:
+                self.backend.delete(key)
+            except Exception as e:
+                logger.error(f"Cache {self.name}: delete error ({e})")
+
+    def delete_prefix(self, prefix):
+        """
+        Invalidate all entries with (string) keys starting with prefix
+        """
+        if prefix is not None:
+            try:
+                self.backend.delete_prefix(prefix)
+            except Exception as e:
+                logger.error(f"Cache {self.name}: delete error ({e})")
+
+    def clear(self):
+        try:
+            self.backend.clear()
+        except Exception as e:
+            logger.error(f"Cache {self.name}: clear error ({e})")
+
+    def stats(self):
+        return {"name": self.name,
+                "entries": len(self.backend),
+                "bytes": getattr(self.backend, "size_bytes", None),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.backend.evictions,
+                }
+
+class IndexVersionTracker(object):
+    """
+    Version of a Solr index, for keys of caches of data derived from it.  The version is rechecked
+      (by the caller, when needs_check() is True) at most every check_interval seconds, and the
+      registered caches are cleared when it changes.  None means unknown: don't use the caches.
+
+    >>> tracker = IndexVersionTracker("doctest", check_interval=60, caches=[OpasCache("doctest")])
+    >>> tracker.needs_check()
+    True
+    >>> tracker.update("1614592800000.12")
+    >>> tracker.caches[0].set("a", 1)
+    >>> tracker.needs_check()
+    False
+    >>> tracker.update("1614592800000.13") # new version, clears the cache
+    >>> tracker.caches[0].get("a") is None
+    True
+    """
+    def __init__(self, name, check_interval=10, caches=None):
+        self.name = name
+        self.check_interval = check_interval
+        self.caches = caches if caches is not None else []
+        self.version = None
+        self.checked = 0
+
+    def needs_check(self):
+        return time.time() - self.checked >= self.check_interval
+
+    def update(self, version):
+        """
+        Record the version just read from Solr (None if it couldn't be read)
+        """
+        if version != self.version and self.version is not None:
+            logger.info(f"Index {self.name} changed from version {self.version} to {version}. Clearing {len(self.caches)} caches.")
+            for cache in self.caches:
+                cache.clear()
+
+        self.version = version
+        self.checked = time.time()
+
+class BackgroundRebuilder(object):
+    """
+    Base for in-memory data built from Solr cores (by key), rebuilt in a background thread when a
+      core's index version changes (checked at most every check_interval seconds, per core).
+
+    Subclasses implement rebuild_core(key, version), which builds or updates the core's data unless
+      it's of that version (None, if the version can't be read).  read_version(solr_core) returns a
+      core's index version (see opasPySolrLib.read_index_version).
+
+    load_in_background() starts the first builds (at server startup), unless preload is False.
+    """
+    def __init__(self, name, cores, read_version, check_interval=10, preload=True):
+        self.name = name
+        self.cores = cores
+        self.read_version = read_version
+        self.preload = preload
+        self.trackers = {key: IndexVersionTracker(f"{key} {name}", check_interval=check_interval) for key in cores}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def check(self, key, wait=False):
+        """
+        If the core's index version is due to be checked, check it (and rebuild if needed) in the
+          background.  With wait, wait for the check (e.g., when there's no data yet).
+        """
+        ret_val = None
+        if self.trackers[key].needs_check():
+            with self._lock:
+                ret_val = self._threads.get(key)
+                if ret_val is None and self.trackers[key].needs_check(): # (not just checked by another thread)
+                    ret_val = threading.Thread(target=self.rebuild, args=(key, ), name=f"{key} {self.name}".replace(" ", "-"), daemon=True)
+                    self._threads[key] = ret_val
+                    ret_val.start()
+            if wait and ret_val is not None:
+                ret_val.join()
+        return ret_val
+
+    def rebuild(self, key):
+        try:
+            try:
+                version = self.read_version(self.cores[key])
+            except Exception as e:
+                logger.warning(f"Can't get the {key} index version for the {self.name}: {e}")
+                version = None
+
+            try:
+                self.rebuild_core(key, version)
+            except Exception as e:
+                logger.error(f"Can't build the {key} {self.name}: {e}")
+
+            self.trackers[key].update(version)
+        finally:
+            with self._lock:
+                self._threads.pop(key, None)
+
+    def rebuild_core(self, key, version):
+        raise NotImplementedError
+
+    def load_in_background(self):
+        """
+        Start building the data for all the cores (if preload is set); returns the threads started
+        """
+        ret_val = []
+        if self.preload:
+            ret_val = [self.check(key) for key in self.cores]
+        return ret_val
+
+# Session info (models.SessionInfo) by session_id, for get_session_info; invalidated on login, logout, and session updates
+session_cache = OpasCache("session",
+                          ttl=opasConfig.SESSION_CACHE_TTL,
+                          backend=get_cache_backend("session",
+                                                    max_entries=opasConfig.SESSION_CACHE_MAX_ENTRIES,
+                                                    backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# PaDS permit decisions, keyed by session, classification and year band (see opasDocPermissions.get_permit)
+permit_cache = OpasCache("permits",
+                         ttl=opasConfig.PERMIT_CACHE_TTL,
+                         backend=get_cache_backend("permits",
+                                                   max_entries=opasConfig.PERMIT_CACHE_MAX_ENTRIES,
+                                                   backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# Search results (models.DocumentList) before per-user access checks, keyed on the query and the docs index version (see opasPySolrLib.search_text_qs)
+search_cache = OpasCache("search",
+                         ttl=opasConfig.SEARCH_CACHE_TTL,
+                         backend=get_cache_backend("search",
+                                                   max_entries=opasConfig.SEARCH_CACHE_MAX_ENTRIES,
+                                                   backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# Rendered (HTML) documents, without search hit markup, by art_id, file_last_modified, page window, options and transformer (see opasPySolrLib.get_fulltext_from_search_results)
+render_cache = OpasCache("render",
+                         ttl=opasConfig.RENDER_CACHE_TTL,
+                         backend=get_cache_backend("render",
+                                                   max_entries=opasConfig.RENDER_CACHE_MAX_ENTRIES,
+                                                   max_bytes=opasConfig.RENDER_CACHE_MAX_BYTES,
+                                                   backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# Metadata function returns (volume, contents, video and source lists), by function and arguments, and docs index version (see opasPySolrLib.metadata_cached)
+metadata_cache = OpasCache("metadata",
+                           ttl=opasConfig.METADATA_CACHE_TTL,
+                           backend=get_cache_backend("metadata",
+                                                     max_entries=opasConfig.METADATA_CACHE_MAX_ENTRIES,
+                                                     backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# Database statistics snapshot (models.ServerStatusContent), by docs index version (see opasAPISupportLib.metadata_get_database_statistics)
+stats_cache = OpasCache("stats",
+                        ttl=opasConfig.STATS_SNAPSHOT_TTL,
+                        backend=get_cache_backend("stats",
+                                                  max_entries=4,
+                                                  backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# Term counts (documents with the term), by docs index version, field and term (see opasPySolrLib.get_term_counts)
+term_count_cache = OpasCache("termcounts",
+                             ttl=opasConfig.TERM_COUNT_CACHE_TTL,
+                             backend=get_cache_backend("termcounts",
+                                                       max_entries=opasConfig.TERM_COUNT_CACHE_MAX_ENTRIES,
+                                                       backend_url=opasConfig.CACHE_SHARED_BACKEND_URL))
+
+# version of the docs core index; caches of results from the core are cleared when it changes
+docs_index_version = IndexVersionTracker("docs",
+                                         check_interval=opasConfig.SOLR_INDEX_VERSION_CHECK_INTERVAL,
+                                         caches=[search_cache, metadata_cache, stats_cache, term_count_cache])
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
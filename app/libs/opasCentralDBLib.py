@@ -50,6 +50,9 @@ __status__      = "Development"
 
 import sys
 import re
+import threading
+import queue
+import atexit
 # import fnmatch
 
 # import os.path
@@ -90,6 +93,7 @@ import requests
 import xml.etree.ElementTree as ET
 
 import models
+from opasCacheSupport import session_cache
 
 # All opasCentral Database Models here
 import modelsOpasCentralPydantic
@@ -198,13 +202,401 @@ class SourceInfoDB(object):
         retVal = dbEntry
         return retVal
 
+class opasConnectionPool(object):
+    """
+    Process wide, thread safe pool of pymysql connections to the opascentral database.
+
+    opasCentralDB.open_connection checks a connection out of the pool and close_connection
+      returns it, so the many short lived opasCentralDB objects (one or more per endpoint call)
+      reuse already authenticated connections rather than connecting each time.
+
+    Up to pool_size idle connections are kept.  Under load, up to max_overflow additional
+      connections are opened; those are closed when returned.  When everything is checked out,
+      callers wait up to checkout_timeout seconds for a connection to be returned.
+
+    Connections older than recycle_seconds are closed and replaced, and connections idle more
+      than ping_after_seconds are pinged before reuse (replaced if the ping fails).
+
+    >>> pool = opasConnectionPool(pool_size=2)
+    >>> conn = pool.checkout("doctest")
+    >>> pool.checkin(conn)
+    >>> pool.stats()["checkouts"]
+    1
+    >>> pool.dispose()
+    """
+    def __init__(self,
+                 pool_size=opasConfig.DB_POOL_SIZE,
+                 max_overflow=opasConfig.DB_POOL_MAX_OVERFLOW,
+                 checkout_timeout=opasConfig.DB_POOL_CHECKOUT_TIMEOUT,
+                 recycle_seconds=opasConfig.DB_POOL_RECYCLE_SECONDS,
+                 ping_after_seconds=opasConfig.DB_POOL_PING_AFTER_SECONDS):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.checkout_timeout = checkout_timeout
+        self.recycle_seconds = recycle_seconds
+        self.ping_after_seconds = ping_after_seconds
+        self._idle = [] # list of (connection, created_time, last_used_time); most recently used at the end
+        self._created = {} # id(connection) -> created_time for connections currently checked out
+        self._open_count = 0 # idle + checked out
+        self._cond = threading.Condition(threading.Lock())
+        # counters, to help size the pool under load
+        self.counters = {"checkouts": 0,   # successful checkouts
+                         "checkins": 0,    # connections returned
+                         "waits": 0,       # checkouts which had to wait for a returned connection
+                         "timeouts": 0,    # checkouts which gave up waiting
+                         "connects": 0,    # new connections opened (including reconnects)
+                         "reconnects": 0,  # stale or broken connections replaced
+                         "recycled": 0,    # connections closed because of age
+                         "discarded": 0,   # connections closed on checkin (overflow or broken)
+                         }
+
+    def _connect(self):
+        conn = pymysql.connect(host=localsecrets.DBHOST, port=localsecrets.DBPORT, user=localsecrets.DBUSER, password=localsecrets.DBPW, database=localsecrets.DBNAME)
+        self._count("connects")
+        return conn
+
+    def _count(self, counter_name):
+        with self._cond:
+            self.counters[counter_name] += 1
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"DB Pool: error closing connection ({e})")
+
+    def checkout(self, caller_name=""):
+        """
+        Return an open connection from the pool (or a new one if needed).
+
+        Raises an exception if the database can't be reached, or no connection frees up within
+          checkout_timeout seconds.
+        """
+        deadline = time.time() + self.checkout_timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created, last_used = self._idle.pop()
+                    break
+                if self._open_count < self.pool_size + self.max_overflow:
+                    conn = None
+                    self._open_count += 1 # reserve the slot while connecting (outside the lock)
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise TimeoutError(f"DB Pool: no connection available for ({caller_name}) after {self.checkout_timeout} seconds")
+                if not waited:
+                    self.counters["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+        now = time.time()
+        try:
+            if conn is not None:
+                if now - created > self.recycle_seconds:
+                    self._close_quietly(conn)
+                    self._count("recycled")
+                    conn = None
+                elif now - last_used > self.ping_after_seconds:
+                    try:
+                        conn.ping(reconnect=False)
+                    except Exception as e:
+                        logger.info(f"DB Pool: stale connection replaced for ({caller_name}) ({e})")
+                        self._close_quietly(conn)
+                        self._count("reconnects")
+                        conn = None
+
+            if conn is None:
+                conn = self._connect()
+                created = now
+        except Exception:
+            # give back the reserved slot
+            with self._cond:
+                self._open_count -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created[id(conn)] = created
+            self.counters["checkouts"] += 1
+
+        return conn
+
+    def checkin(self, conn):
+        """
+        Return a connection to the pool.  Any open transaction is rolled back (as it would
+          be if the connection were closed), so the next user doesn't see a stale snapshot.
+        """
+        if conn is None:
+            return
+
+        with self._cond:
+            created = self._created.pop(id(conn), None)
+            self.counters["checkins"] += 1
+
+        keep = created is not None and conn.open
+        if keep:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.debug(f"DB Pool: connection discarded on return ({e})")
+                keep = False
+
+        with self._cond:
+            if keep and len(self._idle) < self.pool_size:
+                self._idle.append((conn, created, time.time()))
+                discard = False
+            else:
+                discard = True
+                self.counters["discarded"] += 1
+                if created is not None: # connections not from this pool don't count against it
+                    self._open_count -= 1
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    def dispose(self):
+        """
+        Close all idle connections (e.g., at shutdown).  Checked out connections are closed when returned.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open_count -= len(idle)
+
+        for conn, created, last_used in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """
+        Return the pool counters plus current sizes as a dict
+        """
+        with self._cond:
+            ret_val = dict(self.counters)
+            ret_val["idle"] = len(self._idle)
+            ret_val["checked_out"] = len(self._created)
+            ret_val["open"] = self._open_count
+            ret_val["pool_size"] = self.pool_size
+            ret_val["max_overflow"] = self.max_overflow
+
+        return ret_val
+
+# the process wide pool used by all opasCentralDB objects
+db_pool = opasConnectionPool()
+
+SQL_INSERT_SESSION_ENDPOINT = """INSERT INTO
+                            api_session_endpoints(session_id,
+                                                  api_endpoint_id,
+                                                  params,
+                                                  item_of_interest,
+                                                  return_status_code,
+                                                  api_method,
+                                                  return_added_status_message
+                                                 )
+                                                 VALUES
+                                                 (%s, %s, %s, %s, %s, %s, %s)"""
+
+SQL_INSERT_DOCVIEW = """INSERT INTO
+                                api_docviews(user_id,
+                                              document_id,
+                                              session_id,
+                                              type,
+                                              datetimechar
+                                             )
+                                             VALUES
+                                              (%s, %s, %s, %s, %s)"""
+
+class opasLogWriter(object):
+    """
+    Write-behind queue for the usage logging tables (api_session_endpoints and api_docviews).
+
+    Requests put log records (sql, row tuple) on a bounded in-memory queue and return
+      immediately; a background thread writes them with executemany (which pymysql sends as
+      multi-row INSERTs) when batch_size records are waiting or the oldest has waited
+      flush_seconds.
+
+    If the queue is full, the "drop" policy discards the new record, and the "block" policy
+      waits up to block_timeout seconds for room (then drops it).
+
+    Call flush() to wait for everything queued so far to be written, and stop() at shutdown
+      (also registered with atexit).
+    """
+    _STOP = object()
+
+    def __init__(self,
+                 max_queue=opasConfig.DB_LOG_QUEUE_MAX,
+                 batch_size=opasConfig.DB_LOG_BATCH_SIZE,
+                 flush_seconds=opasConfig.DB_LOG_FLUSH_SECONDS,
+                 full_policy=opasConfig.DB_LOG_QUEUE_FULL_POLICY,
+                 block_timeout=opasConfig.DB_LOG_QUEUE_BLOCK_TIMEOUT,
+                 pool=None):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.pool = pool if pool is not None else db_pool
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self.counters = {"queued": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0}
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="opasLogWriter", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def put(self, sql, row):
+        """
+        Queue a record for writing.  Returns True if it was queued, False if it was dropped.
+        """
+        if self._stopped:
+            self.counters["dropped"] += 1
+            return False
+
+        if self._thread is None:
+            self._start()
+
+        try:
+            if self.full_policy == "block":
+                self._queue.put((sql, row), timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait((sql, row))
+        except queue.Full:
+            self.counters["dropped"] += 1
+            logger.warning(f"Log write queue full ({self._queue.maxsize}); record dropped ({row})")
+            return False
+
+        self.counters["queued"] += 1
+        return True
+
+    def flush(self, timeout=30):
+        """
+        Wait until all records queued before this call are written (or timeout seconds pass).
+        """
+        ret_val = True
+        if self._thread is not None and self._thread.is_alive():
+            done = threading.Event()
+            try:
+                self._queue.put(done, timeout=timeout)
+                ret_val = done.wait(timeout)
+            except queue.Full:
+                ret_val = False
+
+        return ret_val
+
+    def stop(self, timeout=30):
+        """
+        Write whatever is queued and stop the writer thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.flush(timeout=timeout)
+            self._stopped = True
+            try:
+                self._queue.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self._stopped = True
+
+    def stats(self):
+        ret_val = dict(self.counters)
+        ret_val["waiting"] = self._queue.qsize()
+        return ret_val
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            if batch:
+                timeout = max(0, deadline - time.time())
+            else:
+                timeout = None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._write(batch)
+                break
+            elif isinstance(item, threading.Event):
+                self._write(batch)
+                batch = []
+                item.set()
+            elif item is not None:
+                if not batch:
+                    deadline = time.time() + self.flush_seconds
+                batch.append(item)
+
+            if batch and (item is None or len(batch) >= self.batch_size or time.time() >= deadline):
+                self._write(batch)
+                batch = []
+
+    def _write(self, batch):
+        """
+        Write the batch, grouped by statement.  If a multi-row insert fails, the rows are retried
+          one at a time so one bad record (e.g., an integrity error) doesn't lose the others.
+        """
+        if not batch:
+            return
+
+        rows_by_sql = {}
+        for sql, row in batch:
+            rows_by_sql.setdefault(sql, []).append(row)
+
+        try:
+            conn = self.pool.checkout(caller_name="opasLogWriter")
+        except Exception as e:
+            self.counters["errors"] += 1
+            self.counters["dropped"] += len(batch)
+            logger.error(f"Log writer could not get a database connection; {len(batch)} records dropped ({e})")
+            return
+
+        try:
+            for sql, rows in rows_by_sql.items():
+                try:
+                    with closing(conn.cursor()) as cursor:
+                        cursor.executemany(sql, rows)
+                    conn.commit()
+                    self.counters["written"] += len(rows)
+                    self.counters["batches"] += 1
+                except Exception as e:
+                    logger.warning(f"Log writer batch insert of {len(rows)} records failed ({e}); retrying individually")
+                    conn.rollback()
+                    for row in rows:
+                        try:
+                            with closing(conn.cursor()) as cursor:
+                                cursor.execute(sql, row)
+                            conn.commit()
+                            self.counters["written"] += 1
+                        except Exception as e:
+                            conn.rollback()
+                            self.counters["errors"] += 1
+                            logger.error(f"Log writer error writing record {row}. Error: {e}")
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Log writer error ({e})")
+        finally:
+            self.pool.checkin(conn)
+
+# the process wide write-behind queue for usage logging
+log_writer = opasLogWriter()
+
 class opasCentralDB(object):
     """
     This object should be used and then discarded on an endpoint by endpoint basis in any
       multiuser mode.
-      
+
     Therefore, keeping session info in the object is ok,
-    
+
+    Database connections are not opened per object; open_connection and close_connection
+      check a connection out of, and back into, the process wide db_pool.
+
     >>> import secrets
     >>> ocd = opasCentralDB()
     >>> random_session_id = secrets.token_urlsafe(16)
@@ -245,8 +637,8 @@ class opasCentralDB(object):
         except:
             # not open reopen it.
             try:
-                self.db = pymysql.connect(host=localsecrets.DBHOST, port=localsecrets.DBPORT, user=localsecrets.DBUSER, password=localsecrets.DBPW, database=localsecrets.DBNAME)
-                logger.debug(f"Database opened by ({caller_name}) Specs: {localsecrets.DBNAME} for host {localsecrets.DBHOST},  user {localsecrets.DBUSER} port {localsecrets.DBPORT}")
+                self.db = db_pool.checkout(caller_name=caller_name)
+                logger.debug(f"Database connection checked out by ({caller_name}) Specs: {localsecrets.DBNAME} for host {localsecrets.DBHOST},  user {localsecrets.DBUSER} port {localsecrets.DBPORT}")
                 self.connected = True
             except Exception as e:
                 logger.warning(f"Database connection not opened ({caller_name}) ({e})")
@@ -255,21 +647,32 @@ class opasCentralDB(object):
         return self.connected
 
     def close_connection(self, caller_name=""):
+        """
+        Return the connection to the pool (it's only really closed if the pool is full or it's broken)
+        """
         if self.db is not None:
             try:
                 if self.db.open:
-                    self.db.close()
-                    self.db = None
-                    logger.debug(f"Database closed by ({caller_name})")
+                    logger.debug(f"Database connection returned by ({caller_name})")
                 else:
                     logger.warning(f"Database close request, but not open ({caller_name})")
-                    
+                db_pool.checkin(self.db)
             except Exception as e:
                 logger.error(f"caller: {caller_name} the db is not open ({e})")
+            self.db = None
 
         # make sure to mark the connection false in any case
         self.connected = False           
 
+    def __del__(self):
+        # don't leak pooled connections if a caller never closed (e.g., an exception path)
+        try:
+            if self.db is not None:
+                db_pool.checkin(self.db)
+                self.db = None
+        except Exception:
+            pass
+
     def end_session(self, session_id, session_end=datetime.utcfromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')):
         """
         End the session
@@ -277,6 +680,7 @@ class opasCentralDB(object):
         Tested in main instance docstring
         """
         ret_val = None
+        session_cache.delete(session_id) # the cached session info is out of date
         self.open_connection(caller_name="end_session") # make sure connection is open
         if self.db is not None:
             cursor = self.db.cursor()
@@ -873,6 +1277,42 @@ class opasCentralDB(object):
         # return session model object
         return ret_val # None or Session Object
 
+    def iter_select(self, sqlSelect: str, dict_rows=False, fetch_size=opasConfig.DB_STREAM_FETCH_SIZE):
+        """
+        Generic retrieval from database, as a generator of lists of rows (up to fetch_size rows each),
+          using an unbuffered (server side) cursor so the whole result is never held in memory.
+
+        Uses its own pooled connection, held until the generator is finished or closed, since
+          nothing else can use a connection while an unbuffered result is being read.
+
+        >>> ocd = opasCentralDB()
+        >>> rows = [row for batch in ocd.iter_select(sqlSelect="SELECT * from vw_reports_session_activity WHERE global_uid = 'nrs';", fetch_size=100) for row in batch]
+        >>> len(rows) > 1
+        True
+
+        """
+        conn = db_pool.checkout(caller_name="iter_select")
+        complete = False
+        try:
+            curs = conn.cursor(pymysql.cursors.SSDictCursor if dict_rows else pymysql.cursors.SSCursor)
+            curs.execute(sqlSelect)
+            while True:
+                rows = curs.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows
+            curs.close()
+            complete = True
+        finally:
+            if not complete:
+                # stopped early (e.g., the client went away); rather than reading the rest of
+                #  the result so the connection can be reused, close it (the pool discards it)
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.debug(f"iter_select: error closing connection ({e})")
+            db_pool.checkin(conn)
+
     def get_session_from_db(self, session_id):
         """
         Get the session record info for session sessionID
@@ -947,6 +1387,7 @@ class opasCentralDB(object):
         Update the extra fields in the session record
         """
         ret_val = None
+        session_cache.delete(session_id) # the cached session info is out of date
         self.open_connection(caller_name="update_session") # make sure connection is open
         setClause = "SET "
         added = 0
@@ -1016,6 +1457,7 @@ class opasCentralDB(object):
         
         """
         ret_val = False
+        session_cache.delete(session_id) # the cached session info is out of date
         #session = None
         if session_id is None:
             err_msg = "Parameter error: No session ID specified"
@@ -1052,6 +1494,7 @@ class opasCentralDB(object):
         Tested in main instance docstring
         """
         ret_val = False
+        session_cache.delete(session_id) # the cached session info is out of date
         if session_id is None:
             logger.warning("SaveSession: No session ID specified")
         elif session_info is None: # for now, required
@@ -1237,53 +1680,49 @@ class opasCentralDB(object):
         Track endpoint calls
         2020-08-25: Added api_endpoint_method
         
+        The record is normally queued on the log_writer (write-behind) rather than written in the
+          request; the return is then 1 if it was queued (None if dropped).
+
         Tested in main instance docstring
         """
         ret_val = None
-        if not self.open_connection(caller_name="record_session_endpoint"): # make sure connection is open
+        try:
+            session_id = session_info.session_id
+            client_id = session_info.api_client_id
+        except:
+            if self.session_id is None:
+                # no session open!
+                logger.warning("OCD: No session is open")
+                return ret_val
+            else:
+                session_id = self.session_id
+                client_id = opasConfig.NO_CLIENT_ID
+                
+        # Workaround for None in session id
+        if session_id is None:
+            session_id = opasConfig.NO_SESSION_ID # just to record it
+
+        logger.debug(f"Session ID: {session_id} (client {client_id}) accessed Session Endpoint {api_endpoint_id}")
+        # TODO: I removed returnStatusCode from here. Remove it from the DB
+        row = (session_id, 
+               api_endpoint_id, 
+               params,
+               item_of_interest,
+               return_status_code,
+               api_endpoint_method, 
+               status_message
+              )
+
+        if opasConfig.DB_LOG_WRITE_BEHIND:
+            if log_writer.put(SQL_INSERT_SESSION_ENDPOINT, row):
+                ret_val = 1
+        elif not self.open_connection(caller_name="record_session_endpoint"): # make sure connection is open
             logger.error("record_session_endpoint could not open database")
         else:
-            try:
-                session_id = session_info.session_id
-                client_id = session_info.api_client_id
-            except:
-                if self.session_id is None:
-                    # no session open!
-                    logger.warning("OCD: No session is open")
-                    return ret_val
-                else:
-                    session_id = self.session_id
-                    client_id = opasConfig.NO_CLIENT_ID
-                    
-            # Workaround for None in session id
-            if session_id is None:
-                session_id = opasConfig.NO_SESSION_ID # just to record it
-                
             if self.db is not None:  # shouldn't need this test
                 cursor = self.db.cursor()
-                # TODO: I removed returnStatusCode from here. Remove it from the DB
-                sql = """INSERT INTO 
-                            api_session_endpoints(session_id, 
-                                                  api_endpoint_id,
-                                                  params, 
-                                                  item_of_interest, 
-                                                  return_status_code,
-                                                  api_method,
-                                                  return_added_status_message
-                                                 )
-                                                 VALUES 
-                                                 (%s, %s, %s, %s, %s, %s, %s)"""
-
-                logger.debug(f"Session ID: {session_id} (client {client_id}) accessed Session Endpoint {api_endpoint_id}")
                 try:
-                    ret_val = cursor.execute(sql, (session_id, 
-                                                   api_endpoint_id, 
-                                                   params,
-                                                   item_of_interest,
-                                                   return_status_code,
-                                                   api_endpoint_method, 
-                                                   status_message
-                                                  ))
+                    ret_val = cursor.execute(SQL_INSERT_SESSION_ENDPOINT, row)
                     self.db.commit()
                     cursor.close()
                 except pymysql.IntegrityError as e:
@@ -1571,11 +2010,12 @@ class opasCentralDB(object):
         """
         Add a record to the api_doc_views table for specified view_type (Abstract, Document, PDF, PDFOriginal, or EPub)
 
+        Like record_session_endpoint, the record is normally queued on the log_writer.
+
         Tested in main instance docstring
         
         """
         ret_val = None
-        self.open_connection(caller_name="record_document_view") # make sure connection is open
         try:
             session_id = session_info.session_id
             user_id =  session_info.user_id
@@ -1585,37 +2025,30 @@ class opasCentralDB(object):
             return ret_val
         try:
             if view_type.lower() != "abstract" and view_type.lower() != "image/jpeg":
-                try:
-                    cursor = self.db.cursor()
-                    sql = """INSERT INTO 
-                                api_docviews(user_id, 
-                                              document_id, 
-                                              session_id, 
-                                              type, 
-                                              datetimechar
-                                             )
-                                             VALUES 
-                                              (%s, %s, %s, %s, %s)"""
-                    
-                    ret_val = cursor.execute(sql,
-                                            (user_id,
-                                             document_id,
-                                             session_id, 
-                                             view_type, 
-                                             datetime.utcfromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-                                             )
-                                            )
-                    self.db.commit()
-                    cursor.close()
-        
-                except Exception as e:
-                    logger.warning(f"Error saving document view: {e}")
+                row = (user_id,
+                       document_id,
+                       session_id, 
+                       view_type, 
+                       datetime.utcfromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
+                      )
+                if opasConfig.DB_LOG_WRITE_BEHIND:
+                    if log_writer.put(SQL_INSERT_DOCVIEW, row):
+                        ret_val = 1
+                else:
+                    self.open_connection(caller_name="record_document_view") # make sure connection is open
+                    try:
+                        cursor = self.db.cursor()
+                        ret_val = cursor.execute(SQL_INSERT_DOCVIEW, row)
+                        self.db.commit()
+                        cursor.close()
+                    except Exception as e:
+                        logger.warning(f"Error saving document view: {e}")
+
+                    self.close_connection(caller_name="record_document_view") # make sure connection is closed
                     
         except Exception as e:
             logger.warning(f"Error checking document view type: {e}")
 
-        self.close_connection(caller_name="record_document_view") # make sure connection is closed
-
         return ret_val
 
     #def get_user(self, username = None, user_id = None):
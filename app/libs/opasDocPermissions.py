@@ -38,6 +38,13 @@ from localsecrets import PADS_BASE_URL, PADS_TEST_ID, PADS_TEST_PW, PADS_BASED_C
 base = PADS_BASE_URL
 # base = "http://development.org:9300"
 import opasCentralDBLib
+from opasCacheSupport import session_cache, permit_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# pooled keep-alive http connections to the authserver (PaDS), shared by all requests
+pads_http = requests.Session()
+pads_http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=opasConfig.PADS_HTTP_POOL_SIZE))
+pads_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=opasConfig.PADS_HTTP_POOL_SIZE))
 
 def verify_header(request, caller_name):
     # Double Check for missing header test--ONLY checks headers, not other avenues used by find
@@ -316,6 +323,8 @@ def authserver_login(username=PADS_TEST_ID,
     """
     msg = ""
     logger.info(f"Logging in user {username} with session_id {session_id}")
+    session_cache.delete(session_id) # whatever was cached for this session is out of date
+    permit_cache.delete_prefix(f"{session_id}:")
     if session_id is not None:
         full_URL = base + f"/v1/Authenticate/" # + f"?SessionId={session_id}"
     else:
@@ -379,11 +388,15 @@ def authserver_login(username=PADS_TEST_ID,
                 pads_session_info.pads_status_response = status_code
                 pads_session_info.pads_disposition = msg 
                 
+    session_cache.delete(pads_session_info.SessionId)
+    permit_cache.delete_prefix(f"{pads_session_info.SessionId}:")
     return pads_session_info
 
 def authserver_logout(session_id, request: Request=None, response: Response=None):
     ret_val = False
     if session_id is not None:
+        session_cache.delete(session_id)
+        permit_cache.delete_prefix(f"{session_id}:")
         if response is not None:
             response.delete_cookie(key=opasConfig.OPASSESSIONID,path="/",
                                    domain=localsecrets.COOKIE_DOMAIN)
@@ -417,7 +430,7 @@ def authserver_permission_check(session_id,
     else:
         headers = None
 
-    response = requests.get(full_URL, headers=headers)
+    response = pads_http.get(full_URL, headers=headers)
     
     if response.status_code == 503:
         # PaDS down, fake it for now
@@ -450,6 +463,144 @@ def authserver_permission_check(session_id,
 
     return ret_val, ret_resp      
         
+def get_permit_cache_key(session_info, doc_id, classification, year, reason_for_check):
+    """
+    Permit decisions for a session are the same for documents of the same source (journal, book series
+      or video stream, since subscriptions are by source), classification and year band, so that's the
+      cache key (with the user and authentication status, which change at login).  Keys start with the
+      session_id, so they can be invalidated by session.
+
+    >>> session_info = models.SessionInfo(session_id="1234", authenticated=True, user_id=10)
+    >>> get_permit_cache_key(session_info, "IJP.080.0001A", "archive", 1999, opasConfig.AUTH_ABSTRACT_VIEW_REQUEST)
+    '1234:10:True:IJP:archive:1999:AbstractView'
+    """
+    try:
+        year_band = int(year) // opasConfig.PERMIT_CACHE_YEAR_BAND
+    except (TypeError, ValueError):
+        year_band = year
+
+    source_code = doc_id.split(".")[0].upper() if doc_id else None
+    ret_val = f"{session_info.session_id}:{session_info.user_id}:{session_info.authenticated}:{source_code}:{classification}:{year_band}:{reason_for_check}"
+    return ret_val
+
+def get_permit(session_info,
+               doc_id,
+               classification,
+               year,
+               reason_for_check=None,
+               request=None):
+    """
+    authserver_permission_check, through the permit cache.
+
+    Full-text (document view) checks are never cached, since PaDS tracks those requests; other
+      decisions are reused for opasConfig.PERMIT_CACHE_TTL seconds.  Exceptions (e.g., PaDS down)
+      are not cached, and are left for the caller to handle.
+    """
+    cacheable = reason_for_check != opasConfig.AUTH_DOCUMENT_VIEW_REQUEST
+    if cacheable:
+        cache_key = get_permit_cache_key(session_info, doc_id, classification, year, reason_for_check)
+        cached = permit_cache.get(cache_key)
+        if cached is not None:
+            authorized, resp = cached
+            logger.debug(f"Permit for {doc_id} from permit cache ({cache_key})")
+            return authorized, resp.copy()
+
+    authorized, resp = authserver_permission_check(session_id=session_info.session_id,
+                                                   doc_id=doc_id,
+                                                   doc_year=year,
+                                                   reason_for_check=reason_for_check,
+                                                   request=request)
+
+    if cacheable and resp is not None and resp.StatusCode in (httpCodes.HTTP_200_OK, httpCodes.HTTP_401_UNAUTHORIZED):
+        permit_cache.set(cache_key, (authorized, resp.copy()))
+
+    return authorized, resp
+
+def get_access_limitations_for_list(document_list_items,
+                                    session_info,
+                                    fulltext_request:bool=None,
+                                    request=None):
+    """
+    get_access_limitations for a page of documents (models.DocumentListItem, updated in place).
+
+    Rather than one PaDS permit request per document, one after the other, the distinct
+      permit cache keys (source, classification and year band) on the page which need a PaDS check are
+      resolved concurrently over the pooled PaDS connections; then each document's limitations
+      are filled in from the permit cache.  The first one is checked on its own, as its answer can
+      settle the rest (a 401 ends the checks for the session, and archive or current access authorizes
+      those documents without a check), so only the permits still undecided after it are requested
+      together.  So a page of results costs at most two round trips (in elapsed time), and none if
+      the decisions are already cached.
+    """
+    ret_val = document_list_items
+    filled_in = 0 # documents with their limitations filled in
+    if (session_info is not None
+        and session_info.session_id is not None
+        and not fulltext_request): # full-text checks aren't cached (see get_permit)
+        reason_for_check = opasConfig.AUTH_ABSTRACT_VIEW_REQUEST
+        to_check = _permit_checks_needed(document_list_items, session_info, reason_for_check)
+        if len(to_check) > 1:
+            filled_in = next(iter(to_check.values())) + 1
+            _fill_in_access_limitations(document_list_items[:filled_in], session_info, fulltext_request, request)
+            to_check = _permit_checks_needed(document_list_items, session_info, reason_for_check, start=filled_in)
+
+        if len(to_check) > 1:
+            ts = time.time()
+            with ThreadPoolExecutor(max_workers=opasConfig.PADS_PERMIT_FANOUT_WORKERS) as executor:
+                for pos in to_check.values():
+                    executor.submit(_prefetch_permit, session_info, document_list_items[pos], reason_for_check, request)
+            logger.debug(f"Prefetched {len(to_check)} permits for {len(document_list_items)} documents: {time.time() - ts}")
+        
+    _fill_in_access_limitations(document_list_items[filled_in:], session_info, fulltext_request, request)
+
+    return ret_val
+
+def _permit_checks_needed(document_list_items, session_info, reason_for_check, start=0):
+    """
+    The distinct permit cache keys of the documents (from position start) which need a PaDS check, given what's
+      known about the session, with the position of the first document with each, in page order
+    """
+    ret_val = {}
+    if session_info.confirmed_unauthenticated == False:
+        for pos in range(start, len(document_list_items)):
+            item = document_list_items[pos]
+            classification = item.accessClassification
+            if classification in (opasConfig.DOCUMENT_ACCESS_FREE, opasConfig.DOCUMENT_ACCESS_OFFSITE):
+                continue # decided without PaDS
+            if classification in (opasConfig.DOCUMENT_ACCESS_ARCHIVE) and session_info.authorized_peparchive:
+                continue
+            if classification in (opasConfig.DOCUMENT_ACCESS_EMBARGOED) and session_info.authorized_pepcurrent:
+                continue
+            cache_key = get_permit_cache_key(session_info, item.documentID, classification, item.year, reason_for_check)
+            if cache_key not in ret_val:
+                ret_val[cache_key] = pos
+
+    return ret_val
+
+def _fill_in_access_limitations(document_list_items, session_info, fulltext_request, request):
+    for item in document_list_items:
+        get_access_limitations(doc_id=item.documentID, 
+                               classification=item.accessClassification, 
+                               year=item.year,
+                               doi=item.doi, 
+                               session_info=session_info, 
+                               documentListItem=item,
+                               fulltext_request=fulltext_request,
+                               request=request
+                              ) # will update accessLimited fields in item
+
+def _prefetch_permit(session_info, item, reason_for_check, request):
+    try:
+        get_permit(session_info,
+                   doc_id=item.documentID,
+                   classification=item.accessClassification,
+                   year=item.year,
+                   reason_for_check=reason_for_check,
+                   request=request)
+    except Exception as e:
+        # get_access_limitations will try again, and handle it
+        logger.warning(f"Permit prefetch for {item.documentID} failed ({e})")
+
 def get_access_limitations(doc_id,
                            classification,
                            session_info,
@@ -562,11 +713,12 @@ def get_access_limitations(doc_id,
     
                     logger.debug(f"Sending permit request for {session_info.session_id}")
                     try:
-                        authorized, resp = authserver_permission_check(session_id=session_info.session_id,
-                                                                 doc_id=doc_id,
-                                                                 doc_year=year,
-                                                                 reason_for_check=reason_for_check,
-                                                                 request=request)
+                        authorized, resp = get_permit(session_info,
+                                                      doc_id=doc_id,
+                                                      classification=classification,
+                                                      year=year,
+                                                      reason_for_check=reason_for_check,
+                                                      request=request)
                     except Exception as e:
                         # PaDS could be down, local development
                         logger.error(f"PaDS Access Exception: {e}")
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasDownloadSupport
+
+Rendering of document downloads (PDF, EPUB, HTML) for the Downloads endpoint.
+
+Rendering (PDF conversion in particular) is CPU bound, so it's done in a process pool
+  rather than in the request thread.  Rendered files are kept in a cache directory
+  (opasConfig.DOWNLOAD_CACHE_PATH) by art_id, format and the source file's timestamp
+  (file_last_modified), so a repeat download is just a file returned from the cache, and
+  an updated source document is rendered again.
+
+Concurrent requests for the same download share one render (single-flight), and the
+  cache is kept under opasConfig.DOWNLOAD_CACHE_MAX_BYTES by removing the least recently
+  used files.
+
+Access checks are the caller's responsibility (see opasPySolrLib.prep_document_download);
+  the cached files don't depend on who requested them.
+
+>>> download_filename("IJP.077.0217A", "pdf")
+'IJP.077.0217A.PDF'
+>>> os.path.basename(cache_filename("IJP.077.0217A", "EPUB", "2021-01-25T10:11:12Z"))
+'IJP.077.0217A.EPUB.1108873ffaf8.epub'
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import os
+import re
+import time
+import hashlib
+import threading
+import concurrent.futures
+
+sys.path.append('../config')
+
+import opasConfig
+import opasXMLHelper as opasxmllib
+from stdMessageLib import COPYRIGHT_PAGE_HTML  # copyright page text to be inserted in ePubs and PDFs
+
+import logging
+logger = logging.getLogger(__name__)
+
+# extension of the file the client receives, by format (as the downloads were always named)
+DOWNLOAD_EXTENSIONS = {"PDF": ".PDF", "EPUB": ".epub", "HTML": ".html"}
+TEMP_SUFFIX = ".tmp"
+
+rcx_unsafe_filename_chars = re.compile(r"[^A-Za-z0-9.\-_]")
+
+def download_filename(art_id, ret_format):
+    """
+    Name of the file as the client receives it, e.g., IJP.077.0217A.PDF
+    """
+    return art_id + DOWNLOAD_EXTENSIONS[ret_format.upper()]
+
+def cache_filename(art_id, ret_format, source_timestamp, cache_path=None):
+    """
+    Path of the rendered file in the cache, by art_id, format and source file timestamp
+    """
+    if cache_path is None:
+        cache_path = opasConfig.DOWNLOAD_CACHE_PATH
+    ret_format = ret_format.upper()
+    stamp = hashlib.sha1(str(source_timestamp).encode("utf-8")).hexdigest()[:12]
+    name = rcx_unsafe_filename_chars.sub("_", art_id)
+    return os.path.join(cache_path, f"{name}.{ret_format}.{stamp}{DOWNLOAD_EXTENSIONS[ret_format]}")
+
+def add_epub_elements(html_string):
+    # for now, just return
+    return html_string
+
+#-----------------------------------------------------------------------------
+def render_document(doc_xml, art_id, ret_format, heading, output_filename):
+    """
+    Render the document to output_filename in the requested format.  Runs in a pool process.
+
+    The file is written under a temporary name and renamed when complete, so a partly
+      written file is never returned from the cache.
+    """
+    ret_format = ret_format.upper()
+    temp_filename = f"{output_filename}.{os.getpid()}{TEMP_SUFFIX}"
+    try:
+        doc_xml = opasxmllib.remove_encoding_string(doc_xml)
+        if ret_format == "HTML":
+            opasxmllib.convert_xml_to_html_file(doc_xml, output_filename=temp_filename)
+        else:
+            html_string = opasxmllib.xml_str_to_html(doc_xml)
+            html_string = re.sub(r"\[\[RunningHead\]\]", f"{heading}", html_string, count=1)
+            if ret_format == "PDF":
+                from xhtml2pdf import pisa             # for HTML 2 PDF conversion
+                html_string = re.sub("</html>", f"{COPYRIGHT_PAGE_HTML}</html>", html_string, count=1)
+                with open(temp_filename, "w+b") as result_file:
+                    # Need to fix links for graphics, e.g., see https://xhtml2pdf.readthedocs.io/en/latest/usage.html#using-xhtml2pdf-in-django
+                    pisa_status = pisa.CreatePDF(src=html_string, dest=result_file)
+                if pisa_status.err:
+                    raise ValueError(f"PDF conversion errors: {pisa_status.err}")
+            elif ret_format == "EPUB":
+                html_string = add_epub_elements(html_string)
+                opasxmllib.html_to_epub(html_string, art_id, art_id, output_filename=temp_filename)
+            else:
+                raise ValueError(f"Format {ret_format} not supported")
+
+        os.replace(temp_filename, output_filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+    return output_filename
+
+#-----------------------------------------------------------------------------
+class DownloadRenderer(object):
+    """
+    Process pool rendering downloads into the cache directory, with single-flight
+      deduplication of concurrent identical requests and size-bounded (LRU) eviction.
+    """
+    def __init__(self,
+                 cache_path=opasConfig.DOWNLOAD_CACHE_PATH,
+                 max_bytes=opasConfig.DOWNLOAD_CACHE_MAX_BYTES,
+                 min_age=opasConfig.DOWNLOAD_CACHE_MIN_AGE,
+                 workers=opasConfig.DOWNLOAD_RENDER_WORKERS,
+                 timeout=opasConfig.DOWNLOAD_RENDER_TIMEOUT):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.RLock() # reentrant: a render that's already done runs its callback (which locks) in add_done_callback
+        self._in_flight = {}
+        self.hits = 0
+        self.renders = 0
+        self.shared = 0
+        self.evictions = 0
+
+    @property
+    def pool(self):
+        # created on first use, so importing the module (or just serving other endpoints) doesn't start processes
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def get(self, doc_xml, art_id, ret_format, source_timestamp, heading=""):
+        """
+        Return the path of the rendered document, from the cache or rendered now.
+
+        Raises the rendering exception (or concurrent.futures.TimeoutError) if it couldn't be rendered.
+        """
+        filename = cache_filename(art_id, ret_format, source_timestamp, cache_path=self.cache_path)
+        with self._lock:
+            if os.path.exists(filename):
+                self.hits += 1
+                self._touch(filename)
+                return filename
+
+            future = self._in_flight.get(filename)
+            if future is None:
+                os.makedirs(self.cache_path, exist_ok=True)
+                future = self.pool.submit(render_document, doc_xml, art_id, ret_format, heading, filename)
+                self._in_flight[filename] = future
+                self.renders += 1
+                future.add_done_callback(lambda f, filename=filename: self._finished(filename))
+            else:
+                self.shared += 1
+
+        ret_val = future.result(timeout=self.timeout)
+        return ret_val
+
+    def _finished(self, filename):
+        with self._lock:
+            self._in_flight.pop(filename, None)
+        try:
+            self.evict()
+        except Exception as e:
+            logger.warning(f"Download cache eviction error: {e}")
+
+    def _touch(self, filename):
+        # the file's mtime is its last use, for LRU eviction
+        try:
+            os.utime(filename)
+        except OSError as e:
+            logger.warning(f"Can't update download cache file time {filename}: {e}")
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache is under max_bytes.
+          Files used within min_age seconds are kept, as they may still be streaming to a client.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        with os.scandir(self.cache_path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith(TEMP_SUFFIX):
+                    # left by a killed render
+                    if now - stat.st_mtime > self.timeout:
+                        os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes or now - mtime < self.min_age:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Can't remove download cache file {path}: {e}")
+                else:
+                    total -= size
+                    self.evictions += 1
+
+        return total
+
+    def stats(self):
+        return {"hits": self.hits,
+                "renders": self.renders,
+                "shared": self.shared,
+                "evictions": self.evictions,
+                "in_flight": len(self._in_flight)
+                }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+download_renderer = DownloadRenderer()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
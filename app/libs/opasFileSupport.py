@@ -15,7 +15,9 @@ __status__      = "Development"
     # 20200530 Added front matter.  Fixed doctest reference (should have been doc rather than docs)
 
 import sys
+sys.path.append('../config')
 import localsecrets
+import opasConfig
 import s3fs # https://s3fs.readthedocs.io/en/latest/api.html#s3fs.core.S3FileSystem
 import os, os.path
 import re
@@ -23,6 +25,9 @@ import boto3
 import logging
 import datetime
 import time
+import glob
+import email.utils
+import threading
 import pathlib
 
 logger = logging.getLogger(__name__)
@@ -65,17 +70,18 @@ class FileInfo(object):
         self.timestamp = datetime.datetime.strptime(self.timestamp_str, localsecrets.TIME_FORMAT_STR)
         self.date_modified = self.timestamp.date()
         # self.date_modified_str = str(self.date_modified)
-        self.etag = fileinfo.get("Etag", None)
+        self.etag = fileinfo.get("ETag", fileinfo.get("Etag", None))
     
     def mapLocalFS(self, filespec):
         self.fileinfo = {}
         self.filespec = filespec
         self.basename = self.fileinfo["base_filename"] = os.path.basename(self.filespec)
-        self.filesize = self.fileinfo["Size"] = os.path.getsize(filespec)
+        file_stat = os.stat(filespec) # one stat for size and modified date (matters when walking the whole tree)
+        self.filesize = self.fileinfo["Size"] = file_stat.st_size
         self.filetype = self.fileinfo["type"] = "xml" # fileinfo["type"]
         self.build_date = self.fileinfo["build_date"] = time.time() # current time
         # modified date
-        mod_date = self.fileinfo["fileSize"] = os.path.getmtime(filespec)
+        mod_date = self.fileinfo["fileSize"] = file_stat.st_mtime
         self.timestamp_str = self.fileinfo["LastModified"] = datetime.datetime.utcfromtimestamp(mod_date).strftime(localsecrets.TIME_FORMAT_STR)
         self.timestamp = self.fileinfo["timestamp"] = datetime.datetime.strptime(self.timestamp_str, localsecrets.TIME_FORMAT_STR)
         self.date_modified = self.fileinfo["date"] = self.timestamp.date()
@@ -352,9 +358,9 @@ class FlexFileSystem(object):
       
         return ret_val
     #-----------------------------------------------------------------------------
-    def get_file_contents(self, filespec, path=None):
+    def get_file_contents(self, filespec, path=None, binary=False):
         """
-        Return the contents of a non-binary file
+        Return the contents of a non-binary file (as bytes, without decoding, if binary is True)
 
         The current API implements this:
         
@@ -370,7 +376,9 @@ class FlexFileSystem(object):
         filespec = self.fullfilespec(filespec)
         if filespec is not None:
             try:
-                if self.fs is not None:
+                if binary:
+                    f = self.fs.open(filespec, "rb") if self.fs is not None else open(filespec, "rb")
+                elif self.fs is not None:
                     f = self.fs.open(filespec, "r", encoding="utf-8")
                 else:
                     f = open(filespec, "r", encoding="utf-8")
@@ -509,6 +517,252 @@ class FlexFileSystem(object):
         return ret_val            
     
     
+#-----------------------------------------------------------------------------
+IMAGE_EXTENSIONS = (".jpg", ".gif", ".tif") # in the order tried when the image id has no extension
+IMAGE_MEDIA_TYPES = {".jpg": "image/jpeg", ".gif": "image/gif", ".tif": "image/tiff"}
+
+class ImageInfo(object):
+    """
+    A resolved image file, with what's needed to answer conditional requests
+
+    >>> info = ImageInfo("g/AIM.036.0275A.FIG001.jpg", filesize=26038, mtime=1576177171)
+    >>> info.etag, info.last_modified, info.media_type
+    ('"5df28e13-65b6"', 'Thu, 12 Dec 2019 18:59:31 GMT', 'image/jpeg')
+    >>> info.not_modified(if_none_match='"5df28e13-65b6"')
+    True
+    >>> info.not_modified(if_modified_since='Thu, 12 Dec 2019 18:59:31 GMT')
+    True
+    >>> info.not_modified(if_none_match='"other"', if_modified_since='Thu, 12 Dec 2019 18:59:31 GMT')
+    False
+    """
+    def __init__(self, filespec, filesize, mtime, etag=None):
+        self.filespec = filespec
+        self.basename = os.path.basename(filespec)
+        self.filesize = filesize
+        self.mtime = int(mtime)
+        if etag is None: # local files, same form as nginx's
+            etag = f'"{self.mtime:x}-{filesize:x}"'
+        self.etag = etag
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.media_type = IMAGE_MEDIA_TYPES.get(os.path.splitext(filespec)[-1].lower(), "image/jpeg")
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """
+        True if the client's copy is current, per the If-None-Match or (if not given) If-Modified-Since header
+        """
+        ret_val = False
+        if if_none_match is not None:
+            etags = [tag.strip() for tag in if_none_match.split(",")]
+            ret_val = "*" in etags or self.etag in etags or f"W/{self.etag}" in etags
+        elif if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_tz(if_modified_since)
+                ret_val = since is not None and email.utils.mktime_tz(since) >= self.mtime
+            except (TypeError, ValueError, OverflowError):
+                ret_val = False
+
+        return ret_val
+
+class ImageManifest(object):
+    """
+    In-memory map of image id to ImageInfo for the images in the root folder of a FlexFileSystem,
+      so an image is resolved without going to the file system (S3) at all, rather than
+      trying the possible extensions one at a time.
+
+    Built by listing the image folder (build, at server startup), and refreshed by listing it
+      again after refresh_interval seconds (in the background).  An image that's not in the
+      manifest is looked up with a single listing (or stat) call and added, so new images are
+      found between refreshes; ids not found are remembered for miss_ttl seconds.
+
+    Image ids are matched ignoring case, with or without the extension.  As with get_image_filename,
+      an id is relative to the root folder, so images in subfolders are only found with the subfolder
+      in the id (by lookup).
+    """
+    def __init__(self, flex_fs, refresh_interval=opasConfig.IMAGE_MANIFEST_REFRESH_INTERVAL, miss_ttl=opasConfig.IMAGE_MANIFEST_MISS_TTL):
+        self.flex_fs = flex_fs
+        self.refresh_interval = refresh_interval
+        self.miss_ttl = miss_ttl
+        self.images = {}
+        self.misses = {}
+        self.built = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @staticmethod
+    def image_keys(image_name):
+        """
+        Keys for an image, from its name relative to the image folder (the image id, as requested, with the extension):
+          the name, and if it's an image extension, the name without it (and the extension's priority)
+
+        >>> ImageManifest.image_keys("AIM.036.0275A.FIG001.jpg")
+        ('AIM.036.0275A.FIG001.JPG', 'AIM.036.0275A.FIG001', 0)
+        >>> ImageManifest.image_keys("banners/bannerIJPLogo.GIF")
+        ('BANNERS/BANNERIJPLOGO.GIF', 'BANNERS/BANNERIJPLOGO', 1)
+        """
+        name = str(image_name).replace("\\", "/").upper()
+        image_id, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            return name, image_id, IMAGE_EXTENSIONS.index(ext.lower())
+        else:
+            return name, None, None
+
+    @staticmethod
+    def _add(images, info, image_name=None):
+        # image_name is relative to the image folder, by default, the file's name (a file in the folder itself)
+        name, image_id, priority = ImageManifest.image_keys(image_name if image_name is not None else info.basename)
+        images[name] = info
+        if image_id is not None:
+            current = images.get(image_id)
+            if current is None or ImageManifest.image_keys(current.filespec)[2] >= priority:
+                images[image_id] = info
+
+    def _list_images(self):
+        """
+        List the image folder (not subfolders, as get_image_filename only looks in the folder itself),
+          returning the ImageInfo for each file (one listing, paged, on S3)
+        """
+        ret_val = []
+        root = self.flex_fs.root
+        if self.flex_fs.key is not None:
+            for info in self.flex_fs.fs.ls(root, detail=True):
+                if info.get("type") == "file":
+                    ret_val.append(self._s3_image_info(info))
+        else:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        ret_val.append(ImageInfo(entry.path, stat.st_size, stat.st_mtime))
+
+        return ret_val
+
+    @staticmethod
+    def _s3_image_info(info):
+        return ImageInfo(info.get("name", info.get("Key")),
+                         info["Size"],
+                         info["LastModified"].timestamp(),
+                         etag=info.get("ETag", None))
+
+    def build(self):
+        """
+        List all the images and replace the manifest (lookups continue to use the current one meanwhile)
+        """
+        ts = time.time()
+        images = {}
+        try:
+            for info in self._list_images():
+                self._add(images, info)
+        except Exception as e:
+            logger.error(f"Image manifest build error: {e}")
+        else:
+            changed = sum(1 for key, info in images.items() if key not in self.images or self.images[key].etag != info.etag)
+            with self._lock:
+                self.images = images
+                self.misses = {}
+                self.built = time.time()
+            logger.info(f"Image manifest built: {len(images)} keys ({changed} new or changed) in {time.time() - ts:.2f} secs")
+        finally:
+            self._refreshing = False
+
+        return len(self.images)
+
+    def refresh_in_background(self):
+        """
+        Start a build in a background thread, unless one is running
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            if self.built is None:
+                self.built = time.time() # so lookups don't start more refreshes while the first build runs
+        threading.Thread(target=self.build, name="ImageManifestBuild", daemon=True).start()
+
+    def _lookup(self, image_id):
+        """
+        Find the image in the file system: one stat (info) call with an extension, one listing call without
+        """
+        ret_val = None
+        filespec = self.flex_fs.fullfilespec(filespec=image_id)
+        ext = os.path.splitext(filespec)[-1].lower()
+        try:
+            if ext in IMAGE_EXTENSIONS:
+                if self.flex_fs.key is not None:
+                    ret_val = self._s3_image_info(self.flex_fs.fs.info(filespec))
+                elif os.path.exists(filespec):
+                    stat = os.stat(filespec)
+                    ret_val = ImageInfo(filespec, stat.st_size, stat.st_mtime)
+            else:
+                if self.flex_fs.key is not None:
+                    found = [self.flex_fs.fs.info(name) for name in self.flex_fs.fs.glob(filespec + ".*")]
+                    found = [self._s3_image_info(info) for info in found]
+                else:
+                    found = [ImageInfo(name, os.stat(name).st_size, os.stat(name).st_mtime) for name in glob.glob(glob.escape(filespec) + ".*")]
+                found = [info for info in found if os.path.splitext(info.filespec)[-1].lower() in IMAGE_EXTENSIONS]
+                if found:
+                    ret_val = min(found, key=lambda info: IMAGE_EXTENSIONS.index(os.path.splitext(info.filespec)[-1].lower()))
+        except FileNotFoundError:
+            ret_val = None
+        except Exception as e:
+            logger.error(f"Image lookup error ({image_id}): {e}")
+
+        return ret_val
+
+    def get(self, image_id):
+        """
+        Return the ImageInfo for the image id (with or without extension), or None if there's no such image
+        """
+        if self.built is None or time.time() - self.built > self.refresh_interval:
+            self.refresh_in_background()
+
+        key = self.image_keys(image_id)[0]
+        ret_val = self.images.get(key)
+        if ret_val is None:
+            missed = self.misses.get(key)
+            if missed is None or time.time() - missed > self.miss_ttl:
+                ret_val = self._lookup(image_id)
+                with self._lock:
+                    if ret_val is not None:
+                        self.misses.pop(key, None)
+                        image_name = image_id
+                        if os.path.splitext(image_id)[-1].lower() not in IMAGE_EXTENSIONS:
+                            image_name += os.path.splitext(ret_val.filespec)[-1]
+                        self._add(self.images, ret_val, image_name=image_name)
+                    else:
+                        logger.warning(f"Image {image_id} not found")
+                        self.misses[key] = time.time()
+
+        return ret_val
+
+    def iter_image(self, info, chunk_size=opasConfig.IMAGE_STREAM_CHUNK_SIZE):
+        """
+        Generator of the image's bytes, in chunks (for a StreamingResponse)
+        """
+        if self.flex_fs.fs is not None:
+            f = self.flex_fs.fs.open(info.filespec, "rb")
+        else:
+            f = open(info.filespec, "rb")
+
+        with f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+image_manifest = None
+def get_image_manifest():
+    """
+    The server's image manifest (of localsecrets.IMAGE_SOURCE_PATH)
+    """
+    global image_manifest
+    if image_manifest is None:
+        flex_fs = FlexFileSystem(key=localsecrets.S3_KEY, secret=localsecrets.S3_SECRET, root=localsecrets.IMAGE_SOURCE_PATH)
+        image_manifest = ImageManifest(flex_fs)
+
+    return image_manifest
+
+#-----------------------------------------------------------------------------
 def get_s3_matching_files(bucket=None,
                           subpath_tomatch=".*",
                           is_folder=False,
@@ -563,6 +563,26 @@ def is_empty(arg):
     else:
         return False
 
+#-----------------------------------------------------------------------------
+def iter_solr_docs(solrcore, query, fl, rows=10000, sort="id asc", fq=None):
+    """
+    Generator for all the documents matching query (and the filter query fq, if any) (pysolr core),
+      fetched in pages of rows with cursorMark (deep paging), so an export of the whole core doesn't
+      get slower page by page.
+
+    The sort must include the uniqueKey field (id) for cursorMark.
+    """
+    args = {"fq": fq} if fq is not None else {}
+    cursor_mark = "*"
+    while True:
+        results = solrcore.search(query, fl=fl, rows=rows, sort=sort, cursorMark=cursor_mark, **args)
+        for doc in results.docs:
+            yield doc
+
+        if results.nextCursorMark is None or results.nextCursorMark == cursor_mark:
+            break
+        cursor_mark = results.nextCursorMark
+
 # -------------------------------------------------------------------------------------------------------
 # run it!
 
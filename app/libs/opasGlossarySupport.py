@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasGlossarySupport
+
+In-memory copy of the glossary core (pepwebglossary, the entries of the PEP Glossary, ZBK.069), so
+  glossary entry requests are answered without Solr queries.  The glossary is small, and only changes
+  when the loader runs, so it's loaded once (at server startup, see load_in_background) and reloaded
+  when the core's index version changes.
+
+Lookups return the records the Solr queries in opasAPISupportLib.documents_get_glossary_entry return:
+
+  - by ID: term_id:ID || group_id:ID (the term first, then the group's terms)
+  - by Name: term_terms:("name"), a phrase in the term
+  - by Group: group_name:("name" || "NAME" || "name") and if there are none, group_name_terms:("name")
+
+Phrase matches are ordered as Solr's scores would order them: shortest field first, then index order.
+
+>>> glossary_tokens("WHEELWRIGHT, Joseph Balch (1906-99)")
+['wheelwright', 'joseph', 'balch', '1906', '99']
+>>> glossary_phrase_in(["anxiety"], ["signal", "anxiety"])
+True
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import re
+
+sys.path.append('../config')
+
+import opasConfig
+import opasCacheSupport
+import opasPySolrLib
+from configLib.opasCoreConfig import solr_gloss2
+
+import logging
+logger = logging.getLogger(__name__)
+
+# words, as the text_simple field type's StandardTokenizer and LowerCaseFilter make them (closely enough for names)
+rcx_glossary_token = re.compile(r"\w+(?:['’]\w+)*")
+
+def glossary_tokens(text):
+    """
+    Lower case words of a term or group name, for phrase matching
+    """
+    return rcx_glossary_token.findall(text.lower()) if text else []
+
+def glossary_phrase_in(phrase_tokens, tokens):
+    """
+    True if phrase_tokens appear in tokens, in order and next to each other (a phrase query)
+    """
+    phrase_len = len(phrase_tokens)
+    if phrase_len == 0:
+        return False
+    for start in range(len(tokens) - phrase_len + 1):
+        if tokens[start:start + phrase_len] == phrase_tokens:
+            return True
+    return False
+
+class GlossaryData(object):
+    """
+    The glossary records, in core (index) order, and the lookup tables for them
+    """
+    def __init__(self, entries, version=None):
+        self.entries = entries
+        self.version = version
+        self.by_term_id = {}
+        self.by_group_id = {}
+        self.by_group_name = {}
+        self.term_tokens = []
+        self.group_name_tokens = []
+        for pos, entry in enumerate(entries):
+            self.by_term_id.setdefault(entry.get("term_id"), []).append(pos)
+            self.by_group_id.setdefault(entry.get("group_id"), []).append(pos)
+            self.by_group_name.setdefault(entry.get("group_name"), []).append(pos)
+            self.term_tokens.append(glossary_tokens(entry.get("term")))
+            self.group_name_tokens.append(glossary_tokens(entry.get("group_name")))
+
+    def phrase_matches(self, phrase, field_tokens):
+        phrase_tokens = glossary_tokens(phrase)
+        ret_val = [pos for pos, tokens in enumerate(field_tokens) if glossary_phrase_in(phrase_tokens, tokens)]
+        ret_val.sort(key=lambda pos: len(field_tokens[pos]))
+        return ret_val
+
+class GlossaryIndex(opasCacheSupport.BackgroundRebuilder):
+    """
+    The glossary core, in memory, reloaded (in the background) when the core's index version changes
+      (checked at most every check_interval seconds).
+    """
+    def __init__(self, solr_core=solr_gloss2, check_interval=opasConfig.GLOSSARY_INDEX_CHECK_INTERVAL, preload=opasConfig.GLOSSARY_INDEX_PRELOAD):
+        super().__init__("glossary index", {"gloss": solr_core}, opasPySolrLib.read_index_version, check_interval=check_interval, preload=preload)
+        self.solr_core = solr_core
+        self.data = None
+        self.loads = 0
+
+    def load(self, version=None):
+        """
+        Read all the glossary core records (in index order) and replace the in-memory glossary
+        """
+        entries = []
+        while True:
+            results = self.solr_core.search("*:*",
+                                            fl=opasConfig.GLOSSARY_ITEM_DEFAULT_FIELDS,
+                                            start=len(entries),
+                                            rows=opasConfig.GLOSSARY_INDEX_PAGE_SIZE)
+            entries.extend(results.docs)
+            if len(results.docs) == 0 or len(entries) >= results.hits:
+                break
+
+        self.data = GlossaryData(entries, version=version)
+        self.loads += 1
+        logger.info(f"Glossary index loaded: {len(entries)} records (index version {version}).")
+        return self.data
+
+    def current(self):
+        """
+        The in-memory glossary (GlossaryData), loaded or reloaded first if the core's index version
+          has changed.  None if it isn't loaded and the core can't be read.
+
+        While it's being reloaded, other requests use the copy already loaded.
+        """
+        self.check("gloss", wait=self.data is None)
+        return self.data
+
+    def rebuild_core(self, key, version):
+        # without a version to compare, reload after each check interval
+        if self.data is None or version is None or version != self.data.version:
+            self.load(version=version)
+
+    def find(self, term_id, term_id_type=None, rows=10):
+        """
+        Glossary records (dicts with the GLOSSARY_ITEM_DEFAULT_FIELDS) for a term ID, Name or Group,
+          as the Solr queries return them (at most rows, Solr's default, as the queries don't set it).
+          None if the glossary isn't available (so the caller can query Solr).
+        """
+        data = self.current()
+        if data is None:
+            return None
+
+        if term_id_type == "Name":
+            positions = data.phrase_matches(term_id, data.term_tokens)
+        elif term_id_type == "Group":
+            positions = sorted({pos for name in (term_id, term_id.upper(), term_id.lower()) for pos in data.by_group_name.get(name, [])})
+            if positions == []:
+                # no match, look in the group terms for a match
+                positions = data.phrase_matches(term_id, data.group_name_tokens)
+        else: # default is term ID
+            term_id = term_id.upper()
+            positions = data.by_term_id.get(term_id, [])
+            positions = positions + [pos for pos in data.by_group_id.get(term_id, []) if pos not in positions]
+
+        return [data.entries[pos] for pos in positions[:rows]]
+
+glossary_index = GlossaryIndex()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasLoadManifest
+
+Local (SQLite) manifest of the files opasDataLoader has loaded: filename -> size, modification
+  time (timestamp_str), content hash, and the file_last_modified value stored in Solr when the
+  contents were loaded.
+
+With the manifest and one bulk export of file_last_modified from Solr, an incremental load
+  can decide which files need to be (re)loaded without a Solr request per file, and files
+  which were only touched (new modification time, same contents) don't need to be reloaded.
+  Entries only apply while Solr still has the file_last_modified they were recorded with, so
+  a load that didn't make it to Solr isn't skipped next time.
+
+>>> manifest = LoadManifest(":memory:")
+>>> manifest.record("AIM.076.0309A(bEXP_ARCH1).XML", filesize=100, timestamp_str="2021-03-01T10:00:00Z", content_hash="abc", loaded_timestamp_str="2021-03-01T10:00:00Z")
+>>> manifest.is_unchanged("AIM.076.0309A(bEXP_ARCH1).XML", filesize=100, timestamp_str="2021-03-01T10:00:00Z", loaded_timestamp_str="2021-03-01T10:00:00Z")
+True
+>>> manifest.is_unchanged("AIM.076.0309A(bEXP_ARCH1).XML", filesize=100, timestamp_str="2021-03-02T10:00:00Z", loaded_timestamp_str="2021-03-01T10:00:00Z")
+False
+>>> manifest.has_content("AIM.076.0309A(bEXP_ARCH1).XML", filesize=100, content_hash="abc", loaded_timestamp_str="2021-03-01T10:00:00Z")
+True
+>>> manifest.has_content("AIM.076.0309A(bEXP_ARCH1).XML", filesize=100, content_hash="abc", loaded_timestamp_str="2020-01-01T10:00:00Z")
+False
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sqlite3
+import hashlib
+import datetime
+
+import logging
+logger = logging.getLogger(__name__)
+
+def content_hash(file_contents):
+    """
+    Hash of the file contents, for the manifest
+
+    >>> content_hash("<pepkbd3></pepkbd3>")
+    '09b681afda8a0be3057343c5ca36fd33352b01ee'
+    """
+    if isinstance(file_contents, str):
+        file_contents = file_contents.encode("utf8")
+
+    return hashlib.sha1(file_contents).hexdigest()
+
+class LoadManifest(object):
+    """
+    The manifest database.  Records are keyed by file basename, like the file_name field in Solr.
+    """
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        # the timeout lets two loader runs (e.g., forward and --reverse) share the manifest
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS loaded_files (
+                               filename TEXT PRIMARY KEY,
+                               filespec TEXT,
+                               filesize INTEGER,
+                               timestamp_str TEXT,
+                               content_hash TEXT,
+                               loaded_timestamp_str TEXT,
+                               updated TEXT
+                           )""")
+        self.db.commit()
+        # filename: (filesize, timestamp_str, content_hash, loaded_timestamp_str)
+        self.files = {row[0]: row[1:] for row in self.db.execute("SELECT filename, filesize, timestamp_str, content_hash, loaded_timestamp_str FROM loaded_files")}
+
+    def __len__(self):
+        return len(self.files)
+
+    def is_unchanged(self, filename, filesize, timestamp_str, loaded_timestamp_str):
+        """
+        True if the file has the size and modification time recorded when it was last loaded (or verified),
+          and what's in Solr (loaded_timestamp_str) is what was loaded then.
+        """
+        entry = self.files.get(filename)
+        return entry is not None and entry[0] == filesize and entry[1] == timestamp_str and entry[3] == loaded_timestamp_str
+
+    def has_content(self, filename, filesize, content_hash, loaded_timestamp_str):
+        """
+        True if the file has the same contents (size and hash) as when it was last loaded (or verified),
+          and what's in Solr (loaded_timestamp_str) is what was loaded then.
+        """
+        entry = self.files.get(filename)
+        return entry is not None and entry[0] == filesize and entry[2] == content_hash and entry[3] == loaded_timestamp_str
+
+    def record(self, filename, filesize, timestamp_str, content_hash, loaded_timestamp_str, filespec=None):
+        """
+        Record the file as loaded (loaded_timestamp_str is the file_last_modified written to Solr),
+          or as verified unchanged since it was loaded.
+        """
+        self.files[filename] = (filesize, timestamp_str, content_hash, loaded_timestamp_str)
+        self.db.execute("REPLACE INTO loaded_files (filename, filespec, filesize, timestamp_str, content_hash, loaded_timestamp_str, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (filename, str(filespec) if filespec is not None else None, filesize, timestamp_str, content_hash, loaded_timestamp_str,
+                         datetime.datetime.utcnow().isoformat()))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
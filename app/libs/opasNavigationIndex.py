@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasNavigationIndex
+
+In-memory ordering of the articles and volumes of each source, for the next/previous article and
+  volume links (opasPySolrLib.metadata_get_next_and_prev_articles, metadata_get_next_and_prev_vols),
+  so they're position lookups rather than Solr queries.
+
+The index is built from an export of the article level documents of the docs core.  When the core's
+  index version changes (after a load), only the volumes (issues) the loader touched are read again:
+  the loader sets the timestamp field of each document it loads, so those are the volumes with documents
+  timestamped since the latest timestamp in the index.  The whole index is rebuilt when too many volumes
+  changed, and every NAV_INDEX_FULL_REBUILD_INTERVAL seconds (to drop any volumes removed from the core).
+
+>>> docs = [("GW.016.0274A", "1993", "16", 1, False), ("GW.015.0001A", "1933", "15", 1, False), ("GW.016.0273A", "1993", "16", 1, False)]
+>>> nav = SourceNavigation("GW", docs)
+>>> [art["art_id"] if art else art for art in nav.next_and_prev_articles("GW.016.0274A")]
+['GW.016.0273A', 'GW.016.0274A', {}]
+>>> nav.next_and_prev_vols("16")
+({'value': '15', 'count': 1, 'year': '1933'}, {'value': '16', 'count': 2, 'year': '1993'}, None)
+>>> volume_sort_key("9") < volume_sort_key("10") < volume_sort_key("10S")
+True
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import re
+import time
+
+sys.path.append('../config')
+
+import opasConfig
+import opasCacheSupport
+import opasGenSupportLib as opasgenlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the documents with article navigation (level 1) or counted in their volume (not book subdocuments)
+NAV_DOC_QUERY = "art_level:1 || bk_subdoc:false"
+NAV_DOC_FIELDS = "id, art_id, art_sourcecode, art_year, art_vol, art_level, bk_subdoc, timestamp"
+
+# positions in the document tuples
+DOC_ART_ID, DOC_YEAR, DOC_VOL, DOC_LEVEL, DOC_SUBDOC = range(5)
+
+rcx_volume_number = re.compile(r"(?P<number>[0-9]+)(?P<rest>.*)")
+
+def volume_sort_key(vol):
+    """
+    Volumes in numeric order, then any others
+    """
+    m = rcx_volume_number.match(vol)
+    if m:
+        ret_val = (0, int(m.group("number")), m.group("rest"))
+    else:
+        ret_val = (1, 0, vol)
+    return ret_val
+
+class SourceNavigation(object):
+    """
+    The articles of a source in art_id order, and its volumes in volume order, with their positions,
+      from (art_id, art_year, art_vol, art_level, bk_subdoc) tuples
+    """
+    def __init__(self, source_code, docs):
+        self.source_code = source_code
+        self.docs = docs
+        self.articles = sorted([doc for doc in docs if doc[DOC_LEVEL] == 1])
+        self.article_pos = {doc[DOC_ART_ID]: pos for pos, doc in enumerate(self.articles)}
+        volumes = {}
+        for doc in docs:
+            if not doc[DOC_SUBDOC]:
+                year, count = volumes.get(doc[DOC_VOL], (doc[DOC_YEAR], 0))
+                volumes[doc[DOC_VOL]] = (min(year, doc[DOC_YEAR]), count + 1)
+        self.volumes = {vol: {"value": vol, "count": count, "year": year} for vol, (year, count) in volumes.items()}
+        self.volume_list = sorted(self.volumes, key=volume_sort_key)
+        self.volume_pos = {vol: pos for pos, vol in enumerate(self.volume_list)}
+
+    def article(self, pos):
+        doc = self.articles[pos]
+        return {"art_sourcecode": self.source_code, "art_year": doc[DOC_YEAR], "art_vol": doc[DOC_VOL], "art_id": doc[DOC_ART_ID]}
+
+    def next_and_prev_articles(self, art_id):
+        """
+        Previous, matching and next article ({} if none) in the article's volume
+        """
+        prev_art = {}
+        match_art = {}
+        next_art = {}
+        pos = self.article_pos.get(art_id)
+        if pos is not None:
+            match_art = self.article(pos)
+            if pos > 0 and self.articles[pos - 1][DOC_VOL] == match_art["art_vol"]:
+                prev_art = self.article(pos - 1)
+            if pos + 1 < len(self.articles) and self.articles[pos + 1][DOC_VOL] == match_art["art_vol"]:
+                next_art = self.article(pos + 1)
+
+        return prev_art, match_art, next_art
+
+    def next_and_prev_vols(self, source_vol):
+        """
+        Previous, matching and next volume (None if none), as dicts of the volume, its document count and year
+        """
+        prev_vol = None
+        match_vol = None
+        next_vol = None
+        pos = self.volume_pos.get(source_vol)
+        if pos is not None:
+            match_vol = dict(self.volumes[source_vol])
+            if pos > 0:
+                prev_vol = dict(self.volumes[self.volume_list[pos - 1]])
+            if pos + 1 < len(self.volume_list):
+                next_vol = dict(self.volumes[self.volume_list[pos + 1]])
+
+        return prev_vol, match_vol, next_vol
+
+class NavigationData(object):
+    def __init__(self, sources, version=None, max_timestamp=None, built=None):
+        self.sources = sources
+        self.version = version
+        self.max_timestamp = max_timestamp
+        self.built = built if built is not None else time.time()
+
+class NavigationIndex(opasCacheSupport.BackgroundRebuilder):
+    """
+    The article and volume navigation of all sources, updated in the background when the docs core's
+      index version changes (checked at most every check_interval seconds).  Until the first build,
+      get() returns None and callers use Solr.
+    """
+    def __init__(self, solr_core, read_version, check_interval=opasConfig.NAV_INDEX_CHECK_INTERVAL, preload=opasConfig.NAV_INDEX_PRELOAD):
+        super().__init__("navigation index", {"docs": solr_core}, read_version, check_interval=check_interval, preload=preload)
+        self.solr_core = solr_core
+        self.data = None
+        self.builds = 0
+        self.updates = 0
+
+    def get(self):
+        """
+        The current NavigationData (or None, if it isn't built yet)
+        """
+        self.check("docs")
+        return self.data
+
+    def rebuild_core(self, key, version):
+        data = self.data
+        if data is None or time.time() - data.built > opasConfig.NAV_INDEX_FULL_REBUILD_INTERVAL:
+            self.data = self.build(version)
+        elif version is None or version != data.version:
+            self.data = self.update(data, version)
+
+    def build(self, version=None):
+        """
+        Build the index from all the documents
+        """
+        docs_by_source = {}
+        max_timestamp = self._add_docs(docs_by_source, opasgenlib.iter_solr_docs(self.solr_core, "*:*", fl=NAV_DOC_FIELDS, rows=opasConfig.NAV_INDEX_EXPORT_PAGE_SIZE, fq=NAV_DOC_QUERY))
+        ret_val = NavigationData({source_code: SourceNavigation(source_code, docs) for source_code, docs in docs_by_source.items()},
+                                 version=version,
+                                 max_timestamp=max_timestamp)
+        self.builds += 1
+        logger.info(f"Navigation index built: {len(ret_val.sources)} sources (index version {version}).")
+        return ret_val
+
+    def update(self, data, version=None):
+        """
+        Read the volumes with documents loaded since the index was built or updated, and replace them in the index
+        """
+        if data.max_timestamp is None:
+            return self.build(version)
+
+        touched = {}
+        for doc in opasgenlib.iter_solr_docs(self.solr_core, f'timestamp:["{data.max_timestamp}" TO *]', fl="id, art_sourcecode, art_vol", rows=opasConfig.NAV_INDEX_EXPORT_PAGE_SIZE, fq=NAV_DOC_QUERY):
+            touched.setdefault(doc.get("art_sourcecode"), set()).add(doc.get("art_vol"))
+
+        if sum([len(vols) for vols in touched.values()]) > opasConfig.NAV_INDEX_MAX_INCREMENTAL_VOLUMES:
+            return self.build(version)
+
+        sources = dict(data.sources)
+        max_timestamp = data.max_timestamp
+        for source_code, vols in touched.items():
+            vol_list = " || ".join([f'"{vol}"' for vol in vols])
+            docs_by_source = {source_code: []}
+            if source_code in sources:
+                docs_by_source[source_code] = [doc for doc in sources[source_code].docs if doc[DOC_VOL] not in vols]
+            source_max_timestamp = self._add_docs(docs_by_source, opasgenlib.iter_solr_docs(self.solr_core, f'art_sourcecode:"{source_code}" && art_vol:({vol_list})', fl=NAV_DOC_FIELDS, rows=opasConfig.NAV_INDEX_EXPORT_PAGE_SIZE, fq=NAV_DOC_QUERY))
+            if source_max_timestamp is not None:
+                max_timestamp = max(max_timestamp, source_max_timestamp)
+            sources[source_code] = SourceNavigation(source_code, docs_by_source[source_code])
+
+        self.updates += 1
+        logger.info(f"Navigation index updated: {sum([len(vols) for vols in touched.values()])} volumes of {len(touched)} sources (index version {version}).")
+        return NavigationData(sources, version=version, max_timestamp=max_timestamp, built=data.built)
+
+    def _add_docs(self, docs_by_source, docs):
+        # returns the latest document timestamp
+        ret_val = None
+        for doc in docs:
+            source_code = doc.get("art_sourcecode")
+            if source_code is None or doc.get("art_id") is None or doc.get("art_vol") is None:
+                continue
+            docs_by_source.setdefault(source_code, []).append((doc.get("art_id"),
+                                                               doc.get("art_year", ""),
+                                                               doc.get("art_vol"),
+                                                               doc.get("art_level"),
+                                                               doc.get("bk_subdoc", False)))
+            timestamp = doc.get("timestamp")
+            if timestamp is not None and (ret_val is None or timestamp > ret_val):
+                ret_val = timestamp
+        return ret_val
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
@@ -15,6 +15,13 @@ __version__     = "2020.1118.1"
 __status__      = "Development"
 
 import re
+import json
+import copy
+import hashlib
+import inspect
+import functools
+import asyncio
+import concurrent.futures
 import logging
 logger = logging.getLogger(__name__)
 import time
@@ -33,10 +40,11 @@ from localsecrets import TIME_FORMAT_STR
 # from localsecrets import BASEURL, SOLRURL, SOLRUSER, SOLRPW, DEBUG_DOCUMENTS, SOLR_DEBUG, CONFIG, COOKIE_DOMAIN  
 import starlette.status as httpCodes
 from configLib.opasCoreConfig import solr_docs2, solr_authors2, solr_gloss2
+from opasSolrAsync import solr_docs_async
+from starlette.concurrency import run_in_threadpool
 import opasConfig 
 from opasConfig import KEY_SEARCH_FIELD, KEY_SEARCH_SMARTSEARCH, KEY_SEARCH_VALUE
 from configLib.opasCoreConfig import EXTENDED_CORES
-from stdMessageLib import COPYRIGHT_PAGE_HTML  # copyright page text to be inserted in ePubs and PDFs
 
 import models
 import opasCentralDBLib
@@ -46,7 +54,10 @@ import opasXMLHelper as opasxmllib
 import opasDocPermissions as opasDocPerm
 import smartsearch
 import opasQueryHelper
-from xhtml2pdf import pisa             # for HTML 2 PDF conversion
+import opasCacheSupport
+import opasDownloadSupport
+import opasTermDictionary
+import opasNavigationIndex
 
 import pysolr
 
@@ -60,6 +71,11 @@ rx_nuisance_words = f"""{opasConfig.HITMARKERSTART}(?P<word>i\.e|e\.g|a|am|an|ar
 |was|we|were|what|when|where|which|while|who|whom|why|with|would|you|your|yours|yourself|yourselves){opasConfig.HITMARKEREND}"""
 
 rcx_remove_nuisance_words = re.compile(rx_nuisance_words, flags=re.IGNORECASE)
+rcx_hit_markers = re.compile(f"{opasConfig.HITMARKERSTART}|{opasConfig.HITMARKEREND}")
+rcx_hit_terms = re.compile(f"{opasConfig.HITMARKERSTART}(?P<term>.*?){opasConfig.HITMARKEREND}", flags=re.DOTALL)
+rcx_markup = re.compile("(<[^>]*>|&#?[0-9A-Za-z]+;)") # tags, and entity and character references
+rcx_html_skip_start = re.compile("<(head|script|style)[\\s>]", flags=re.IGNORECASE)
+rcx_html_skip_end = re.compile("</(head|script|style)\\s*>", flags=re.IGNORECASE)
 
 #-----------------------------------------------------------------------------
 def remove_nuisance_word_hits(result_str):
@@ -115,6 +131,173 @@ def numbered_anchors(matchobj):
     else:
         return matchobj.group(0)
 
+#-----------------------------------------------------------------------------
+def hit_term_key(term):
+    # terms ignoring case and the whitespace between words
+    return " ".join(term.lower().split())
+
+def hit_terms_regex(terms):
+    # whole words, ignoring case; longest first, for overlapping terms
+    terms = sorted(terms, key=len, reverse=True)
+    return re.compile("(?<!\\w)(" + "|".join(["\\s+".join([re.escape(word) for word in term.split()]) for term in terms]) + ")(?!\\w)", flags=re.IGNORECASE)
+
+#-----------------------------------------------------------------------------
+def get_hit_marks(text_xml):
+    """
+    The hits marked in text_xml by Solr, as the hit terms, and for each term (see hit_term_key), the
+      numbers of its whole word occurrences in the text (not in tags or entity references) which are marked,
+      and its occurrence count.  With these, mark_hits_in_html marks the same hits in the html rendered
+      from text_xml without the markers.
+
+    Returns None if the hits can't be located that way (e.g., a hit spanning a tag).
+
+    >>> get_hit_marks("<p>Love and #@@@love@@@#, #@@@mother love@@@# &amp; #@@@amp@@@#</p>")
+    (['love', 'mother love', 'amp'], {'love': [1], 'mother love': [0], 'amp': [0]}, {'love': 2, 'mother love': 1, 'amp': 1})
+    >>> get_hit_marks("<p>#@@@mother <i>love@@@#</i></p>") is None
+    True
+    """
+    terms = {}
+    texts = []
+    marked_spans = set()
+    parts = rcx_markup.split(text_xml)
+    for n, part in enumerate(parts):
+        if n % 2 == 1: # tag or reference
+            if rcx_hit_markers.search(part):
+                return None
+            continue
+        # the text without the markers, and the spans of the hits in it
+        text = ""
+        pos = 0
+        for m in rcx_hit_terms.finditer(part):
+            term = m.group("term")
+            if rcx_hit_markers.search(part, pos, m.start()) or rcx_hit_markers.search(term) or term.strip() == "":
+                return None
+            text += part[pos:m.start()]
+            marked_spans.add((len(texts), len(text), len(text) + len(term)))
+            terms.setdefault(hit_term_key(term), term)
+            text += term
+            pos = m.end()
+        if rcx_hit_markers.search(part, pos):
+            return None
+        texts.append(text + part[pos:])
+
+    marks = {}
+    counts = {}
+    if terms:
+        rcx_terms = hit_terms_regex(terms.values())
+        marked_count = 0
+        for text_num, text in enumerate(texts):
+            for m in rcx_terms.finditer(text):
+                key = hit_term_key(m.group(0))
+                if (text_num, m.start(), m.end()) in marked_spans:
+                    marks.setdefault(key, []).append(counts.get(key, 0))
+                    marked_count += 1
+                counts[key] = counts.get(key, 0) + 1
+        if marked_count != len(marked_spans):
+            # a hit that isn't a whole word (or phrase) occurrence of its term
+            return None
+
+    return list(terms.values()), marks, counts
+
+#-----------------------------------------------------------------------------
+def mark_hits_in_html(html_str, hit_marks):
+    """
+    Mark the hits from get_hit_marks with the hit markers in the text of html rendered from the unmarked xml
+      (not in tags, entity references, or the head, scripts, or styles), so a render cached without hits
+      can be used for a search.
+
+    Returns None if the html doesn't have the same occurrences of the hit terms as the xml had, so the hits
+      can't be placed.
+
+    >>> hit_marks = get_hit_marks("<p>Tom &amp; Jerry, #@@@amp@@@# and #@@@love@@@#, loves</p>")
+    >>> mark_hits_in_html("<html><head><title>Love</title></head><p class='love'>Tom &amp; Jerry, amp and Love, loves</p></html>", hit_marks)
+    "<html><head><title>Love</title></head><p class='love'>Tom &amp; Jerry, #@@@amp@@@# and #@@@Love@@@#, loves</p></html>"
+    >>> mark_hits_in_html("<html><p>Love, love</p></html>", hit_marks) is None
+    True
+    """
+    ret_val = html_str
+    if hit_marks is not None and hit_marks[0]:
+        terms, marks, counts = hit_marks
+        rcx_terms = hit_terms_regex(terms)
+        found = {}
+        def mark_hit(m):
+            key = hit_term_key(m.group(0))
+            occurrence = found.get(key, 0)
+            found[key] = occurrence + 1
+            if occurrence in marks.get(key, []):
+                return f"{opasConfig.HITMARKERSTART}{m.group(0)}{opasConfig.HITMARKEREND}"
+            return m.group(0)
+
+        parts = rcx_markup.split(html_str)
+        skipping = False
+        for n, part in enumerate(parts):
+            if n % 2 == 1: # tag or reference
+                if rcx_html_skip_start.match(part):
+                    skipping = True
+                elif rcx_html_skip_end.match(part):
+                    skipping = False
+            elif not skipping and part != "":
+                parts[n] = rcx_terms.sub(mark_hit, part)
+
+        if found == counts:
+            ret_val = "".join(parts)
+        else:
+            ret_val = None
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def get_render_cache_key(result, page_offset, page_limit, return_options=None):
+    """
+    Render cache key for a document (or page window of it) from the search result, None if the result
+      doesn't have the file_last_modified to tell renders of different versions apart.
+
+    >>> get_render_cache_key({"art_id": "AIM.076.0309A", "file_last_modified": "2021-03-01T10:00:00Z"}, 0, None, {"Glossary": False})
+    'AIM.076.0309A|2021-03-01T10:00:00Z|0|None|glossary=False'
+    """
+    ret_val = None
+    art_id = result.get("art_id", None)
+    file_last_modified = result.get("file_last_modified", None)
+    if art_id is not None and file_last_modified is not None:
+        glossary = True
+        if return_options is not None and return_options.get("Glossary", None) == False:
+            glossary = False
+        ret_val = f"{art_id}|{file_last_modified}|{page_offset}|{page_limit}|glossary={glossary}"
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def xml_str_to_html_cached(text_xml, render_key=None, transformer_name=opasConfig.TRANSFORMER_XMLTOHTML):
+    """
+    opasxmllib.xml_str_to_html for a document, via the render cache when there's a render_key
+      (see get_render_cache_key).  The document is rendered and cached without the search hit markers,
+      and the same hits are marked in the html afterwards, so the render is reused across searches.
+      If they can't be (see get_hit_marks, mark_hits_in_html), the document is rendered with the hits.
+    """
+    if render_key is None:
+        return opasxmllib.xml_str_to_html(text_xml, transformer_name=transformer_name)
+
+    hit_marks = get_hit_marks(text_xml)
+    if hit_marks is None:
+        return opasxmllib.xml_str_to_html(text_xml, transformer_name=transformer_name)
+
+    cache_key = f"{render_key}|{transformer_name}"
+    ret_val = opasCacheSupport.render_cache.get(cache_key)
+    if ret_val is None:
+        ret_val = opasxmllib.xml_str_to_html(rcx_hit_markers.sub("", text_xml), transformer_name=transformer_name)
+        # error returns (messages, or the xml) aren't cached
+        if ret_val is not None and re.match("\\s*<!DOCTYPE html", ret_val, flags=re.IGNORECASE):
+            opasCacheSupport.render_cache.set(cache_key, ret_val)
+
+    if ret_val is not None and hit_marks[0]:
+        marked_html = mark_hits_in_html(ret_val, hit_marks)
+        if marked_html is None:
+            logger.debug(f"Hits not placed in the cached render ({render_key}); rendering with the hits.")
+            marked_html = opasxmllib.xml_str_to_html(text_xml, transformer_name=transformer_name)
+        ret_val = marked_html
+
+    return ret_val
+
 #-----------------------------------------------------------------------------
 def cleanNullTerms(dictionary):
     # one liner comprehension to clean Nones from dict:
@@ -483,14 +666,15 @@ def get_term_index(term_partial,
                    limit=opasConfig.DEFAULT_LIMIT_FOR_SOLR_RETURNS,
                    offset=0,
                    start_at=None, # a particular term to start with
-                   order="index"):
+                   order="count"):
     """
     Returns a list of matching terms from an arbitrary field in the Solr database,
       either for core "authors" or "docs" per parameter core.
       
-    IMPORTANT NOTE: : The offset is not supported by the PySolr solr library,
-                      just simulated by this call, which does not save time or memory.
-                      Instead, use start_at to specify the term to start with, using the start_at
+    Fields with a term dictionary (opasConfig.TERM_DICTIONARY_FIELDS, see opasTermDictionary) are looked up
+      in memory, with real offset paging, and the responseInfo fullCount is the number of matching terms.
+      Other fields (and all fields until the dictionaries are built) use the Solr terms handler, where
+      the offset is simulated (the terms before it are requested and skipped).
     
     You can specify more than one field at once, using a tuple, e.g.,
           resp = get_term_index("love", term_field=('title','art_kwds_str'), limit=5)
@@ -507,7 +691,8 @@ def get_term_index(term_partial,
         term_field (str): Where to look for term
         limit (int, optional): Paging mechanism, return is limited to this number of items.
         offset (int, optional): Paging mechanism, start with this item in limited return set, 0 is first item.
-        order (str, optional): Return the list in this order, per Solr documentation.  Defaults to "index", which is the Solr determined indexing order.
+        start_at (str, optional): Start with this term (rather than the first matching the prefix).
+        order (str, optional): Return the list in this order, "count" (most frequent first, the default, as for Solr's terms.sort) or "index" (sorted).
 
     Returns:
         models.termIndex: Pydantic structure (dict) for termIndex.  See models.py
@@ -519,7 +704,7 @@ def get_term_index(term_partial,
         >>> resp = get_term_index("love", term_field='text', limit=2)
         >>> resp.termIndex.responseInfo.count == 2
         True
-        >>> resp = get_term_index("love", term_field='text', limit=20, offset=5)
+        >>> resp = get_term_index("love", term_field='text', limit=20, offset=4)
         >>> resp.termIndex.responseSet[0].term
         'lovers'
         >>> resp = get_term_index("love", term_field='text', limit=20, start_at='lovet')
@@ -555,50 +740,53 @@ def get_term_index(term_partial,
     """
     ret_val = {}
 
-    def load_from_term_field(results, term_field, limit=9999, offset=0):
+    def load_term_index_items(term_counts, term_field):
         """
         to use one code base for loading from a list of term_fields in main function
         """
-        term_index_items = []
-        count = 0
-        for key, value in results[term_field]: # tuples
-            count += 1
-            if offset != 0:
-                if count < offset:
-                    continue
-    
-            if value > 0:
-                item = models.TermIndexItem(term = key, 
-                                            field = term_field,
-                                            termCount = value,
-                                            ) 
-                term_index_items.append(item)
-                logger.debug ("TermIndexInfo", item)
-        return term_index_items
+        return [models.TermIndexItem(term = key, field = term_field, termCount = value) for key, value in term_counts if value > 0]
         
     core_term_indexers = {
         "docs": solr_docs2,
         "authors": solr_authors2,
     }
 
+    term_fields = list(term_field) if isinstance(term_field, (list, tuple)) else [term_field]
+    term_partial = term_partial.lower()
+    items_by_field = {}
+    full_count = 0
     try:
         # select core
         term_index = core_term_indexers[core]
-        args = {
-            "terms.limit": limit,
-            "terms.lower": start_at,
-            "terms.lower.incl": 'true'
-        }
-        args = cleanNullTerms(args)
-        # get index data
-        results = term_index.suggest_terms(fields=term_field,
-                                           prefix=term_partial.lower(),
-                                           handler='terms',
-                                           **args
-                                          )
+        solr_fields = []
+        for term_field_member in term_fields:
+            term_dict = term_dictionaries.get(core, term_field_member)
+            if term_dict is None:
+                solr_fields.append(term_field_member)
+            else:
+                term_counts = term_dict.lookup(term_partial, offset=offset, limit=limit, order=order, start_at=start_at)
+                items_by_field[term_field_member] = load_term_index_items(term_counts, term_field_member)
+                full_count += term_dict.prefix_count(term_partial, start_at=start_at)
+
+        if solr_fields:
+            args = {
+                "terms.limit": offset + limit,
+                "terms.lower": start_at,
+                "terms.lower.incl": 'true',
+                "terms.sort": order
+            }
+            args = cleanNullTerms(args)
+            # get index data
+            results = term_index.suggest_terms(fields=solr_fields,
+                                               prefix=term_partial,
+                                               handler='terms',
+                                               **args
+                                              )
+            for term_field_member in solr_fields:
+                items_by_field[term_field_member] = load_term_index_items(results[term_field_member][offset:], term_field_member)
     except Exception as e:
         # error
-        logger.error("Specified core does not have a term index configured ({e})")
+        logger.error(f"Specified core does not have a term index configured ({e})")
 
     else:
         response_info = models.ResponseInfo( limit=limit,
@@ -612,14 +800,15 @@ def get_term_index(term_partial,
                                              )
 
         term_index_items = []
-        if isinstance(term_field, (list, tuple)):
-            for term_field_member in term_field:
-                term_index_items.extend(load_from_term_field(results, term_field_member, limit=limit, offset=offset))
-        else:
-            term_index_items.extend(load_from_term_field(results, term_field, limit=limit, offset=offset))
+        for term_field_member in term_fields:
+            term_index_items.extend(items_by_field[term_field_member])
 
         response_info.count = len(term_index_items)
-        response_info.fullCountComplete = limit >= response_info.count
+        if solr_fields:
+            response_info.fullCountComplete = limit >= response_info.count
+        else:
+            response_info.fullCount = full_count
+            response_info.fullCountComplete = offset + response_info.count >= full_count
 
         term_index_struct = models.TermIndexStruct( responseInfo = response_info, 
                                                     responseSet = term_index_items
@@ -912,31 +1101,25 @@ def search_text(query,
     return ret_val, ret_status
 
 #================================================================================================================
-def search_text_qs(solr_query_spec: models.SolrQuerySpec,
-                   extra_context_len=None,
-                   req_url: str=None,
-                   facet_limit=None,
-                   facet_offset=None, 
-                   limit=None,
-                   offset=None,
-                   mlt_count=None, # 0 turns off defaults for mlt, number overrides defaults, setting solr_query_spec is top priority
-                   sort=None, 
-                   session_info=None,
-                   solr_core="pepwebdocs", 
-                   request=None #pass around request object, needed for ip auth
-                   ):
+class SearchParamError(ValueError):
     """
-    Full-text search, via the Solr server api.
-
-    Returns a pair of values: ret_val, ret_status.  The double return value is important in case the Solr server isn't running or it returns an HTTP error.  The 
-       ret_val = a DocumentList model object
-       ret_status = a status tuple, consisting of a HTTP status code and a status mesage. Default (HTTP_200_OK, "OK")
-
+    The search parameters (query spec) couldn't be turned into Solr parameters; a bad request (400)
     """
-    ret_val = {}
-    ret_status = (200, "OK") # default is like HTTP_200_OK
-    # count_anchors = 0
 
+#-----------------------------------------------------------------------------
+def _search_text_qs_params(solr_query_spec: models.SolrQuerySpec,
+                           extra_context_len=None,
+                           req_url: str=None,
+                           limit=None,
+                           offset=None,
+                           mlt_count=None,
+                           sort=None,
+                           solr_core="pepwebdocs"
+                           ):
+    """
+    Fill in the defaults for the query spec, and return the Solr query, parameters, and (final) mlt_count
+      for search_text_qs and search_text_qs_async
+    """
     if 1:
         if solr_query_spec.solrQueryOpts is None: # initialize a new model
             solr_query_spec.solrQueryOpts = models.SolrQueryOpts()
@@ -1034,7 +1217,7 @@ def search_text_qs(solr_query_spec: models.SolrQuerySpec,
         if solr_query_spec.fullReturn: #and session_info.XXXauthenticated:
             # NOTE: we add this here, but in return data, access by document will be checked.
             if "text_xml" not in solr_query_spec.returnFields:
-                return_fields = return_fields + ", text_xml, para" #, art_excerpt, art_excerpt_xml
+                return_fields = return_fields + ", text_xml, para, art_pgmap" #, art_excerpt, art_excerpt_xml
         
         if solr_query_spec.abstractReturn:
             if "abstract_xml" not in solr_query_spec.returnFields:
@@ -1080,6 +1263,7 @@ def search_text_qs(solr_query_spec: models.SolrQuerySpec,
 
     except Exception as e:
         logger.error(f"Solr Param Assignment Error {e}")
+        raise SearchParamError(f"Search parameter error: {e}") from e
 
     # add additional facet parameters from faceSpec
     #for key, value in solr_query_spec.facetSpec.items():
@@ -1100,12 +1284,10 @@ def search_text_qs(solr_query_spec: models.SolrQuerySpec,
             except Exception as e:
                 detail=f"Bad Extended Request. Core Specification Error. {e}"
                 logger.error(detail)
-                ret_val = models.ErrorReturn(httpcode=400, error="Core specification error", error_description=detail)
             else:
                 if solr_core is None:
                     detail=f"Bad Extended Request. Unknown core specified."
                     logger.warning(detail)
-                    ret_val = models.ErrorReturn(httpcode=400, error="Core specification error", error_description=detail)
         else:
             solr_query_spec.core = "pepwebdocs"
             solr_core = solr_docs2
@@ -1115,22 +1297,24 @@ def search_text_qs(solr_query_spec: models.SolrQuerySpec,
         except Exception as e:
             detail=f"Bad Extended Request. Core Specification Error. {e}"
             logger.error(detail)
-            ret_val = models.ErrorReturn(httpcode=400, error="Core specification error", error_description=detail)
         else:
             if solr_core is None:
                 detail=f"Bad Extended Request. Unknown core specified."
                 logger.warning(detail)
-                ret_val = models.ErrorReturn(httpcode=400, error="Core specification error", error_description=detail)
 
-    try:
-        # PySolr does not like None's, so clean them
-        solr_param_dict = cleanNullTerms(solr_param_dict)
+    # PySolr does not like None's, so clean them
+    solr_param_dict = cleanNullTerms(solr_param_dict)
 
-        # SEARCH!
-        results = solr_docs2.search(query, **solr_param_dict)
-        
+    return query, solr_param_dict, mlt_count
 
-    except solr.SolrException as e:
+#-----------------------------------------------------------------------------
+def _search_text_qs_error(e, solr_param_dict=None):
+    """
+    Return the ret_val, ret_status pair for an exception from the Solr search in search_text_qs
+    """
+    ret_val = {}
+    ret_status = (200, "OK")
+    if isinstance(e, solr.SolrException):
         # TODO not sure if this exception model applies to pysolr, and no documentation on exceptions I can find.  So need to watch it.
         if e is None:
             ret_val = models.ErrorReturn(httpcode=httpCodes.HTTP_400_BAD_REQUEST, error="Solr engine returned an unknown error", error_description=f"Solr engine returned error without a reason")
@@ -1148,312 +1332,800 @@ def search_text_qs(solr_query_spec: models.SolrQuerySpec,
             logger.error(f"Solr Runtime Search Error (c): {e.httpcode}")
             logger.error(e.body)
         
-    except SAXParseException as e:
+    elif isinstance(e, SearchParamError):
+        ret_val = models.ErrorReturn(httpcode=httpCodes.HTTP_400_BAD_REQUEST, error="Search parameter error", error_description=f"{e}")
+        ret_status = (httpCodes.HTTP_400_BAD_REQUEST, e)
+
+    elif isinstance(e, SAXParseException):
         ret_val = models.ErrorReturn(httpcode=httpCodes.HTTP_400_BAD_REQUEST, error="Search syntax error", error_description=f"{e.getMessage()}")
         ret_status = (httpCodes.HTTP_400_BAD_REQUEST, e) 
         logger.error(f"Solr Runtime Search Error (parse): {ret_val}. Params sent: {solr_param_dict}")
 
-    except AttributeError as e:
+    elif isinstance(e, AttributeError):
         logger.error(f"Attribute Error: {e}")
     
-    except Exception as e:
-        try:
-            tb = sys.exc_info()[2]
-            raise ValueError(...).with_traceback(tb)
-        except Exception as e2:
-            error_code = 500
-            ret_status = (httpCodes.HTTP_500_INTERNAL_SERVER_ERROR, None)
-        else:
-            ret_status = (httpCodes.HTTP_400_BAD_REQUEST, e) # e has type <class 'solrpy.core.SolrException'>, with useful elements of httpcode, reason, and body, e.g.,
-        finally:
-            ret_val = models.ErrorReturn(httpcode=error_code, error="Search syntax error", error_description=f"There's an error in your input (no reason supplied)")
-            logger.error(f"Solr Runtime Search Error (syntax): {ret_status}. Params sent: {solr_param_dict}")
-                                
-    else: #  search was ok
+    else:
+        # e has type <class 'solrpy.core.SolrException'> or pysolr.SolrError, with useful elements of httpcode, reason, and body
+        ret_status = (httpCodes.HTTP_500_INTERNAL_SERVER_ERROR, None)
+        ret_val = models.ErrorReturn(httpcode=httpCodes.HTTP_500_INTERNAL_SERVER_ERROR, error="Search syntax error", error_description=f"There's an error in your input (no reason supplied)")
+        logger.error(f"Solr Runtime Search Error (syntax): {ret_status}. {e}. Params sent: {solr_param_dict}")
+
+    return ret_val, ret_status
+
+#-----------------------------------------------------------------------------
+def _omit_abstract(documentListItem, session_info=None):
+    """
+    True if the abstract of the (access checked) document should be replaced by the restricted message
+      for this session
+    """
+    ret_val = False
+    if opasConfig.ACCESS_ABSTRACT_RESTRICTION and documentListItem.accessLimited: # if restriction is on, AND this is restricted content
+        if session_info is not None:
+            if not session_info.authenticated:
+                # experimental - remove abstract if not authenticated, per DT's requirement
+                ret_val = True
+        else: # no session info, omit abstract
+            ret_val = True
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def _search_text_qs_results(results,
+                            solr_query_spec: models.SolrQuerySpec,
+                            mlt_count=0,
+                            req_url: str=None,
+                            session_info=None,
+                            request=None,
+                            check_access=True
+                            ):
+    """
+    Build the DocumentList for search_text_qs and search_text_qs_async from the (pysolr) search results,
+      checking access (PaDS permits) for the documents, and returning full-text where requested and permitted.
+
+    With check_access=False (not for fullReturn), the list is built without any session dependent
+      information, for the search cache; _search_text_qs_apply_access adds that for the user.
+    """
+    ret_val = {}
+    try:
+        logger.info(f"Search Ok. Result Size:{results.hits}; Search:{solr_query_spec.solrQuery.searchQ}; Filter:{solr_query_spec.solrQuery.filterQ}")
+        scopeofquery = [solr_query_spec.solrQuery.searchQ, solr_query_spec.solrQuery.filterQ]
+
+        documentItemList = []
+        rowCount = 0
+        # rowOffset = 0
+        #if solr_query_spec.fullReturn:
+            ## if we're not authenticated, then turn off the full-text request and behave as if we didn't try
+            #if not authenticated: # and file_classification != opasConfig.DOCUMENT_ACCESS_FREE:
+                ## can't bring back full-text
+                #logger.warning("Fulltext requested--by API--but not authenticated.")
+                #solr_query_spec.fullReturn = False
+                
+        # try checking PaDS for authenticated; if false, no need to check permits
         try:
-            logger.info(f"Search Ok. Result Size:{results.hits}; Search:{solr_query_spec.solrQuery.searchQ}; Filter:{solr_query_spec.solrQuery.filterQ}")
-            scopeofquery = [solr_query_spec.solrQuery.searchQ, solr_query_spec.solrQuery.filterQ]
-    
-            if ret_status[0] == 200: 
-                documentItemList = []
-                rowCount = 0
-                # rowOffset = 0
-                #if solr_query_spec.fullReturn:
-                    ## if we're not authenticated, then turn off the full-text request and behave as if we didn't try
-                    #if not authenticated: # and file_classification != opasConfig.DOCUMENT_ACCESS_FREE:
-                        ## can't bring back full-text
-                        #logger.warning("Fulltext requested--by API--but not authenticated.")
-                        #solr_query_spec.fullReturn = False
-                        
-                # try checking PaDS for authenticated; if false, no need to check permits
+            if session_info is not None:
+                if session_info.authenticated == False:
+                    logger.debug("User is not authenticated.  Permit optimization enabled.")
+                else:
+                    logger.debug("User is authenticated.  Permit optimization disabled.")
+            else: # no session info provided.  Set it to defaults, non-authenticated
+                logger.debug("No session info object provided.")
+                
+        except Exception as e:
+            #  no session info...what to do?
+            logger.debug(f"No session info to perform optimizations {e}")
+            
+        record_count = len(results.docs)
+        document_list_items = []
+        for result in results.docs:
+            # authorIDs = result.get("art_authors", None)
+            documentListItem = models.DocumentListItem()
+            documentListItem = opasQueryHelper.get_base_article_info_from_search_result(result, documentListItem)
+            document_list_items.append(documentListItem)
+
+        # sometimes, we don't need to check permissions
+        # Always check if fullReturn is selected
+        # Don't check when it's not and a large number of records are requested (but if fullreturn is requested, must check)
+        if check_access and (record_count < opasConfig.MAX_RECORDS_FOR_ACCESS_INFO_RETURN or solr_query_spec.fullReturn):
+            # checks the whole page at once, so permits are requested together (and cached)
+            opasDocPerm.get_access_limitations_for_list(document_list_items,
+                                                        session_info=session_info, 
+                                                        fulltext_request=solr_query_spec.fullReturn,
+                                                        request=request
+                                                       ) # will updated accessLimited fields in each documentListItem
+
+        for result, documentListItem in zip(results.docs, document_list_items):
+            # reset anchor counts for full-text markup re.sub
+            # count_anchors = 0
+            documentID = documentListItem.documentID
+            documentListItem.score = result.get("score", None)               
+            try:
+                text_xml = results.highlighting[documentID].get("text_xml", None)
+                if text_xml == []:
+                    text_xml = None
+            except:
+                text_xml = None
+
+            if text_xml is None: # try getting it from para
                 try:
-                    if session_info is not None:
-                        if session_info.authenticated == False:
-                            logger.debug("User is not authenticated.  Permit optimization enabled.")
-                        else:
-                            logger.debug("User is authenticated.  Permit optimization disabled.")
-                    else: # no session info provided.  Set it to defaults, non-authenticated
-                        logger.debug("No session info object provided.")
-                        
-                except Exception as e:
-                    #  no session info...what to do?
-                    logger.debug(f"No session info to perform optimizations {e}")
-                    
-                for result in results.docs:
-                    # reset anchor counts for full-text markup re.sub
-                    # count_anchors = 0
-                    record_count = len(results.docs)
-                    # authorIDs = result.get("art_authors", None)
-                    documentListItem = models.DocumentListItem()
-                    documentListItem = opasQueryHelper.get_base_article_info_from_search_result(result, documentListItem)
-                    documentID = documentListItem.documentID
-                    # sometimes, we don't need to check permissions
-                    # Always check if fullReturn is selected
-                    # Don't check when it's not and a large number of records are requested (but if fullreturn is requested, must check)
-                    if record_count < opasConfig.MAX_RECORDS_FOR_ACCESS_INFO_RETURN or solr_query_spec.fullReturn:
-                        #print(f"Precheck: Session info archive access: {session_info.authorized_peparchive}")
-                        opasDocPerm.get_access_limitations( doc_id=documentListItem.documentID, 
-                                                            classification=documentListItem.accessClassification, 
-                                                            year=documentListItem.year,
-                                                            doi=documentListItem.doi, 
-                                                            session_info=session_info, 
-                                                            documentListItem=documentListItem,
-                                                            fulltext_request=solr_query_spec.fullReturn,
-                                                            request=request
-                                                           ) # will updated accessLimited fields in documentListItem
-                        #print(f"Postcheck: Session info archive access: {session_info.authorized_peparchive}")
-    
-                    documentListItem.score = result.get("score", None)               
+                    text_xml = results.highlighting[documentID].get("para", None)
+                except:
                     try:
-                        text_xml = results.highlighting[documentID].get("text_xml", None)
-                        if text_xml == []:
-                            text_xml = None
+                        text_xml = result["text_xml"]
                     except:
-                        text_xml = None
-    
-                    if text_xml is None: # try getting it from para
-                        try:
-                            text_xml = results.highlighting[documentID].get("para", None)
-                        except:
-                            try:
-                                text_xml = result["text_xml"]
-                            except:
-                                text_xml = result.get("para", None)
-    
-                    #if text_xml is None: # PySolrLib doesn't put text in highlight unless there was a term search, so get it here.
-                        #text_xml = result.get("text_xml", None)
-    
-                    if text_xml is not None and type(text_xml) != list:
-                        text_xml = [text_xml]
-    
-                    # do this before we potentially clear text_xml if no full text requested below
-                    if solr_query_spec.abstractReturn:
-                        omit_abstract = False
-                        if opasConfig.ACCESS_ABSTRACT_RESTRICTION and documentListItem.accessLimited: # if restriction is on, AND this is restricted content
-                            if session_info is not None:
-                                if not session_info.authenticated:
-                                    # experimental - remove abstract if not authenticated, per DT's requirement
-                                    omit_abstract = True
-                            else: # no session info, omit abstract
-                                omit_abstract = True
-                        
-                        documentListItem = opasQueryHelper.get_excerpt_from_search_result(result,
-                                                                                          documentListItem,
-                                                                                          solr_query_spec.returnFormat,
-                                                                                          omit_abstract=omit_abstract)
-    
-                    documentListItem.kwic = "" # need this, so it doesn't default to Nonw
-                    documentListItem.kwicList = []
-                    # no kwic list when full-text is requested.
-                    kwic_list = []
-                    kwic = ""  # this has to be "" for PEP-Easy, or it hits an object error.                      if text_xml is not None and not solr_query_spec.fullReturn and solr_query_spec.solrQueryOpts.hl == 'true':
-                        #kwicList = getKwicList(textXml, extraContextLen=extraContextLen)  # returning context matches as a list, making it easier for clients to work with
-                        kwic_list = []
-                        for n in text_xml:
-                            # strip all tags
-                            match = opasxmllib.xml_string_to_text(n)
-                            # change the tags the user told Solr to use to the final output tags they want
-                            #   this is done to use non-xml-html hit tags, then convert to that after stripping the other xml-html tags
-                            # this function changes variable count_anchors with the count of changes
-                            match = re.sub(opasConfig.HITMARKERSTART, opasConfig.HITMARKERSTART_OUTPUTHTML, match)
-                            match = re.sub(opasConfig.HITMARKEREND, opasConfig.HITMARKEREND_OUTPUTHTML, match)
-                            kwic_list.append(match)
-    
-                        kwic = " . . . ".join(kwic_list)  # how its done at GVPi, for compatibility (as used by PEPEasy)
-                        # we don't need fulltext
-                        text_xml = None
-                        #print ("Document Length: {}; Matches to show: {}".format(len(textXml), len(kwicList)))
-                    #else: # either fulltext requested, or no document, we don't need kwic
-                        #kwic_list = []
-                        #kwic = ""  # this has to be "" for PEP-Easy, or it hits an object error.  
-    
-                    if kwic != "": documentListItem.kwic = kwic
-                    if kwic_list != []: documentListItem.kwicList = kwic_list
-    
-                    # see if this article is an offsite article
-                    offsite = result.get("art_offsite", False)
-                    # ########################################################################
-                    # This is the room where where full-text return HAPPENS
-                    # ########################################################################
-                    if solr_query_spec.fullReturn and not documentListItem.accessLimited and not offsite:
-                        documentListItem.term = f"SearchHits({solr_query_spec.solrQuery.searchQ})"
-                        documentListItem = get_fulltext_from_search_results(result=result,
-                                                                            text_xml=text_xml,
-                                                                            format_requested=solr_query_spec.returnFormat,
-                                                                            return_options=solr_query_spec.returnOptions, 
-                                                                            page=solr_query_spec.page,
-                                                                            page_offset=solr_query_spec.page_offset,
-                                                                            page_limit=solr_query_spec.page_limit,
-                                                                            documentListItem=documentListItem)
-
-                        #  test remove glossary..for my tests, not for stage/production code.
-                        # Note: the question mark before the first field in search= matters
-                        #  e.g., http://development.org:9100/v2/Documents/Document/JCP.001.0246A/?return_format=XML&search=%27?fulltext1="Evenly%20Suspended%20Attention"~25&limit=10&facetmincount=1&facetlimit=15&sort=score%20desc%27
-                        # documentListItem.document = opasxmllib.xml_remove_tags_from_xmlstr(documentListItem.document,['impx'])
-                        if documentListItem.document == None:
-                            errmsg = f"Document fetch failed! ({solr_query_spec.solrQuery.searchQ}"
-                            logger.error(errmsg)
-                            documentListItem.termCount = 0
-                        
-                    else: # by virtue of not calling that...
-                        # no full-text if accessLimited or offsite article
-                        # free up some memory, since it may be large
-                        result["text_xml"] = None                   
-    
-                    stat = {}
-                    count_all = result.get("art_cited_all", None)
-                    if count_all is not None:
-                        stat["art_cited_5"] = result.get("art_cited_5", None)
-                        stat["art_cited_10"] = result.get("art_cited_10", None)
-                        stat["art_cited_20"] = result.get("art_cited_20", None)
-                        stat["art_cited_all"] = count_all
-    
-                    count0 = result.get("art_views_lastcalyear", 0)
-                    count1 = result.get("art_views_lastweek", 0)
-                    count2 = result.get("art_views_last1mos", 0)
-                    count3 = result.get("art_views_last6mos", 0)
-                    count4 = result.get("art_views_last12mos", 0)
-    
-                    if count0 + count1 + count2 + count3+ count4 > 0:
-                        stat["art_views_lastcalyear"] = count0
-                        stat["art_views_lastweek"] = count1
-                        stat["art_views_last1mos"] = count2
-                        stat["art_views_last6mos"] = count3
-                        stat["art_views_last12mos"] = count4
-    
-                    if stat == {}:
-                        stat = None
-    
-                    documentListItem.stat = stat
-    
-                    similarityMatch = None
-                    if mlt_count > 0:
-                        if results.raw_response["moreLikeThis"][documentID] is not None:
-                            similarityMatch = {}
-                            # remove text
-                            similarityMatch["similarDocs"] = {}
-                            similarityMatch["similarDocs"][documentID] = []
-                            for n in results.raw_response["moreLikeThis"][documentID]["docs"]:
-                                likeThisListItem = models.DocumentListItem()
-                                #n["text_xml"] = None
-                                n = opasQueryHelper.get_base_article_info_from_search_result(n, likeThisListItem)                    
-                                similarityMatch["similarDocs"][documentID].append(n)
-    
-                            similarityMatch["similarMaxScore"] = results.raw_response["moreLikeThis"][documentID]["maxScore"]
-                            similarityMatch["similarNumFound"] = results.raw_response["moreLikeThis"][documentID]["numFound"]
-                            # documentListItem.moreLikeThis = results.moreLikeThis[documentID]
-    
-                    if similarityMatch is not None: documentListItem.similarityMatch = similarityMatch
-                    
-                    #parent_tag = result.get("parent_tag", None)
-                    #if parent_tag is not None:
-                        #documentListItem.docChild = {}
-                        #documentListItem.docChild["id"] = result.get("id", None)
-                        #documentListItem.docChild["parent_tag"] = parent_tag
-                        #documentListItem.docChild["para"] = result.get("para", None)
-                        #documentListItem.docChild["lang"] = result.get("lang", None)
-                        #documentListItem.docChild["para_art_id"] = result.get("para_art_id", None)
-                    #else:
-                        #documentListItem.docChild = None
-    
-                    sort_field = None
-                    if solr_query_spec.solrQuery.sort is not None:
-                        try:
-                            sortby = re.search("(?P<field>[a-z_]+[1-9][0-9]?)[ ]*?", solr_query_spec.solrQuery.sort)
-                        except Exception as e:
-                            sort_field = None
-                        else:
-                            if sortby is not None:
-                                sort_field = sortby.group("field")
-    
-                    documentListItem.score = result.get("score", None)
-                    documentListItem.rank = rowCount + 1
-                    if sort_field is not None:
-                        if sort_field == "art_cited_all":
-                            documentListItem.rank = result.get("art_cited_all", None) 
-                        elif sort_field == "score":
-                            documentListItem.rank = result.get("score", None)
-                        else:
-                            documentListItem.rank = result.get(sort_field, None)
-                            
-                            
-                    rowCount += 1
-                    # add it to the set!
-                    documentItemList.append(documentListItem)
-                    #TODO - we probably don't need this.
-                    if solr_query_spec.limit is not None:
-                        if rowCount > solr_query_spec.limit:
-                            break
-    
+                        text_xml = result.get("para", None)
+
+            #if text_xml is None: # PySolrLib doesn't put text in highlight unless there was a term search, so get it here.
+                #text_xml = result.get("text_xml", None)
+
+            if text_xml is not None and type(text_xml) != list:
+                text_xml = [text_xml]
+
+            # do this before we potentially clear text_xml if no full text requested below
+            if solr_query_spec.abstractReturn:
+                omit_abstract = check_access and _omit_abstract(documentListItem, session_info)
+                documentListItem = opasQueryHelper.get_excerpt_from_search_result(result,
+                                                                                  documentListItem,
+                                                                                  solr_query_spec.returnFormat,
+                                                                                  omit_abstract=omit_abstract)
+
+            documentListItem.kwic = "" # need this, so it doesn't default to Nonw
+            documentListItem.kwicList = []
+            # no kwic list when full-text is requested.
+            kwic_list = []
+            kwic = ""  # this has to be "" for PEP-Easy, or it hits an object error.  
+            if text_xml is not None and not solr_query_spec.fullReturn and solr_query_spec.solrQueryOpts.hl == 'true':
+                #kwicList = getKwicList(textXml, extraContextLen=extraContextLen)  # returning context matches as a list, making it easier for clients to work with
+                kwic_list = []
+                for n in text_xml:
+                    # strip all tags
+                    match = opasxmllib.xml_string_to_text(n)
+                    # change the tags the user told Solr to use to the final output tags they want
+                    #   this is done to use non-xml-html hit tags, then convert to that after stripping the other xml-html tags
+                    # this function changes variable count_anchors with the count of changes
+                    match = re.sub(opasConfig.HITMARKERSTART, opasConfig.HITMARKERSTART_OUTPUTHTML, match)
+                    match = re.sub(opasConfig.HITMARKEREND, opasConfig.HITMARKEREND_OUTPUTHTML, match)
+                    kwic_list.append(match)
+
+                kwic = " . . . ".join(kwic_list)  # how its done at GVPi, for compatibility (as used by PEPEasy)
+                # we don't need fulltext
+                text_xml = None
+                #print ("Document Length: {}; Matches to show: {}".format(len(textXml), len(kwicList)))
+            #else: # either fulltext requested, or no document, we don't need kwic
+                #kwic_list = []
+                #kwic = ""  # this has to be "" for PEP-Easy, or it hits an object error.  
+
+            if kwic != "": documentListItem.kwic = kwic
+            if kwic_list != []: documentListItem.kwicList = kwic_list
+
+            # see if this article is an offsite article
+            offsite = result.get("art_offsite", False)
+            # ########################################################################
+            # This is the room where where full-text return HAPPENS
+            # ########################################################################
+            if solr_query_spec.fullReturn and not documentListItem.accessLimited and not offsite:
+                documentListItem.term = f"SearchHits({solr_query_spec.solrQuery.searchQ})"
+                documentListItem = get_fulltext_from_search_results(result=result,
+                                                                    text_xml=text_xml,
+                                                                    format_requested=solr_query_spec.returnFormat,
+                                                                    return_options=solr_query_spec.returnOptions, 
+                                                                    page=solr_query_spec.page,
+                                                                    page_offset=solr_query_spec.page_offset,
+                                                                    page_limit=solr_query_spec.page_limit,
+                                                                    documentListItem=documentListItem)
+
+                #  test remove glossary..for my tests, not for stage/production code.
+                # Note: the question mark before the first field in search= matters
+                #  e.g., http://development.org:9100/v2/Documents/Document/JCP.001.0246A/?return_format=XML&search=%27?fulltext1="Evenly%20Suspended%20Attention"~25&limit=10&facetmincount=1&facetlimit=15&sort=score%20desc%27
+                # documentListItem.document = opasxmllib.xml_remove_tags_from_xmlstr(documentListItem.document,['impx'])
+                if documentListItem.document == None:
+                    errmsg = f"Document fetch failed! ({solr_query_spec.solrQuery.searchQ}"
+                    logger.error(errmsg)
+                    documentListItem.termCount = 0
+                
+            else: # by virtue of not calling that...
+                # no full-text if accessLimited or offsite article
+                # free up some memory, since it may be large
+                result["text_xml"] = None                   
+
+            stat = {}
+            count_all = result.get("art_cited_all", None)
+            if count_all is not None:
+                stat["art_cited_5"] = result.get("art_cited_5", None)
+                stat["art_cited_10"] = result.get("art_cited_10", None)
+                stat["art_cited_20"] = result.get("art_cited_20", None)
+                stat["art_cited_all"] = count_all
+
+            count0 = result.get("art_views_lastcalyear", 0)
+            count1 = result.get("art_views_lastweek", 0)
+            count2 = result.get("art_views_last1mos", 0)
+            count3 = result.get("art_views_last6mos", 0)
+            count4 = result.get("art_views_last12mos", 0)
+
+            if count0 + count1 + count2 + count3+ count4 > 0:
+                stat["art_views_lastcalyear"] = count0
+                stat["art_views_lastweek"] = count1
+                stat["art_views_last1mos"] = count2
+                stat["art_views_last6mos"] = count3
+                stat["art_views_last12mos"] = count4
+
+            if stat == {}:
+                stat = None
+
+            documentListItem.stat = stat
+
+            similarityMatch = None
+            if mlt_count > 0:
+                if results.raw_response["moreLikeThis"][documentID] is not None:
+                    similarityMatch = {}
+                    # remove text
+                    similarityMatch["similarDocs"] = {}
+                    similarityMatch["similarDocs"][documentID] = []
+                    for n in results.raw_response["moreLikeThis"][documentID]["docs"]:
+                        likeThisListItem = models.DocumentListItem()
+                        #n["text_xml"] = None
+                        n = opasQueryHelper.get_base_article_info_from_search_result(n, likeThisListItem)                    
+                        similarityMatch["similarDocs"][documentID].append(n)
+
+                    similarityMatch["similarMaxScore"] = results.raw_response["moreLikeThis"][documentID]["maxScore"]
+                    similarityMatch["similarNumFound"] = results.raw_response["moreLikeThis"][documentID]["numFound"]
+                    # documentListItem.moreLikeThis = results.moreLikeThis[documentID]
+
+            if similarityMatch is not None: documentListItem.similarityMatch = similarityMatch
+            
+            #parent_tag = result.get("parent_tag", None)
+            #if parent_tag is not None:
+                #documentListItem.docChild = {}
+                #documentListItem.docChild["id"] = result.get("id", None)
+                #documentListItem.docChild["parent_tag"] = parent_tag
+                #documentListItem.docChild["para"] = result.get("para", None)
+                #documentListItem.docChild["lang"] = result.get("lang", None)
+                #documentListItem.docChild["para_art_id"] = result.get("para_art_id", None)
+            #else:
+                #documentListItem.docChild = None
+
+            sort_field = None
+            if solr_query_spec.solrQuery.sort is not None:
                 try:
-                    facet_counts = {}
-                    facets = results.facets["facet_fields"]
-                    facet_counts["facet_fields"] = facet_processing(facets)
+                    sortby = re.search("(?P<field>[a-z_]+[1-9][0-9]?)[ ]*?", solr_query_spec.solrQuery.sort)
+                except Exception as e:
+                    sort_field = None
+                else:
+                    if sortby is not None:
+                        sort_field = sortby.group("field")
+
+            documentListItem.score = result.get("score", None)
+            documentListItem.rank = rowCount + 1
+            if sort_field is not None:
+                if sort_field == "art_cited_all":
+                    documentListItem.rank = result.get("art_cited_all", None) 
+                elif sort_field == "score":
+                    documentListItem.rank = result.get("score", None)
+                else:
+                    documentListItem.rank = result.get(sort_field, None)
                     
-                except:
-                    facet_counts = None
-    
-            if req_url is None:
-                req_url = solr_query_spec.urlRequest
-    
-            # Moved this down here, so we can fill in the Limit, Page and Offset fields based on whether there
-            #  was a full-text request with a page offset and limit
-            # Solr search was ok
-            responseInfo = models.ResponseInfo(count = len(results.docs),
-                                               fullCount = results.hits,
-                                               totalMatchCount = results.hits,
-                                               description=solr_query_spec.solrQuery.semanticDescription, 
-                                               limit = solr_query_spec.limit,
-                                               offset = solr_query_spec.offset,
-                                               page = solr_query_spec.page, 
-                                               listType="documentlist",
-                                               scopeQuery=[scopeofquery], 
-                                               fullCountComplete = solr_query_spec.limit >= results.hits,
-                                               solrParams = None, # results._params,
-                                               facetCounts=facet_counts,
-                                               #authenticated=authenticated, 
-                                               request=f"{req_url}",
-                                               core=solr_query_spec.core, 
-                                               timeStamp = datetime.utcfromtimestamp(time.time()).strftime(TIME_FORMAT_STR)                     
-                                               )
-   
-            # responseInfo.count = len(documentItemList)
-    
-            documentListStruct = models.DocumentListStruct( responseInfo = responseInfo, 
-                                                            responseSet = documentItemList
-                                                            )
-    
-            documentList = models.DocumentList(documentList = documentListStruct)
-    
-            ret_val = documentList
+                    
+            rowCount += 1
+            # add it to the set!
+            documentItemList.append(documentListItem)
+            #TODO - we probably don't need this.
+            if solr_query_spec.limit is not None:
+                if rowCount > solr_query_spec.limit:
+                    break
+
+        try:
+            facet_counts = {}
+            facets = results.facets["facet_fields"]
+            facet_counts["facet_fields"] = facet_processing(facets)
             
+        except:
+            facet_counts = None
+
+        if req_url is None:
+            req_url = solr_query_spec.urlRequest
+
+        # Moved this down here, so we can fill in the Limit, Page and Offset fields based on whether there
+        #  was a full-text request with a page offset and limit
+        # Solr search was ok
+        responseInfo = models.ResponseInfo(count = len(results.docs),
+                                           fullCount = results.hits,
+                                           totalMatchCount = results.hits,
+                                           description=solr_query_spec.solrQuery.semanticDescription, 
+                                           limit = solr_query_spec.limit,
+                                           offset = solr_query_spec.offset,
+                                           page = solr_query_spec.page, 
+                                           listType="documentlist",
+                                           scopeQuery=[scopeofquery], 
+                                           fullCountComplete = solr_query_spec.limit >= results.hits,
+                                           solrParams = None, # results._params,
+                                           facetCounts=facet_counts,
+                                           #authenticated=authenticated, 
+                                           request=f"{req_url}",
+                                           core=solr_query_spec.core, 
+                                           timeStamp = datetime.utcfromtimestamp(time.time()).strftime(TIME_FORMAT_STR)                     
+                                           )
+
+        # responseInfo.count = len(documentItemList)
+
+        documentListStruct = models.DocumentListStruct( responseInfo = responseInfo, 
+                                                        responseSet = documentItemList
+                                                        )
+
+        documentList = models.DocumentList(documentList = documentListStruct)
+
+        ret_val = documentList
+        
+    except Exception as e:
+        logger.error(f"Problem with query results processing {e}")
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def _search_text_qs_apply_access(document_list,
+                                 solr_query_spec: models.SolrQuerySpec,
+                                 req_url: str=None,
+                                 session_info=None,
+                                 request=None
+                                 ):
+    """
+    Return a copy of a session independent DocumentList (from _search_text_qs_results with check_access=False,
+      e.g., from the search cache) with the access information for this session, and the abstracts
+      of restricted documents replaced, as _search_text_qs_results does when it checks access.
+    """
+    ret_val = document_list.copy(deep=True)
+    document_list_items = ret_val.documentList.responseSet
+    if len(document_list_items) < opasConfig.MAX_RECORDS_FOR_ACCESS_INFO_RETURN:
+        opasDocPerm.get_access_limitations_for_list(document_list_items,
+                                                    session_info=session_info, 
+                                                    fulltext_request=solr_query_spec.fullReturn,
+                                                    request=request
+                                                   ) # will updated accessLimited fields in each documentListItem
+
+    if solr_query_spec.abstractReturn:
+        for documentListItem in document_list_items:
+            if documentListItem.abstract is not None and _omit_abstract(documentListItem, session_info):
+                # the excerpt itself isn't used when the abstract is omitted
+                opasQueryHelper.get_excerpt_from_search_result({"art_excerpt": ""},
+                                                               documentListItem,
+                                                               solr_query_spec.returnFormat,
+                                                               omit_abstract=True)
+
+    if req_url is None:
+        req_url = solr_query_spec.urlRequest
+
+    response_info = ret_val.documentList.responseInfo
+    response_info.request = f"{req_url}"
+    response_info.timeStamp = datetime.utcfromtimestamp(time.time()).strftime(TIME_FORMAT_STR)
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def _search_cache_key(query, solr_param_dict, solr_query_spec: models.SolrQuerySpec, mlt_count, index_version):
+    """
+    Search cache key: everything the (session independent) results depend on, i.e., the query sent to Solr,
+      the spec (normalized by _search_text_qs_params, less the request url and label), and the index version.
+      None if the search can't be cached.
+    """
+    ret_val = None
+    if index_version is not None and not solr_query_spec.fullReturn and opasConfig.SEARCH_CACHE_TTL > 0:
+        key_data = {"q": query,
+                    "params": solr_param_dict,
+                    "spec": solr_query_spec.dict(exclude={"urlRequest", "label"}),
+                    "mlt_count": mlt_count,
+                    "index_version": index_version
+                    }
+        key_str = json.dumps(key_data, sort_keys=True, default=str)
+        ret_val = hashlib.sha1(key_str.encode("utf8")).hexdigest()
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def read_index_version(solr_core):
+    """
+    Index version and generation of a (pysolr) core from its replication handler, as "version.generation";
+      both change whenever a commit changes the index.  Raises an exception if it can't be read.
+    """
+    response = solr_core.get_session().get(solr_core.url.rstrip("/") + "/replication",
+                                           params={"command": "indexversion", "wt": "json"},
+                                           auth=solr_core.auth,
+                                           timeout=solr_core.timeout)
+    response.raise_for_status()
+    decoded = response.json()
+    return f"{decoded['indexversion']}.{decoded['generation']}"
+
+# in-process term dictionaries for get_term_index (WordWheel), rebuilt when a core's index version changes
+term_dictionaries = opasTermDictionary.TermDictionaries(cores={"docs": solr_docs2, "authors": solr_authors2},
+                                                        read_version=read_index_version)
+
+# in-memory next/previous article and volume navigation, updated when the docs core index version changes
+navigation_index = opasNavigationIndex.NavigationIndex(solr_docs2, read_version=read_index_version)
+
+#-----------------------------------------------------------------------------
+def get_docs_index_version():
+    """
+    Return the docs core index version (see opasCacheSupport.IndexVersionTracker), reading it
+      from the Solr replication handler when it's due to be checked.  None if it can't be read.
+    """
+    tracker = opasCacheSupport.docs_index_version
+    if tracker.needs_check():
+        version = None
+        try:
+            version = read_index_version(solr_docs2)
         except Exception as e:
-            logger.error(f"Problem with query results processing {e}")
-            
+            logger.warning(f"Can't get the docs index version; search results won't be cached: {e}")
+
+        tracker.update(version)
+
+    return tracker.version
+
+#-----------------------------------------------------------------------------
+async def get_docs_index_version_async():
+    """
+    get_docs_index_version for the async endpoints
+    """
+    tracker = opasCacheSupport.docs_index_version
+    if tracker.needs_check():
+        version = None
+        try:
+            version = await solr_docs_async.index_version()
+        except Exception as e:
+            logger.warning(f"Can't get the docs index version; search results won't be cached: {e}")
+
+        tracker.update(version)
+
+    return tracker.version
+
+#-----------------------------------------------------------------------------
+def metadata_cached(func):
+    """
+    Decorator for the metadata functions (volume, contents, video and source lists), whose
+      returns only change when the loader updates the docs index: returns are kept in
+      opasCacheSupport.metadata_cache by function, arguments and docs index version.
+
+    req_url isn't part of the key; the cached return's responseInfo.request is set to the
+      caller's.  Callers get a copy, so they can change it.  Error returns aren't cached.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        index_version = get_docs_index_version()
+        if index_version is None or not opasConfig.METADATA_CACHE_TTL:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        req_url = arguments.pop("req_url", None)
+        arg_key = hashlib.sha1(json.dumps(arguments, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        cache_key = f"{func.__name__}.{index_version}.{arg_key}"
+        ret_val = opasCacheSupport.metadata_cache.get(cache_key)
+        if ret_val is None:
+            ret_val = func(*args, **kwargs)
+            if not _metadata_is_error(ret_val):
+                opasCacheSupport.metadata_cache.set(cache_key, ret_val)
+
+        ret_val = copy.deepcopy(ret_val)
+        if req_url is not None:
+            _metadata_set_request(ret_val, req_url)
+
+        return ret_val
+
+    return wrapper
+
+def _metadata_is_error(ret_val):
+    if ret_val is None or isinstance(ret_val, models.ErrorReturn):
+        return True
+    if isinstance(ret_val, tuple): # metadata_get_videos: total_count, source_info_dblist, ret_val, return_status
+        return any(isinstance(item, models.ErrorReturn) for item in ret_val) or ret_val[-1] != (200, "OK")
+    return False
+
+def _metadata_set_request(ret_val, req_url):
+    # e.g., ret_val.volumeList.responseInfo.request
+    for field in getattr(ret_val, "__fields__", {}):
+        response_info = getattr(getattr(ret_val, field, None), "responseInfo", None)
+        if response_info is not None:
+            response_info.request = f"{req_url}"
+
+#-----------------------------------------------------------------------------
+rcx_term_wildcard = re.compile(".*[\*\?\.].*")
+rcx_term_wildcard_to_regex = re.compile("(?P<lead>[^\.])(?P<wildc>[\*\?])")
+
+def term_count_items(term_specs):
+    """
+    Parse (field, term) specs for the term count functions into (field, kind, term) items,
+      in order and without duplicates.  A term can be a comma separated list; wildcard
+      terms (* and ?) are converted to a regex (kind "regex"), others are exact terms (kind "term").
+
+    >>> term_count_items([("text", "Mother, father"), ("text", "mother"), ("title", "m?th*")])
+    [('text', 'term', 'mother'), ('text', 'term', 'father'), ('title', 'regex', 'm.?th.*')]
+    """
+    ret_val = []
+    for field, term in term_specs:
+        for n in term.split(","):
+            n = n.strip("'\" ")
+            if n == "":
+                continue
+            if rcx_term_wildcard.match(n):
+                item = (field, "regex", rcx_term_wildcard_to_regex.sub("\g<lead>.\g<wildc>", n))
+            else:
+                item = (field, "term", n.lower())
+            if item not in ret_val:
+                ret_val.append(item)
+
+    return ret_val
+
+def _term_count_cache_key(index_version, item, wildcard_match_limit):
+    field, kind, term = item
+    if kind == "regex":
+        return f"{index_version}.{field}.{kind}.{wildcard_match_limit}.{term}"
+    return f"{index_version}.{field}.{kind}.{term}"
+
+def _term_count_plan(term_specs, index_version, wildcard_match_limit):
+    """
+    Returns the items (see term_count_items), the counts already in the term count cache
+      by item, and the Solr /terms requests, as (field, items, params), for the rest: one
+      terms.list request per field for the exact terms, and a terms.regex request per wildcard term.
+    """
+    items = term_count_items(term_specs)
+    resolved = {}
+    if index_version is not None and opasConfig.TERM_COUNT_CACHE_TTL:
+        for item in items:
+            value = opasCacheSupport.term_count_cache.get(_term_count_cache_key(index_version, item, wildcard_match_limit))
+            if value is not None:
+                resolved[item] = value
+
+    requests = []
+    term_lists = {}
+    for item in items:
+        field, kind, term = item
+        if item in resolved:
+            continue
+        elif kind == "term":
+            term_lists.setdefault(field, []).append(item)
+        else:
+            requests.append((field, [item], {"terms.regex": term.lower(),
+                                             "terms.limit": wildcard_match_limit,
+                                             "terms.mincount": 1,
+                                             "terms.sort": "count"  # wildcard, pick highest
+                                             }))
+
+    list_requests = [(field, field_items, {"terms.list": ",".join([term for (f, kind, term) in field_items]),
+                                           "terms.limit": len(field_items),
+                                           "terms.mincount": 1
+                                           }) for field, field_items in term_lists.items()]
+
+    return items, resolved, list_requests + requests
+
+def _term_count_result(items, resolved, requests, results, index_version, wildcard_match_limit):
+    """
+    Combine the cached counts and the /terms request results into {field: {term: count}},
+      adding the new counts to the term count cache.
+    """
+    for (field, request_items, params), result in zip(requests, results):
+        values = dict(result.get(field, []))
+        for item in request_items:
+            field, kind, term = item
+            if kind == "term":
+                resolved[item] = values.get(term, 0)
+            else:
+                resolved[item] = values
+            if index_version is not None and opasConfig.TERM_COUNT_CACHE_TTL:
+                opasCacheSupport.term_count_cache.set(_term_count_cache_key(index_version, item, wildcard_match_limit), resolved[item])
+
+    ret_val = {}
+    for item in items:
+        field, kind, term = item
+        counts = ret_val.setdefault(field, {})
+        if kind == "term":
+            if resolved[item] > 0:
+                counts[term] = resolved[item]
+        else:
+            term_wild = term.replace(".", "")
+            counts.update({f"{key}({term_wild})": value for (key, value) in resolved[item].items()})
+            counts[f"Total({term_wild})>="] = sum(resolved[item].values())
+
+    return ret_val
+
+def _term_count_error(e):
+    logger.warning(f"Term count error (Solr): {e}")
+    return models.ErrorReturn(httpcode=httpCodes.HTTP_400_BAD_REQUEST, error="Search syntax error (Solr)", error_description="There's an error in your search input.")
+
+def get_term_counts(term_specs, wildcard_match_limit=4):
+    """
+    Number of documents with each term, for a list of (field, term) specs, as {field: {term: count}}.
+      Terms with no documents are left out.  A term can be a comma separated list of terms, and
+      wildcard terms (* and ?) return the wildcard_match_limit most frequent matches, keyed
+      term(wildcard term), plus their total, keyed Total(wildcard term)>=.
+
+    The exact terms for a field are counted with one Solr terms.list request, and the wildcard
+      terms' regex requests are run concurrently.  Counts are kept in opasCacheSupport.term_count_cache
+      by docs index version.
+
+    Returns models.ErrorReturn if Solr returns an error.
+    """
+    index_version = get_docs_index_version()
+    items, resolved, requests = _term_count_plan(term_specs, index_version, wildcard_match_limit)
+    try:
+        if len(requests) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(requests), opasConfig.TERM_COUNT_MAX_CONCURRENCY)) as executor:
+                results = list(executor.map(lambda request: solr_docs2.suggest_terms(request[0], "", **request[2]), requests))
+        else:
+            results = [solr_docs2.suggest_terms(field, "", **params) for (field, request_items, params) in requests]
+    except pysolr.SolrError as e:
+        ret_val = _term_count_error(e)
+    else:
+        ret_val = _term_count_result(items, resolved, requests, results, index_version, wildcard_match_limit)
+
+    return ret_val
+
+async def get_term_counts_async(term_specs, wildcard_match_limit=4):
+    """
+    get_term_counts for the async endpoints; the Solr requests are awaited together (opasSolrAsync)
+    """
+    index_version = await get_docs_index_version_async()
+    items, resolved, requests = _term_count_plan(term_specs, index_version, wildcard_match_limit)
+    try:
+        results = await asyncio.gather(*[solr_docs_async.suggest_terms(field, "", **params) for (field, request_items, params) in requests])
+    except pysolr.SolrError as e:
+        ret_val = _term_count_error(e)
+    else:
+        ret_val = _term_count_result(items, resolved, requests, results, index_version, wildcard_match_limit)
+
+    return ret_val
+
+#-----------------------------------------------------------------------------
+def search_text_qs(solr_query_spec: models.SolrQuerySpec,
+                   extra_context_len=None,
+                   req_url: str=None,
+                   facet_limit=None,
+                   facet_offset=None, 
+                   limit=None,
+                   offset=None,
+                   mlt_count=None, # 0 turns off defaults for mlt, number overrides defaults, setting solr_query_spec is top priority
+                   sort=None, 
+                   session_info=None,
+                   solr_core="pepwebdocs", 
+                   request=None #pass around request object, needed for ip auth
+                   ):
+    """
+    Full-text search, via the Solr server api.
+
+    Returns a pair of values: ret_val, ret_status.  The double return value is important in case the Solr server isn't running or it returns an HTTP error.  The 
+       ret_val = a DocumentList model object
+       ret_status = a status tuple, consisting of a HTTP status code and a status mesage. Default (HTTP_200_OK, "OK")
+
+    Except for full-text returns, results are cached (opasCacheSupport.search_cache) without the session dependent
+      access information, keyed on the query and the Solr index version; access is then checked for each user.
+
+    """
+    ret_val = {}
+    ret_status = (200, "OK") # default is like HTTP_200_OK
+    solr_param_dict = None
+    cache_key = None
+    cached_list = None
+    try:
+        query, solr_param_dict, mlt_count = _search_text_qs_params(solr_query_spec,
+                                                                   extra_context_len=extra_context_len,
+                                                                   req_url=req_url,
+                                                                   limit=limit,
+                                                                   offset=offset,
+                                                                   mlt_count=mlt_count,
+                                                                   sort=sort,
+                                                                   solr_core=solr_core)
+        if not solr_query_spec.fullReturn:
+            cache_key = _search_cache_key(query, solr_param_dict, solr_query_spec, mlt_count, get_docs_index_version())
+            if cache_key is not None:
+                cached_list = opasCacheSupport.search_cache.get(cache_key)
+
+        if cached_list is None:
+            # SEARCH!
+            results = solr_docs2.search(query, **solr_param_dict)
+    except Exception as e:
+        ret_val, ret_status = _search_text_qs_error(e, solr_param_dict)
+    else: #  search was ok
+        if cache_key is None:
+            ret_val = _search_text_qs_results(results,
+                                              solr_query_spec,
+                                              mlt_count=mlt_count,
+                                              req_url=req_url,
+                                              session_info=session_info,
+                                              request=request)
+        else:
+            if cached_list is None:
+                cached_list = _search_text_qs_results(results,
+                                                      solr_query_spec,
+                                                      mlt_count=mlt_count,
+                                                      req_url=req_url,
+                                                      check_access=False)
+                if cached_list != {}:
+                    opasCacheSupport.search_cache.set(cache_key, cached_list)
+
+            if cached_list != {}:
+                ret_val = _search_text_qs_apply_access(cached_list,
+                                                       solr_query_spec,
+                                                       req_url=req_url,
+                                                       session_info=session_info,
+                                                       request=request)
+
+    return ret_val, ret_status
+
+#-----------------------------------------------------------------------------
+async def search_text_qs_async(solr_query_spec: models.SolrQuerySpec,
+                               extra_context_len=None,
+                               req_url: str=None,
+                               facet_limit=None,
+                               facet_offset=None, 
+                               limit=None,
+                               offset=None,
+                               mlt_count=None, # 0 turns off defaults for mlt, number overrides defaults, setting solr_query_spec is top priority
+                               sort=None, 
+                               session_info=None,
+                               solr_core="pepwebdocs", 
+                               request=None #pass around request object, needed for ip auth
+                               ):
+    """
+    search_text_qs for the async endpoints: the Solr query is awaited (opasSolrAsync), so other requests
+      are served while Solr works, and the results processing, which checks permits with PaDS
+      and may read full-text, runs in the threadpool.
+
+    Same arguments and (ret_val, ret_status) return, and search cache use, as search_text_qs.
+    """
+    ret_val = {}
+    ret_status = (200, "OK") # default is like HTTP_200_OK
+    solr_param_dict = None
+    cache_key = None
+    cached_list = None
+    try:
+        query, solr_param_dict, mlt_count = _search_text_qs_params(solr_query_spec,
+                                                                   extra_context_len=extra_context_len,
+                                                                   req_url=req_url,
+                                                                   limit=limit,
+                                                                   offset=offset,
+                                                                   mlt_count=mlt_count,
+                                                                   sort=sort,
+                                                                   solr_core=solr_core)
+        if not solr_query_spec.fullReturn:
+            cache_key = _search_cache_key(query, solr_param_dict, solr_query_spec, mlt_count, await get_docs_index_version_async())
+            if cache_key is not None:
+                cached_list = opasCacheSupport.search_cache.get(cache_key)
+
+        if cached_list is None:
+            # SEARCH!
+            results = await solr_docs_async.search(query, **solr_param_dict)
+    except Exception as e:
+        ret_val, ret_status = _search_text_qs_error(e, solr_param_dict)
+    else: #  search was ok
+        if cache_key is None:
+            ret_val = await run_in_threadpool(_search_text_qs_results,
+                                              results,
+                                              solr_query_spec,
+                                              mlt_count=mlt_count,
+                                              req_url=req_url,
+                                              session_info=session_info,
+                                              request=request)
+        else:
+            if cached_list is None:
+                cached_list = await run_in_threadpool(_search_text_qs_results,
+                                                      results,
+                                                      solr_query_spec,
+                                                      mlt_count=mlt_count,
+                                                      req_url=req_url,
+                                                      check_access=False)
+                if cached_list != {}:
+                    opasCacheSupport.search_cache.set(cache_key, cached_list)
+
+            if cached_list != {}:
+                ret_val = await run_in_threadpool(_search_text_qs_apply_access,
+                                                  cached_list,
+                                                  solr_query_spec,
+                                                  req_url=req_url,
+                                                  session_info=session_info,
+                                                  request=request)
 
     return ret_val, ret_status
 
 #-----------------------------------------------------------------------------
+@metadata_cached
 def metadata_get_videos(src_type=None, pep_code=None, limit=opasConfig.DEFAULT_LIMIT_FOR_METADATA_LISTS, offset=0, sort_field="art_citeas_xml"):
     """
     Fill out a sourceInfoDBList which can be used for a getSources return, but return individual 
@@ -1529,6 +2201,7 @@ def metadata_get_videos(src_type=None, pep_code=None, limit=opasConfig.DEFAULT_L
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
+@metadata_cached
 def metadata_get_contents(pep_code, #  e.g., IJP, PAQ, CPS
                           year="*",
                           vol="*",
@@ -1976,6 +2649,7 @@ def metadata_get_next_and_prev_articles(art_id=None,
     ({}, {}, {})
     
     New: 2020-11-17      
+    Uses the navigation index (opasNavigationIndex) once it's built; until then, Solr.
     """
     # returns multiple gw's and se's, 139 unique volumes counting those (at least in 2020)
     # works for journal, videostreams have more than one year per vol.
@@ -1987,47 +2661,52 @@ def metadata_get_next_and_prev_articles(art_id=None,
     prev_art = {}
     match_art = {}
     
-    query = "art_level:1 "
-    if source_code is not None and source_code.isalpha():
-        query += f" && art_sourcecode:{source_code}"
+    navigation = navigation_index.get()
+    if navigation is not None:
+        # from the navigation index (see opasNavigationIndex)
+        source_navigation = navigation.sources.get(source_code)
+        if source_navigation is not None:
+            prev_art, match_art, next_art = source_navigation.next_and_prev_articles(art_id)
+    else:
+        query = "art_level:1 "
+        if source_code is not None and source_code.isalpha():
+            query += f" && art_sourcecode:{source_code}"
 
-    if source_vol is not None and source_vol.isalnum():
-        query += f" && art_vol:{source_vol}"
+        if source_vol is not None and source_vol.isalnum():
+            query += f" && art_vol:{source_vol}"
         
-    if source_year is not None and source_year.isalnum():
-        query += f" && art_year:{source_year}"
+        if source_year is not None and source_year.isalnum():
+            query += f" && art_year:{source_year}"
         
-    try:
-        logger.info(f"Solr Query: q={query}")
-        args = {
-            "fl": distinct_return,
-            "fq": "*:*",
-            "sort": "art_id asc",
-            "rows": 200
-        }
+        try:
+            logger.info(f"Solr Query: q={query}")
+            args = {
+                "fl": distinct_return,
+                "fq": "*:*",
+                "sort": "art_id asc",
+                "rows": 200
+            }
 
-        results = solr_docs2.search(query, **args)
+            results = solr_docs2.search(query, **args)
 
-    except Exception as e:
-        logger.error(f"Error: {e}")
-    else:
-        # find the doc
-        count = 0
-        for n in results.docs:
-            if n["art_id"] == art_id:
-                # we found it
-                match_art = n
-                try:
-                    prev_art = results.docs[count-1]
-                except:
-                    prev_art = {}
-                try:
-                    next_art = results.docs[count+1]
-                except:
-                    next_art = {}
-            else:
-                count += 1
-                continue
+        except Exception as e:
+            logger.error(f"Error: {e}")
+        else:
+            # find the doc
+            count = 0
+            for n in results.docs:
+                if n["art_id"] == art_id:
+                    # we found it
+                    match_art = n
+                    if count > 0: # (docs[-1] would be the last article)
+                        prev_art = results.docs[count-1]
+                    try:
+                        next_art = results.docs[count+1]
+                    except:
+                        next_art = {}
+                else:
+                    count += 1
+                    continue
     
     return prev_art, match_art, next_art
 #-----------------------------------------------------------------------------
@@ -2042,7 +2721,7 @@ def metadata_get_next_and_prev_vols(source_code=None,
     New: 2020-11-17
 
     >>> metadata_get_next_and_prev_vols(source_code="APA", source_vol="66")
-    ({'value': '65', 'count': 89, 'year': '2017'}, {'value': '66', 'count': 95, 'year': '2018'}, {'value': '67', 'count': 88, 'year': 'APA'})
+    ({'value': '65', 'count': 89, 'year': '2017'}, {'value': '66', 'count': 95, 'year': '2018'}, {'value': '67', 'count': 88, 'year': '2019'})
     
     >>> metadata_get_next_and_prev_vols(source_code="GW", source_vol="16")
     ({'value': '15', 'count': 1, 'year': '1933'}, {'value': '16', 'count': 1, 'year': '1993'}, None)
@@ -2056,6 +2735,7 @@ def metadata_get_next_and_prev_vols(source_code=None,
     >>> metadata_get_next_and_prev_vols(source_code="GW", source_vol=16)
     ({'value': '15', 'count': 1, 'year': '1933'}, {'value': '16', 'count': 1, 'year': '1993'}, None)
 
+    Uses the navigation index (opasNavigationIndex) once it's built; until then, Solr.
     """  
     distinct_return = "art_sourcecode, art_year, art_vol"
     next_vol = None
@@ -2071,68 +2751,75 @@ def metadata_get_next_and_prev_vols(source_code=None,
         if source_vol is None:
             logger.error("No vol number provided;")
         else:
-            source_vol_int = int(source_vol)
-            next_source_vol_int = source_vol_int + 1
-            prev_source_vol_int = source_vol_int - 1
-            try:
-                logger.info(f"Solr Query: q={query}")
-                facet_fields = ["art_vol", "art_sourcecode"]
-                facet_pivot_fields = "art_sourcecode,art_year,art_vol" # important ...no spaces!
-                query += f" && art_vol:({source_vol} || {next_source_vol_int} || {prev_source_vol_int})"
+            navigation = navigation_index.get()
+            if navigation is not None:
+                # from the navigation index (see opasNavigationIndex)
+                source_navigation = navigation.sources.get(source_code)
+                if source_navigation is not None:
+                    prev_vol, match_vol, next_vol = source_navigation.next_and_prev_vols(str(source_vol))
+            else:
+                source_vol_int = int(source_vol)
+                next_source_vol_int = source_vol_int + 1
+                prev_source_vol_int = source_vol_int - 1
+                try:
+                    logger.info(f"Solr Query: q={query}")
+                    facet_fields = ["art_vol", "art_sourcecode"]
+                    facet_pivot_fields = "art_sourcecode,art_year,art_vol" # important ...no spaces!
+                    query += f" && art_vol:({source_vol} || {next_source_vol_int} || {prev_source_vol_int})"
         
-                args = {
-                    "fl": distinct_return,
-                    "fq": "*:*",
-                    "sort": "art_sourcecode asc, art_year asc",
-                    "facet": "on", 
-                    "facet.fields" : facet_fields, 
-                    "facet.pivot" : facet_pivot_fields,
-                    "facet.mincount" : 1,
-                    "facet.sort" : "art_year asc", 
-                    #"rows": limit,
-                    #"start": offset
-                }
+                    args = {
+                        "fl": distinct_return,
+                        "fq": "*:*",
+                        "sort": "art_sourcecode asc, art_year asc",
+                        "facet": "on", 
+                        "facet.fields" : facet_fields, 
+                        "facet.pivot" : facet_pivot_fields,
+                        "facet.mincount" : 1,
+                        "facet.sort" : "art_year asc", 
+                        #"rows": limit,
+                        #"start": offset
+                    }
         
-                results = solr_docs2.search(query, **args)
-                logger.info(f"Solr Query: q={query}")
-                facet_pivot = results.facets["facet_pivot"][facet_pivot_fields]
-                #ret_val = [(piv['value'], [n["value"] for n in piv["pivot"]]) for piv in facet_pivot]
-            except Exception as e:
-                logger.error(f"Error: {e}")
-            else:
-                prev_vol = None
-                match_vol = None
-                next_vol = None
-                if facet_pivot != []:
-                    next_vol_idx = None
-                    prev_vol_idx = None
-                    match_vol_idx = None
-                    pivot_len = len(facet_pivot[0]['pivot'])
-                    counter = 0
-                    for n in facet_pivot[0]['pivot']:
-                        if n['pivot'][0]['value'] == str(source_vol):
-                            match_vol_idx = counter
-                            match_vol = n['pivot'][0]
-                            match_vol_year = n['value']
-                            match_vol['year'] = match_vol_year
-                        counter += 1
+                    results = solr_docs2.search(query, **args)
+                    logger.info(f"Solr Query: q={query}")
+                    facet_pivot = results.facets["facet_pivot"][facet_pivot_fields]
+                    #ret_val = [(piv['value'], [n["value"] for n in piv["pivot"]]) for piv in facet_pivot]
+                except Exception as e:
+                    logger.error(f"Error: {e}")
+                else:
+                    prev_vol = None
+                    match_vol = None
+                    next_vol = None
+                    if facet_pivot != []:
+                        next_vol_idx = None
+                        prev_vol_idx = None
+                        match_vol_idx = None
+                        pivot_len = len(facet_pivot[0]['pivot'])
+                        counter = 0
+                        for n in facet_pivot[0]['pivot']:
+                            if n['pivot'][0]['value'] == str(source_vol):
+                                match_vol_idx = counter
+                                match_vol = n['pivot'][0]
+                                match_vol_year = n['value']
+                                match_vol['year'] = match_vol_year
+                            counter += 1
         
-                    if match_vol_idx is not None:
-                        if match_vol_idx > 0:
-                            prev_vol_idx = match_vol_idx - 1
-                            prev_vol = facet_pivot[0]['pivot'][prev_vol_idx]
-                            prev_vol_year = prev_vol['value']
-                            prev_vol = prev_vol['pivot'][0]
-                            prev_vol['year'] = prev_vol_year
+                        if match_vol_idx is not None:
+                            if match_vol_idx > 0:
+                                prev_vol_idx = match_vol_idx - 1
+                                prev_vol = facet_pivot[0]['pivot'][prev_vol_idx]
+                                prev_vol_year = prev_vol['value']
+                                prev_vol = prev_vol['pivot'][0]
+                                prev_vol['year'] = prev_vol_year
                             
-                        if match_vol_idx < pivot_len - 1:
-                            next_vol_idx = match_vol_idx + 1
-                            next_vol = facet_pivot[0]['pivot'][next_vol_idx]
-                            next_vol_year = facet_pivot[0]['value']
-                            next_vol = next_vol['pivot'][0]
-                            next_vol['year'] = next_vol_year
-                    else:
-                        logger.warning("No volume to assess: ", match_vol_idx)
+                            if match_vol_idx < pivot_len - 1:
+                                next_vol_idx = match_vol_idx + 1
+                                next_vol = facet_pivot[0]['pivot'][next_vol_idx]
+                                next_vol_year = next_vol['value']
+                                next_vol = next_vol['pivot'][0]
+                                next_vol['year'] = next_vol_year
+                        else:
+                            logger.warning("No volume to assess: ", match_vol_idx)
                         
                 try:
                     del(match_vol['field'])
@@ -2153,6 +2840,7 @@ def metadata_get_next_and_prev_vols(source_code=None,
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
+@metadata_cached
 def metadata_get_volumes(source_code=None,
                          source_type=None,
                          req_url: str=None 
@@ -2294,10 +2982,6 @@ def prep_document_download(document_id,
 
 
     """
-    def add_epub_elements(str):
-        # for now, just return
-        return str
-
     ret_val = None
     status = httpCodes.HTTP_200_OK
 
@@ -2305,7 +2989,7 @@ def prep_document_download(document_id,
     args = {
              "fl": """art_id, art_citeas_xml, text_xml, art_excerpt, art_sourcetype, art_year,
                       art_sourcetitleabbr, art_vol, art_iss, art_pgrg, art_doi,
-                      art_issn, file_classification"""
+                      art_issn, file_classification, file_last_modified"""
     }
 
     try:
@@ -2350,9 +3034,13 @@ def prep_document_download(document_id,
                                                                ret_format="HTML"
                                                                )
         
-                        if ret_format.upper() == "HTML":
-                            html = opasxmllib.remove_encoding_string(doc)
-                            filename = opasxmllib.convert_xml_to_html_file(html, output_filename=document_id + ".html")  # returns filename
+                        if ret_format.upper() in ("HTML", "PDF", "EPUB"):
+                            # rendered in the download process pool, or returned from the download cache
+                            filename = opasDownloadSupport.download_renderer.get(doc,
+                                                                                 art_id=art_info.get("art_id", document_id),
+                                                                                 ret_format=ret_format,
+                                                                                 source_timestamp=art_info.get("file_last_modified", ""),
+                                                                                 heading=heading)
                             ret_val = filename
                         elif ret_format.upper() == "PDFORIG":
                             # setup so can include year in path (folder names) in AWS, helpful.
@@ -2366,30 +3054,6 @@ def prep_document_download(document_id,
                                                              error_description=err_msg
                                                            )
                                 ret_val = None
-                        elif ret_format.upper() == "PDF":
-                            pisa.showLogging() # debug only
-                            doc = opasxmllib.remove_encoding_string(doc)
-                            html_string = opasxmllib.xml_str_to_html(doc)
-                            html_string = re.sub("\[\[RunningHead\]\]", f"{heading}", html_string, count=1)
-                            html_string = re.sub("</html>", f"{COPYRIGHT_PAGE_HTML}</html>", html_string, count=1)                        
-                            # open output file for writing (truncated binary)
-                            filename = document_id + ".PDF" 
-                            result_file = open(filename, "w+b")
-                            # convert HTML to PDF
-                            # Need to fix links for graphics, e.g., see https://xhtml2pdf.readthedocs.io/en/latest/usage.html#using-xhtml2pdf-in-django
-                            pisaStatus = pisa.CreatePDF(src=html_string,            # the HTML to convert
-                                                        dest=result_file)           # file handle to receive result
-                            # close output file
-                            result_file.close()                 # close output file
-                            # return True on success and False on errors
-                            ret_val = filename
-                        elif ret_format.upper() == "EPUB":
-                            doc = opasxmllib.remove_encoding_string(doc)
-                            html_string = opasxmllib.xml_str_to_html(doc)
-                            html_string = re.sub("\[\[RunningHead\]\]", f"{heading}", html_string, count=1)
-                            html_string = add_epub_elements(html_string)
-                            filename = opasxmllib.html_to_epub(html_string, document_id, document_id)
-                            ret_val = filename
                         else:
                             err_msg = f"Format {ret_format} not supported"
                             logger.warning(err_msg)
@@ -2563,6 +3227,7 @@ def get_fulltext_from_search_results(result,
 
     child_xml = None
     offset = 0
+    render_key = None
     if documentListItem.sourceTitle is None:
         documentListItem = opasQueryHelper.get_base_article_info_from_search_result(result, documentListItem)
         
@@ -2600,21 +3265,38 @@ def get_fulltext_from_search_results(result,
             offset = page_offset
             reduce = True
 
+        render_key = get_render_cache_key(result, 0, None, return_options)
         if reduce == True or page_limit is not None:
             # extract the requested pages
             try:
-                temp_xml = opasxmllib.xml_get_pages(xmlstr=text_xml,
-                                                    offset=offset,
-                                                    limit=page_limit,
-                                                    pagebrk="pb",
-                                                    inside="body",
-                                                    env="body")
+                temp_xml = None
+                page_map = result.get("art_pgmap", None)
+                if page_map is not None:
+                    # slice the pages using the page map stored by the loader, rather than parse the document
+                    try:
+                        temp_xml = opasxmllib.xml_get_pages_from_page_map(xmlstr=text_xml,
+                                                                          page_map=json.loads(page_map),
+                                                                          offset=offset,
+                                                                          limit=page_limit,
+                                                                          env="body")
+                    except Exception as e:
+                        logger.warning(f"Page map not usable ({e}).  Extracting pages from the document.")
+                        temp_xml = None
+
+                if temp_xml is None:
+                    temp_xml = opasxmllib.xml_get_pages(xmlstr=text_xml,
+                                                        offset=offset,
+                                                        limit=page_limit,
+                                                        pagebrk="pb",
+                                                        inside="body",
+                                                        env="body")
                 temp_xml = temp_xml[0]
                 
             except Exception as e:
                 logger.error(f"Page extraction from document failed. Error: {e}.  Keeping entire document.")
             else: # ok
                 text_xml = temp_xml
+                render_key = get_render_cache_key(result, offset, page_limit, return_options)
     
         if return_options is not None:
             if return_options.get("Glossary", None) == False:
@@ -2665,7 +3347,7 @@ def get_fulltext_from_search_results(result,
                                                ret_format="HTML"
                                                )
         try:
-            text_xml = opasxmllib.xml_str_to_html(text_xml)  #  e.g, r"./libs/styles/pepkbd3-html.xslt"
+            text_xml = xml_str_to_html_cached(text_xml, render_key)  #  e.g, r"./libs/styles/pepkbd3-html.xslt"
         except Exception as e:
             logger.error(f"Could not convert to HTML {e}; returning native format")
             text_xml = re.sub(f"{opasConfig.HITMARKERSTART}|{opasConfig.HITMARKEREND}", numbered_anchors, text_xml)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasSolrAsync
+
+asyncio Solr client for the async endpoints, so a Solr query doesn't block the event loop
+  (and every other request being handled by the server worker) while it waits for Solr.
+
+Each core has a pooled (keep-alive) http client with timeouts, and retries requests after
+  connection errors, timeouts and 502/503/504 returns.  Results are returned as pysolr.Results,
+  the same as solr_docs2.search, so code processing the results works with either.
+
+>>> solr_docs_async.url.endswith("pepwebdocs/")
+True
+>>> solr_docs_async.prepare_params({"q": "love", "hl": True, "rows": 10, "fq": ["a:1", "b:2"]})
+{'q': 'love', 'hl': 'true', 'rows': '10', 'fq': ['a:1', 'b:2'], 'wt': 'json'}
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import json
+import asyncio
+
+sys.path.append('../config')
+
+import httpx
+import pysolr
+
+import opasConfig
+from localsecrets import SOLRUSER, SOLRPW, SOLRURL
+from configLib.opasCoreConfig import SOLR_DOCS, SOLR_AUTHORS, SOLR_GLOSSARY
+
+import logging
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+class AsyncSolr(object):
+    """
+    asyncio counterpart of pysolr.Solr for one core (search and suggest_terms)
+    """
+    def __init__(self, url, auth=None,
+                 pool_size=opasConfig.SOLR_ASYNC_POOL_SIZE,
+                 timeout=opasConfig.SOLR_ASYNC_TIMEOUT,
+                 connect_timeout=opasConfig.SOLR_ASYNC_CONNECT_TIMEOUT,
+                 retries=opasConfig.SOLR_ASYNC_RETRIES,
+                 retry_backoff=opasConfig.SOLR_ASYNC_RETRY_BACKOFF):
+        self.url = url if url.endswith("/") else url + "/"
+        self.auth = auth
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._client = None
+        self._loop = None
+
+    @property
+    def client(self):
+        # created on first use, so it's bound to the server's running event loop (and recreated
+        #  if called from another loop, e.g., asyncio.run in tests)
+        loop = asyncio.get_event_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(auth=self.auth,
+                                             timeout=self.timeout,
+                                             limits=httpx.Limits(max_connections=self.pool_size,
+                                                                 max_keepalive_connections=self.pool_size))
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    def prepare_params(self, params):
+        """
+        Convert parameter values to what Solr expects (pysolr does the same when encoding them)
+        """
+        ret_val = {}
+        for key, value in params.items():
+            if value is None:
+                continue
+            elif isinstance(value, bool):
+                ret_val[key] = "true" if value else "false"
+            elif isinstance(value, (list, tuple)):
+                ret_val[key] = [str(n) for n in value]
+            else:
+                ret_val[key] = str(value)
+
+        ret_val["wt"] = "json"
+        return ret_val
+
+    async def _post(self, handler, params):
+        """
+        Send the request (as a form post, so long queries don't exceed URL limits),
+          retrying on connection problems, and return the decoded json response.
+
+        Raises pysolr.SolrError like pysolr, so callers handle errors from either the same way.
+        """
+        url = self.url + handler
+        data = self.prepare_params(params)
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.post(url, data=data)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                if attempt >= self.retries:
+                    logger.error(f"Solr request to {url} failed after {attempt + 1} tries: {e}")
+                    raise pysolr.SolrError(f"Failed to connect to server at {url}: {e}")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    break
+
+            delay = self.retry_backoff * (2 ** attempt)
+            attempt += 1
+            logger.warning(f"Solr request to {url} retry {attempt} in {delay} seconds")
+            await asyncio.sleep(delay)
+
+        if response.status_code != 200:
+            error_message = f"Solr responded with an error (HTTP {response.status_code}): {response.text[:1000]}"
+            logger.error(error_message)
+            raise pysolr.SolrError(error_message)
+
+        try:
+            ret_val = json.loads(response.text)
+        except ValueError as e:
+            raise pysolr.SolrError(f"Solr returned an invalid response: {e}")
+
+        return ret_val
+
+    async def search(self, q, search_handler="select", **kwargs):
+        """
+        Search, returning pysolr.Results, as solr_docs2.search(q, **kwargs) does
+        """
+        params = {"q": q}
+        params.update(kwargs)
+        decoded = await self._post(search_handler, params)
+        return pysolr.Results(decoded)
+
+    async def suggest_terms(self, fields, prefix, handler="terms", **kwargs):
+        """
+        Term list by field, {field: [(term, count), ...]}, as solr_docs2.suggest_terms returns
+        """
+        params = {"terms.fl": fields, "terms.prefix": prefix}
+        params.update(kwargs)
+        decoded = await self._post(handler, params)
+        terms = decoded.get("terms", {})
+        if isinstance(terms, (list, tuple)): # flat list of field name, term list
+            terms = dict(zip(terms[0::2], terms[1::2]))
+
+        ret_val = {}
+        for field, values in terms.items():
+            ret_val[field] = list(zip(values[0::2], values[1::2]))
+
+        return ret_val
+
+    async def index_version(self):
+        """
+        Index version and generation from the replication handler, as "version.generation";
+          both change whenever a commit changes the index.
+        """
+        decoded = await self._post("replication", {"command": "indexversion"})
+        return f"{decoded['indexversion']}.{decoded['generation']}"
+
+auth = (SOLRUSER, SOLRPW) if SOLRUSER is not None else None
+solr_docs_async = AsyncSolr(SOLRURL + SOLR_DOCS, auth=auth)
+solr_authors_async = AsyncSolr(SOLRURL + SOLR_AUTHORS, auth=auth)
+solr_gloss_async = AsyncSolr(SOLRURL + SOLR_GLOSSARY, auth=auth)
+
+async def close_all():
+    """
+    Close the pooled connections (server shutdown)
+    """
+    for core in (solr_docs_async, solr_authors_async, solr_gloss_async):
+        await core.close()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
@@ -24,6 +24,7 @@ import string
 import re
 import urllib.request, urllib.parse, urllib.error
 import random
+import json
 
 import lxml
 from lxml import etree
@@ -66,6 +67,28 @@ def non_empty_string(strval):
     except Exception as e:
         return None
 
+def plain_data(value):
+    """
+    Return a copy of value (dicts, lists and tuples of values) where strings returned by lxml
+      (which keep a reference to their element) are plain str, so the data can be pickled,
+      e.g., to send it from a worker process.
+
+    >>> root = etree.fromstring("<art lang='en'><p>one</p></art>")
+    >>> data = plain_data({"lang": root.xpath("//@lang"), "n": 1})
+    >>> data, type(data["lang"][0]) is str
+    ({'lang': ['en'], 'n': 1}, True)
+    """
+    if isinstance(value, str):
+        ret_val = str(value)
+    elif isinstance(value, dict):
+        ret_val = {key: plain_data(val) for key, val in value.items()}
+    elif isinstance(value, (list, tuple)):
+        ret_val = type(value)(plain_data(val) for val in value)
+    else:
+        ret_val = value
+
+    return ret_val
+
 def strip_tags(value, compiled_tag_pattern):
     """
     Strip tags matching the compiled_tag_pattern.
@@ -184,6 +207,13 @@ class BiblioEntry(object):
         self.author_list_str = '; '.join(self.author_list)
         self.author_list_str = self.author_list_str[:2040]
 #------------------------------------------------------------------------------------------------------
+def get_biblio_entries(pepxml, artInfo):
+    """
+    Return a BiblioEntry for each reference (be) in the document's bibliography
+    """
+    return [BiblioEntry(artInfo, ref) for ref in pepxml.xpath("/pepkbd3//be")]
+
+#------------------------------------------------------------------------------------------------------
 class ArticleInfo(object):
     """
     An entry from a documents metadata.
@@ -548,13 +578,32 @@ def get_file_dates_solr(solrcore, filename=None):
             ret_val = {}
 
     return ret_val
+
 #------------------------------------------------------------------------------------------------------
-def process_article_for_glossary_core(pepxml, artInfo, solr_gloss, fileXMLContents, verbose=None):
+def get_all_file_dates_solr(solrcore):
     """
-    Process the special PEP Glossary documents.  These are linked to terms in the document
-       as popups.
+    Return the file_last_modified value for all the loaded files (articles), as a dict by file_name,
+      in one export (rather than get_file_dates_solr one file at a time).
+    """
+    ret_val = {}
+    try:
+        for doc in opasgenlib.iter_solr_docs(solrcore, "art_level:1", fl="id,file_name,file_last_modified", rows=loaderConfig.SOLR_EXPORT_PAGE_SIZE):
+            file_name = doc.get("file_name")
+            if file_name is not None:
+                ret_val[file_name] = doc.get("file_last_modified")
+    except Exception as e:
+        msg = f"Solr file dates export error {e}"
+        logger.error(msg)
+        print (msg)
+        ret_val = None
+
+    return ret_val
+
+#------------------------------------------------------------------------------------------------------
+def get_glossary_core_records(pepxml, artInfo, verbose=None):
+    """
+    Return the Glossary core records (dicts) for the dictentry's in the special PEP Glossary documents.
     """
-    ret_val = False
     glossary_groups = pepxml.xpath("/pepkbd3//dictentrygrp")  
     group_count = len(glossary_groups)
     msg = f"   ...Processing XML for Glossary Core. File has {group_count} groups."
@@ -616,6 +665,16 @@ def process_article_for_glossary_core(pepxml, artInfo, solr_gloss, fileXMLConten
             }
             all_dict_entries.append(this_dict_entry)
 
+    return all_dict_entries
+#------------------------------------------------------------------------------------------------------
+def process_article_for_glossary_core(pepxml, artInfo, solr_gloss, fileXMLContents, verbose=None):
+    """
+    Process the special PEP Glossary documents.  These are linked to terms in the document
+       as popups.
+    """
+    ret_val = False
+    all_dict_entries = get_glossary_core_records(pepxml, artInfo, verbose=verbose)
+
     # We collected all the dictentries for the group.  Now lets save the whole shebang
     try:
         response_update = solr_gloss.add_many(all_dict_entries)  # lets hold off on the , _commit=True)
@@ -629,13 +688,15 @@ def process_article_for_glossary_core(pepxml, artInfo, solr_gloss, fileXMLConten
 
     return ret_val    
 #------------------------------------------------------------------------------------------------------
-def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, include_paras=False, verbose=None):
+def get_doc_core_record(pepxml, artInfo, file_xml_contents, include_paras=False, verbose=None):
     """
-    Extract and load data for the full-text core.  Whereas in the Refs core each
+    Extract the data for the full-text core.  Whereas in the Refs core each
       Solr document is a reference, here each Solr document is a PEP Article.
 
       This core contains bib entries too, but not subfields.
 
+      Returns the Solr document (dict), with any paragraph child documents in _doc
+
       TODO: Originally, this core supported each bibliography record in its own
             json formatted structure, saved in a single field.  However, when
             the code was switched from PySolr to Solrpy this had to be removed,
@@ -643,7 +704,6 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
             as a case on the issues board for Solrpy.
 
     """
-    ret_val = False
     msg = f"   ...Processing XML for Docs Core."
     logger.info(msg)
     if verbose:
@@ -712,55 +772,10 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
     # you must load with command line option includeparas=True
     if include_paras == True or artInfo.src_code in loaderConfig.SRC_CODES_TO_INCLUDE_PARAS:
         children = doc_children() # new instance, reset child counter suffix
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//body//p|//body//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_body",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//h1|//h2|//h3|//h4|//h5|//h6", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_heading",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//quote//p|//quote//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_quote",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//dream//p|//dream//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_dream",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//poem//p|//poem//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_poem",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//note//p|//note//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_note",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//dialog//p|//dialog//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_dialog",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//panel//p|//panel//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_panel",
-                              default_lang=art_lang)
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//caption//p", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_caption",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//bib//be|//binc", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_bib",
-                              default_lang=art_lang[0])
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//appxs//p|//appxs//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_appxs",
-                              default_lang=art_lang[0])
-        # summaries and abstracts
-        children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, "//summaries//p|//summaries//p2|//abs//p|//abs//p2", attr_to_find="lang"),
-                              parent_id=artInfo.art_id,
-                              parent_tag="p_summaries",
-                              default_lang=art_lang[0])
+        # body paragraphs, headings, quotes, dreams, ..., references, summaries and abstracts (see PARA_CHILD_GROUPS)
+        children.add_para_children(pepxml,
+                                   parent_id=artInfo.art_id,
+                                   default_lang=art_lang[0])
 
         child_list = children.child_list
         # indented status
@@ -819,6 +834,12 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
     else:
         bk_title_series_str = None
         
+    page_map = None
+    if isinstance(file_xml_contents, str):
+        page_map = opasxmllib.xml_get_page_map(file_xml_contents)
+        if page_map is not None:
+            page_map = json.dumps(page_map)
+
     if artInfo.art_issue_title is not None:
         art_issue_title_str = artInfo.art_issue_title.translate(str.maketrans('', '', string.punctuation))
     else:
@@ -844,6 +865,7 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
                 "art_excerpt_xml" : excerpt_xml,
                 # very important field for displaying the whole document or extracting parts
                 "text_xml" : file_xml_contents,                                # important
+                "art_pgmap" : page_map,  # page break offsets in text_xml, for page requests (see opasXMLHelper.xml_get_pages_from_page_map)
                 "art_offsite" : offsite_contents, #  true if it's offsite
                 "author_bio_xml" : opasxmllib.xml_xpath_return_xmlstringlist(pepxml, "//nbio", default_return = None),
                 "author_aff_xml" : opasxmllib.xml_xpath_return_xmlstringlist(pepxml, "//autaff", default_return = None),
@@ -939,6 +961,16 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
                 "_doc" : child_list  # children.child_list
               }
 
+    return new_rec
+#------------------------------------------------------------------------------------------------------
+def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, include_paras=False, verbose=None):
+    """
+    Extract and load data for the full-text core (see get_doc_core_record)
+
+    """
+    ret_val = False
+    new_rec = get_doc_core_record(pepxml, artInfo, file_xml_contents, include_paras=include_paras, verbose=verbose)
+
     #experimental paras save
     # parasxml_update(parasxml, solrcon, artInfo)
     # format for pysolr (rather than solrpy, supports nesting)
@@ -955,6 +987,29 @@ def process_article_for_doc_core(pepxml, artInfo, solrcon, file_xml_contents, in
         
     return ret_val
 
+# Paragraph level child document groups, in the order they're added (and numbered):
+#   (parent_tag, [(element tags, scope ancestor tags or None for anywhere), ...])
+#   e.g., p_quote is //quote//p|//quote//p2
+PARA_CHILD_GROUPS = [("p_body", [(("p", "p2"), ("body", ))]),
+                     ("p_heading", [(("h1", "h2", "h3", "h4", "h5", "h6"), None)]),
+                     ("p_quote", [(("p", "p2"), ("quote", ))]),
+                     ("p_dream", [(("p", "p2"), ("dream", ))]),
+                     ("p_poem", [(("p", "p2"), ("poem", ))]),
+                     ("p_note", [(("p", "p2"), ("note", ))]),
+                     ("p_dialog", [(("p", "p2"), ("dialog", ))]),
+                     ("p_panel", [(("p", "p2"), ("panel", ))]),
+                     ("p_caption", [(("p", ), ("caption", ))]),
+                     ("p_bib", [(("be", ), ("bib", )), (("binc", ), None)]),
+                     ("p_appxs", [(("p", "p2"), ("appxs", ))]),
+                     ("p_summaries", [(("p", "p2"), ("summaries", "abs"))]),
+                     ]
+PARA_CHILD_GROUPS_BY_TAG = {} # tag: [(parent_tag, scope_tags), ...]
+for parent_tag, alternatives in PARA_CHILD_GROUPS:
+    for tags, scope_tags in alternatives:
+        for tag in tags:
+            PARA_CHILD_GROUPS_BY_TAG.setdefault(tag, []).append((parent_tag, scope_tags))
+PARA_CHILD_SCOPE_TAGS = {tag for parent_tag, alternatives in PARA_CHILD_GROUPS for tags, scope_tags in alternatives for tag in (scope_tags or ())}
+
 class doc_children(object):
     """
     Create an list of child strings to be used as the Solr nested document.
@@ -976,35 +1031,74 @@ class doc_children(object):
          - level for creating children at different levels (even if in the same object)
         """
         for n in stringlist:
-            self.count += 1
-            try:
-                self.tag_counts[parent_tag] += 1
-            except: # initialize
-                self.tag_counts[parent_tag] = 1
-            
-            # special attr handling.  Later look and see if this is slowing us down...
+            # special attr handling
             currelem = etree.fromstring(n, parser=parser)
-            lang = currelem.attrib.get("lang", default_lang)
-            para_lgrid = currelem.attrib.get("lgrid", None)
-            para_lgrx = currelem.attrib.get("lgrx", None)
-            if para_lgrx is not None:
-                para_lgrx = [item.strip() for item in para_lgrx.split(',')]
-                
-            self.child_list.append({"id": parent_id + f".{self.count}",
-                                    "para_art_id": parent_id,
-                                    "art_level": level,
-                                    "parent_tag": parent_tag,
-                                    "lang": lang,
-                                    "para": n,
-                                    "para_lgrid" : para_lgrid,
-                                    "para_lgrx" : para_lgrx
-                                  })
+            self._add_child(n, currelem.attrib, parent_id, parent_tag, level, default_lang)
+
         return self.count
 
+    def add_para_children(self, pepxml, parent_id, level=2, default_lang=None):
+        """
+        Add the children for each group in PARA_CHILD_GROUPS, from one pass over the article tree.
+
+        The children (and their numbering) are the same as calling add_children for each group with
+          opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, xpath, attr_to_find="lang"):
+          an element in more than one group (e.g., a quote paragraph in the body) is a child of each, and
+          elements without a lang attribute get the nearest ancestor's (it's set on the element too).
+        """
+        group_nodes = {parent_tag: [] for parent_tag, alternatives in PARA_CHILD_GROUPS}
+        # the candidate elements are found by lxml, in document order; each one's ancestors give its scopes and inherited lang
+        for elem in pepxml.iter(*PARA_CHILD_GROUPS_BY_TAG):
+            lang = elem.get("lang") or None
+            scopes = set()
+            for ancestor in elem.iterancestors():
+                if lang is None:
+                    lang = ancestor.get("lang") or None
+                if ancestor.tag in PARA_CHILD_SCOPE_TAGS:
+                    scopes.add(ancestor.tag)
+            for parent_tag, scope_tags in PARA_CHILD_GROUPS_BY_TAG[elem.tag]:
+                if scope_tags is None or not scopes.isdisjoint(scope_tags):
+                    group_nodes[parent_tag].append((elem, lang))
+
+        for parent_tag, alternatives in PARA_CHILD_GROUPS:
+            nodes = group_nodes[parent_tag]
+            # set the inherited lang for the whole group before serializing any of it, as
+            #   xml_xpath_return_xmlstringlist_withinheritance does (it can show in a parent's serialization)
+            for elem, lang in nodes:
+                if lang is not None and not elem.get("lang"):
+                    elem.set("lang", lang)
+            for elem, lang in nodes:
+                self._add_child(etree.tostring(elem, with_tail=False, encoding="unicode"), elem.attrib, parent_id, parent_tag, level, default_lang)
+
+        return self.count
+
+    def _add_child(self, para, attrib, parent_id, parent_tag, level, default_lang):
+        self.count += 1
+        try:
+            self.tag_counts[parent_tag] += 1
+        except: # initialize
+            self.tag_counts[parent_tag] = 1
+
+        lang = attrib.get("lang", default_lang)
+        para_lgrid = attrib.get("lgrid", None)
+        para_lgrx = attrib.get("lgrx", None)
+        if para_lgrx is not None:
+            para_lgrx = [item.strip() for item in para_lgrx.split(',')]
+
+        self.child_list.append({"id": parent_id + f".{self.count}",
+                                "para_art_id": parent_id,
+                                "art_level": level,
+                                "parent_tag": parent_tag,
+                                "lang": lang,
+                                "para": para,
+                                "para_lgrid" : para_lgrid,
+                                "para_lgrx" : para_lgrx
+                              })
+
 #------------------------------------------------------------------------------------------------------
-def process_info_for_author_core(pepxml, artInfo, solrAuthor, verbose=None):
+def get_author_core_records(pepxml, artInfo, verbose=None):
     """
-    Get author data and write a record for each author in each document.  Hence an author
+    Get author data, a record (dict) for each author in each document.  Hence an author
        of multiple articles will be listed multiple times, once for each article.  But
        this core will let us research by individual author, including facets.
        
@@ -1013,12 +1107,7 @@ def process_info_for_author_core(pepxml, artInfo, solrAuthor, verbose=None):
     # update author data
     #<!-- ID = PEP articleID + authorID -->
     
-    ret_val = False
-    msg = f"   ...Processing XML for Author Core."
-    logger.info(msg)
-    if verbose:
-        print (msg)
-    
+    ret_val = []
     try:
         # Save author info in database
         authorPos = 0
@@ -1045,39 +1134,26 @@ def process_info_for_author_core(pepxml, artInfo, solrAuthor, verbose=None):
                 authorAffil = pepxml.xpath('//artinfo/artauth/autaff[@affid="%s"]' % authorAffID)
                 authorAffil = etree.tostring(authorAffil[0])
                
-            try:  
-                response_update = solrAuthor.add(id = authorDocid,         # important =  note this is unique id for every author + artid
-                                                 art_id = artInfo.art_id,
-                                                 title = artInfo.art_title,
-                                                 authors = artInfo.art_author_id_list,
-                                                 art_author_id = authorID,
-                                                 art_author_listed = authorListed,
-                                                 art_author_pos_int = authorPos,
-                                                 art_author_role = authorRole,
-                                                 art_author_bio = authorBio,
-                                                 art_author_affil_xml = authorAffil,
-                                                 art_year_int = artInfo.art_year_int,
-                                                 art_sourcetype = artInfo.src_type,
-                                                 art_sourcetitlefull = artInfo.src_title_full,
-                                                 art_citeas_xml = artInfo.art_citeas_xml,
-                                                 art_author_xml = authorXML,
-                                                 file_last_modified = artInfo.filedatetime,
-                                                 file_classification = artInfo.file_classification,
-                                                 file_name = artInfo.filename,
-                                                 timestamp = artInfo.processed_datetime  # When batch was entered into core
-                                                )
-                if not re.search('"status">0</int>', response_update):
-                    msg = "Solr save error for author core for %s: %s (%s)" % (artInfo.art_id, err, response_update)
-                    logger.error(msg)
-                    print (msg)
-            except Exception as err:
-                #processingErrorCount += 1
-                errStr = "Solr Author core error for %s: %s" % (artInfo.art_id, err)
-                print (errStr)
-                logger.error(errStr)
-            else:
-                ret_val = True # ok!
-                
+            ret_val.append({"id": authorDocid,         # important =  note this is unique id for every author + artid
+                            "art_id": artInfo.art_id,
+                            "title": artInfo.art_title,
+                            "authors": artInfo.art_author_id_list,
+                            "art_author_id": authorID,
+                            "art_author_listed": authorListed,
+                            "art_author_pos_int": authorPos,
+                            "art_author_role": authorRole,
+                            "art_author_bio": authorBio,
+                            "art_author_affil_xml": authorAffil,
+                            "art_year_int": artInfo.art_year_int,
+                            "art_sourcetype": artInfo.src_type,
+                            "art_sourcetitlefull": artInfo.src_title_full,
+                            "art_citeas_xml": artInfo.art_citeas_xml,
+                            "art_author_xml": authorXML,
+                            "file_last_modified": artInfo.filedatetime,
+                            "file_classification": artInfo.file_classification,
+                            "file_name": artInfo.filename,
+                            "timestamp": artInfo.processed_datetime  # When batch was entered into core
+                           })
 
     except Exception as err:
         #processingErrorCount += 1
@@ -1087,6 +1163,215 @@ def process_info_for_author_core(pepxml, artInfo, solrAuthor, verbose=None):
 
     return ret_val
 #------------------------------------------------------------------------------------------------------
+def process_info_for_author_core(pepxml, artInfo, solrAuthor, verbose=None):
+    """
+    Write a record for each author in each document to the authors core (see get_author_core_records)
+       
+    """
+    ret_val = False
+    msg = f"   ...Processing XML for Author Core."
+    logger.info(msg)
+    if verbose:
+        print (msg)
+    
+    for author_rec in get_author_core_records(pepxml, artInfo, verbose=verbose):
+        try:  
+            response_update = solrAuthor.add(**author_rec)
+            if not re.search('"status">0</int>', response_update):
+                msg = "Solr save error for author core for %s: (%s)" % (artInfo.art_id, response_update)
+                logger.error(msg)
+                print (msg)
+        except Exception as err:
+            #processingErrorCount += 1
+            errStr = "Solr Author core error for %s: %s" % (artInfo.art_id, err)
+            print (errStr)
+            logger.error(errStr)
+        else:
+            ret_val = True # ok!
+
+    return ret_val
+
+#------------------------------------------------------------------------------------------------------
+def solr_doc_size(solr_doc):
+    """
+    Approximate size (bytes) of a Solr document (with any nested child documents) when sent to Solr
+
+    >>> solr_doc_size({"id": "AIM.076.0309A", "_doc": [{"id": "AIM.076.0309A.P1", "para": "text"}]})
+    77
+    """
+    return len(json.dumps(solr_doc, default=str))
+
+class SolrBatchWriter(object):
+    """
+    Buffers documents for a Solr core (pysolr) across articles, and sends them in batches bounded by
+      document count (parent and nested child documents) and size, rather than one add per article.
+
+    Solr commits the adds within commit_within milliseconds (commitWithin), so the loader doesn't
+      need to commit explicitly as it goes.  A batch that fails is retried (with backoff); if it still
+      fails, the documents are sent one at a time so only the document(s) Solr won't take are lost
+      (and logged).
+    """
+    def __init__(self, solrcon, name,
+                 max_docs=loaderConfig.SOLR_BATCH_MAX_DOCS,
+                 max_bytes=loaderConfig.SOLR_BATCH_MAX_BYTES,
+                 commit_within=loaderConfig.SOLR_COMMIT_WITHIN,
+                 retries=loaderConfig.SOLR_BATCH_RETRIES,
+                 retry_backoff=loaderConfig.SOLR_BATCH_RETRY_BACKOFF,
+                 verbose=None):
+        self.solrcon = solrcon
+        self.name = name
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.commit_within = commit_within
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.verbose = verbose
+        self.pending = []
+        self.pending_docs = 0
+        self.pending_bytes = 0
+        # stats
+        self.docs_sent = 0
+        self.batches_sent = 0
+        self.bytes_sent = 0
+        self.failed_docs = 0
+        self.send_seconds = 0.0
+        # the HTTP status of the latest request to the core (pysolr's SolrError only has it in the message)
+        self.last_status = None
+        self.solrcon.get_session().hooks["response"].append(self._record_status)
+
+    def _record_status(self, response, *args, **kwargs):
+        # requests response hook
+        self.last_status = response.status_code
+
+    def add(self, solr_docs):
+        """
+        Add documents (dicts, parents with any child documents nested in _doc), sending a batch
+          when the bounds are reached.
+        """
+        for solr_doc in solr_docs:
+            doc_count = 1 + len(solr_doc.get("_doc") or [])
+            doc_size = solr_doc_size(solr_doc)
+            if self.pending != [] and (self.pending_docs + doc_count > self.max_docs or self.pending_bytes + doc_size > self.max_bytes):
+                self.flush()
+
+            self.pending.append(solr_doc)
+            self.pending_docs += doc_count
+            self.pending_bytes += doc_size
+
+    def flush(self):
+        """
+        Send the pending documents.  Returns the number of (parent) documents added.
+        """
+        ret_val = 0
+        batch = self.pending
+        batch_bytes = self.pending_bytes
+        self.pending = []
+        self.pending_docs = 0
+        self.pending_bytes = 0
+        if batch == []:
+            return ret_val
+
+        send_start = time.time()
+        if self._send(batch):
+            ret_val = len(batch)
+        else:
+            logger.warning(f"Solr {self.name} core: batch of {len(batch)} documents failed.  Adding them one at a time.")
+            for solr_doc in batch:
+                try:
+                    self.solrcon.add([solr_doc], commitWithin=self.commit_within)
+                    ret_val += 1
+                except Exception as err:
+                    self.failed_docs += 1
+                    errStr = f"Solr {self.name} core error for {solr_doc.get('id')}: {err}"
+                    logger.error(errStr)
+                    print (errStr)
+
+        self.send_seconds += time.time() - send_start
+        self.docs_sent += ret_val
+        self.batches_sent += 1
+        self.bytes_sent += batch_bytes
+        if self.verbose:
+            print (f"   ...Solr {self.name} core: added {ret_val} documents ({batch_bytes} bytes)")
+
+        return ret_val
+
+    def _send(self, batch):
+        ret_val = False
+        attempt = 0
+        while True:
+            self.last_status = None
+            try:
+                self.solrcon.add(batch, commitWithin=self.commit_within)
+            except Exception as e:
+                if attempt >= self.retries or self.last_status == 400:
+                    # a document Solr won't take (bad request) won't be fixed by retrying
+                    logger.error(f"Solr {self.name} core: batch add failed after {attempt + 1} tries ({e})")
+                    break
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f"Solr {self.name} core: batch add error ({e}).  Retry {attempt} in {delay} seconds.")
+                time.sleep(delay)
+            else:
+                ret_val = True
+                break
+
+        return ret_val
+
+    def commit(self):
+        """
+        Send the pending documents and commit (end of the load)
+        """
+        self.flush()
+        self.solrcon.commit()
+
+    def stats_str(self):
+        rate = f"{self.docs_sent/self.send_seconds:.1f} docs/sec" if self.send_seconds > 0 else "-"
+        return f"Solr {self.name} core: {self.docs_sent} documents in {self.batches_sent} batches ({self.bytes_sent} bytes) in {self.send_seconds:.2f} secs ({rate}); {self.failed_docs} failed."
+
+#------------------------------------------------------------------------------------------------------
+SQL_REPLACE_API_BIBLIOXML = r"""REPLACE
+                           INTO api_biblioxml (
+                                art_id,
+                                bib_local_id,
+                                art_year,
+                                bib_rx,
+                                bib_sourcecode, 
+                                bib_rxcf, 
+                                bib_authors, 
+                                bib_authors_xml, 
+                                bib_articletitle, 
+                                bib_sourcetype, 
+                                bib_sourcetitle, 
+                                bib_pgrg, 
+                                bib_year, 
+                                bib_year_int, 
+                                bib_volume, 
+                                bib_publisher, 
+                                full_ref_xml,
+                                full_ref_text
+                                )
+                            values (%(art_id)s,
+                                    %(ref_local_id)s,
+                                    %(art_year_int)s,
+                                    %(rx)s,
+                                    %(rx_sourcecode)s,
+                                    %(rxcf)s,
+                                    %(author_list_str)s,
+                                    %(authors_xml)s,
+                                    %(ref_title)s,
+                                    %(source_type)s,
+                                    %(source_title)s,
+                                    %(pgrg)s,
+                                    %(year_of_publication)s,
+                                    %(year_of_publication_int)s,
+                                    %(volume)s,
+                                    %(publishers)s,
+                                    %(ref_entry_xml)s,
+                                    %(ref_entry_text)s
+                                    );
+                        """
+
+#------------------------------------------------------------------------------------------------------
 def add_reference_to_biblioxml_table(ocd, artInfo, bib_entry, verbose=None):
     """
     Adds the bibliography data from a single document to the biblioxml table in mysql database opascentral.
@@ -1107,51 +1392,10 @@ def add_reference_to_biblioxml_table(ocd, artInfo, bib_entry, verbose=None):
       
     """
     ret_val = False
-    insert_if_not_exists = r"""REPLACE
-                               INTO api_biblioxml (
-                                    art_id,
-                                    bib_local_id,
-                                    art_year,
-                                    bib_rx,
-                                    bib_sourcecode, 
-                                    bib_rxcf, 
-                                    bib_authors, 
-                                    bib_authors_xml, 
-                                    bib_articletitle, 
-                                    bib_sourcetype, 
-                                    bib_sourcetitle, 
-                                    bib_pgrg, 
-                                    bib_year, 
-                                    bib_year_int, 
-                                    bib_volume, 
-                                    bib_publisher, 
-                                    full_ref_xml,
-                                    full_ref_text
-                                    )
-                                values (%(art_id)s,
-                                        %(ref_local_id)s,
-                                        %(art_year_int)s,
-                                        %(rx)s,
-                                        %(rx_sourcecode)s,
-                                        %(rxcf)s,
-                                        %(author_list_str)s,
-                                        %(authors_xml)s,
-                                        %(ref_title)s,
-                                        %(source_type)s,
-                                        %(source_title)s,
-                                        %(pgrg)s,
-                                        %(year_of_publication)s,
-                                        %(year_of_publication_int)s,
-                                        %(volume)s,
-                                        %(publishers)s,
-                                        %(ref_entry_xml)s,
-                                        %(ref_entry_text)s
-                                        );
-                            """
     query_param_dict = bib_entry.__dict__
     
     try:
-        res = ocd.do_action_query(querytxt=insert_if_not_exists, queryparams=query_param_dict)
+        res = ocd.do_action_query(querytxt=SQL_REPLACE_API_BIBLIOXML, queryparams=query_param_dict)
     except Exception as e:
         errStr = f"api_biblioxml table insert (returned {res}) error {e}"
         logger.error(errStr)
@@ -1160,8 +1404,170 @@ def add_reference_to_biblioxml_table(ocd, artInfo, bib_entry, verbose=None):
         
     else:
         ret_val = True
-        
+
     return ret_val  # return True for success
+
+#------------------------------------------------------------------------------------------------------
+def add_rows_to_table(ocd, sql, rows, chunk_size=loaderConfig.DB_INSERT_CHUNK_SIZE, caller_name="add_rows_to_table", verbose=None):
+    """
+    Write rows (the parameter dicts for sql, a single row REPLACE or INSERT) with executemany, chunk_size
+      rows at a time, all in one transaction.  pymysql sends each chunk as one multi-row statement.
+
+    If the transaction fails, it's rolled back and the rows are written one at a time, so only
+      the row(s) with a problem are skipped (and logged), as when they're written one by one.
+
+    Returns the number of rows written (0, if there's no database connection).
+    """
+    ret_val = 0
+    if rows == []:
+        return ret_val
+
+    ocd.open_connection(caller_name=caller_name)
+    if ocd.db is None:
+        errStr = f"{caller_name}: no database connection; {len(rows)} rows not written"
+        logger.error(errStr)
+        if verbose:
+            print (errStr)
+        return ret_val
+
+    try:
+        with ocd.db.cursor() as cursor:
+            for start in range(0, len(rows), chunk_size):
+                cursor.executemany(sql, rows[start:start + chunk_size])
+        ocd.db.commit()
+        ret_val = len(rows)
+    except pymysql.Error as e:
+        logger.warning(f"{caller_name}: batch insert error ({e}).  Inserting {len(rows)} rows one at a time.")
+        ocd.db.rollback()
+        for row in rows:
+            try:
+                with ocd.db.cursor() as cursor:
+                    cursor.execute(sql, row)
+                ocd.db.commit()
+                ret_val += 1
+            except pymysql.Error as err:
+                errStr = f"{caller_name}: insert error for {row.get('art_id')} ({err})"
+                logger.error(errStr)
+                if verbose:
+                    print (errStr)
+                ocd.db.rollback()
+
+    ocd.close_connection(caller_name=caller_name)
+    return ret_val
+
+class BiblioWriter(object):
+    """
+    Collects the bibliography entries for one or more articles, and writes them to the api_biblioxml
+      table in bulk (see add_rows_to_table), rather than one REPLACE per reference
+      (add_reference_to_biblioxml_table).
+
+    Pending entries are written when there are max_pending or more of them, and by flush, which
+      the loader calls when it commits the Solr cores, and at the end of the load.
+    """
+    def __init__(self, ocd, chunk_size=loaderConfig.DB_INSERT_CHUNK_SIZE, max_pending=loaderConfig.BIBLIO_MAX_PENDING_ROWS, verbose=None):
+        self.ocd = ocd
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.verbose = verbose
+        self.pending = []
+        self.rows_written = 0
+        self.write_seconds = 0.0
+
+    def add(self, bib_entries):
+        """
+        Add the BiblioEntry instances (or their __dict__) for an article
+        """
+        for bib_entry in bib_entries:
+            self.pending.append(bib_entry if isinstance(bib_entry, dict) else bib_entry.__dict__)
+
+        if len(self.pending) >= self.max_pending:
+            self.flush()
+
+    def flush(self):
+        rows = self.pending
+        self.pending = []
+        write_start = time.time()
+        ret_val = add_rows_to_table(self.ocd, SQL_REPLACE_API_BIBLIOXML, rows, chunk_size=self.chunk_size, caller_name="BiblioWriter", verbose=self.verbose)
+        self.write_seconds += time.time() - write_start
+        self.rows_written += ret_val
+        return ret_val
+
+#------------------------------------------------------------------------------------------------------
+SQL_REPLACE_API_ARTICLES = r"""REPLACE
+                           INTO api_articles (
+                                art_id,
+                                art_doi,
+                                art_type,
+                                art_lang,
+                                art_kwds,
+                                art_auth_mast,
+                                art_auth_citation,
+                                art_title,
+                                src_title_abbr,
+                                src_code,
+                                art_year,
+                                art_vol,
+                                art_vol_str,
+                                art_vol_suffix,
+                                art_issue,
+                                art_pgrg,
+                                art_pgstart,
+                                art_pgend,
+                                main_toc_id,
+                                start_sectname,
+                                bk_info_xml,
+                                bk_title,
+                                bk_publisher,
+                                art_citeas_xml,
+                                art_citeas_text,
+                                ref_count,
+                                filename,
+                                filedatetime
+                                )
+                            values (
+                                    %(art_id)s,
+                                    %(art_doi)s,
+                                    %(art_type)s,
+                                    %(art_lang)s,
+                                    %(art_kwds)s,
+                                    %(art_auth_mast)s,
+                                    %(art_auth_citation)s,
+                                    %(art_title)s,
+                                    %(src_title_abbr)s,
+                                    %(src_code)s,
+                                    %(art_year)s,
+                                    %(art_vol_int)s,
+                                    %(art_vol_str)s,
+                                    %(art_vol_suffix)s,
+                                    %(art_issue)s,
+                                    %(art_pgrg)s,
+                                    %(art_pgstart)s,
+                                    %(art_pgend)s,
+                                    %(main_toc_id)s,
+                                    %(start_sectname)s,
+                                    %(bk_info_xml)s,
+                                    %(bk_title)s,
+                                    %(bk_publisher)s,
+                                    %(art_citeas_xml)s,
+                                    %(art_citeas_text)s,
+                                    %(ref_count)s,
+                                    %(filename)s,
+                                    %(filedatetime)s
+                                    );
+                        """
+
+#------------------------------------------------------------------------------------------------------
+def get_api_articles_params(art_info):
+    """
+    Return the query parameters for SQL_REPLACE_API_ARTICLES for the article
+    """
+    # string entries in the SQL must match an attr of the art_info instance.
+    ret_val = art_info.__dict__.copy()
+    # the element objects in the author_xml_list cause an error in the action query 
+    # even though that dict entry is not used.  So removed in a copy.
+    ret_val["author_xml_list"] = None
+    return ret_val
+
 #------------------------------------------------------------------------------------------------------
 def add_article_to_api_articles_table(ocd, art_info, verbose=None):
     """
@@ -1181,78 +1587,9 @@ def add_article_to_api_articles_table(ocd, art_info, verbose=None):
         print (msg)
     
     ocd.open_connection(caller_name="processArticles")
-  
-    insert_if_not_exists = r"""REPLACE
-                               INTO api_articles (
-                                    art_id,
-                                    art_doi,
-                                    art_type,
-                                    art_lang,
-                                    art_kwds,
-                                    art_auth_mast,
-                                    art_auth_citation,
-                                    art_title,
-                                    src_title_abbr,
-                                    src_code,
-                                    art_year,
-                                    art_vol,
-                                    art_vol_str,
-                                    art_vol_suffix,
-                                    art_issue,
-                                    art_pgrg,
-                                    art_pgstart,
-                                    art_pgend,
-                                    main_toc_id,
-                                    start_sectname,
-                                    bk_info_xml,
-                                    bk_title,
-                                    bk_publisher,
-                                    art_citeas_xml,
-                                    art_citeas_text,
-                                    ref_count,
-                                    filename,
-                                    filedatetime
-                                    )
-                                values (
-                                        %(art_id)s,
-                                        %(art_doi)s,
-                                        %(art_type)s,
-                                        %(art_lang)s,
-                                        %(art_kwds)s,
-                                        %(art_auth_mast)s,
-                                        %(art_auth_citation)s,
-                                        %(art_title)s,
-                                        %(src_title_abbr)s,
-                                        %(src_code)s,
-                                        %(art_year)s,
-                                        %(art_vol_int)s,
-                                        %(art_vol_str)s,
-                                        %(art_vol_suffix)s,
-                                        %(art_issue)s,
-                                        %(art_pgrg)s,
-                                        %(art_pgstart)s,
-                                        %(art_pgend)s,
-                                        %(main_toc_id)s,
-                                        %(start_sectname)s,
-                                        %(bk_info_xml)s,
-                                        %(bk_title)s,
-                                        %(bk_publisher)s,
-                                        %(art_citeas_xml)s,
-                                        %(art_citeas_text)s,
-                                        %(ref_count)s,
-                                        %(filename)s,
-                                        %(filedatetime)s
-                                        );
-                            """
-
-    # string entries above must match an attr of the art_info instance.
-    query_param_dict = art_info.__dict__.copy()
-    # the element objects in the author_xml_list cause an error in the action query 
-    # even though that dict entry is not used.  So removed in a copy.
-    query_param_dict["author_xml_list"] = None
-        
+    query_param_dict = get_api_articles_params(art_info)
     try:
-        res = ocd.do_action_query(querytxt=insert_if_not_exists, queryparams=query_param_dict)
+        res = ocd.do_action_query(querytxt=SQL_REPLACE_API_ARTICLES, queryparams=query_param_dict)
     except Exception as e:
         errStr = f"api_articles table insert error {e}"
         logger.error(errStr)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+opasTermDictionary
+
+In-process term dictionaries (the indexed terms and their document counts) for the fields used
+  by the WordWheel endpoint and get_term_index, so prefix lookups don't need a Solr /terms request,
+  and offset paging is real rather than simulated.
+
+The terms of each configured field (opasConfig.TERM_DICTIONARY_FIELDS) are exported from Solr in
+  index order, in pages, and kept sorted and front coded: in blocks of block_size terms, the first
+  term is kept whole (for binary search), and each of the rest as the length of the prefix it
+  shares with the term before it, and the rest of the term.  The counts are kept in an array.
+
+A dictionary is rebuilt (in the background) when its core's index version changes, i.e., after
+  a load, and until the first one is built, callers use Solr.
+
+>>> term_dict = TermDictionary([("love", 50), ("loved", 20), ("lovelace", 1), ("lovely", 9), ("lover", 20), ("lust", 3)], block_size=2)
+>>> term_dict.lookup("love", limit=3)
+[('love', 50), ('loved', 20), ('lover', 20)]
+>>> term_dict.lookup("love", offset=1, limit=3, order="index")
+[('loved', 20), ('lovelace', 1), ('lovely', 9)]
+>>> term_dict.lookup("love", start_at="lovel", order="index")
+[('lovelace', 1), ('lovely', 9), ('lover', 20)]
+>>> term_dict.prefix_count("lov"), len(term_dict)
+(5, 6)
+"""
+
+__author__      = "Neil R. Shapiro"
+__copyright__   = "Copyright 2021, Psychoanalytic Electronic Publishing"
+__license__     = "Apache 2.0"
+__version__     = "2021.0301.1"
+__status__      = "Development"
+
+import sys
+import array
+import bisect
+import heapq
+
+sys.path.append('../config')
+
+import opasConfig
+import opasCacheSupport
+
+import logging
+logger = logging.getLogger(__name__)
+
+def shared_prefix_len(term1, term2):
+    """
+    >>> shared_prefix_len("lovelace", "lovely")
+    5
+    """
+    ret_val = 0
+    for char1, char2 in zip(term1, term2):
+        if char1 != char2:
+            break
+        ret_val += 1
+    return ret_val
+
+def prefix_successor(prefix):
+    """
+    The first string after all the strings starting with prefix (None for any string)
+
+    >>> prefix_successor("lov")
+    'low'
+    """
+    ret_val = None
+    if prefix:
+        ret_val = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return ret_val
+
+class TermDictionary(object):
+    """
+    Front coded sorted terms of a field, with their counts, from (term, count) tuples in index (sorted) order
+    """
+    def __init__(self, term_counts, block_size=opasConfig.TERM_DICTIONARY_BLOCK_SIZE, version=None):
+        self.block_size = block_size
+        self.version = version
+        self.heads = []      # first term of each block
+        self.blocks = []     # the rest of the block's terms: chr(shared prefix length) + chr(suffix length) + suffix, each
+        self.counts = array.array("q")
+        block = []
+        last_term = None
+        for term, count in term_counts:
+            if len(self.counts) % block_size == 0:
+                if self.heads:
+                    self.blocks.append("".join(block))
+                self.heads.append(term)
+                block = []
+            else:
+                shared = shared_prefix_len(last_term, term)
+                block.append(chr(shared) + chr(len(term) - shared) + term[shared:])
+            self.counts.append(count)
+            last_term = term
+        if self.heads:
+            self.blocks.append("".join(block))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def block_terms(self, block_num):
+        """
+        All the terms of a block, decoded
+        """
+        term = self.heads[block_num]
+        ret_val = [term]
+        block = self.blocks[block_num]
+        pos = 0
+        while pos < len(block):
+            shared = ord(block[pos])
+            suffix_end = pos + 2 + ord(block[pos + 1])
+            term = term[:shared] + block[pos + 2:suffix_end]
+            ret_val.append(term)
+            pos = suffix_end
+        return ret_val
+
+    def term(self, term_num):
+        block_num, pos = divmod(term_num, self.block_size)
+        return self.block_terms(block_num)[pos]
+
+    def lower_bound(self, term):
+        """
+        Number of the first term >= term (binary search of the block heads, then within the block)
+        """
+        if term is None:
+            return len(self.counts)
+        block_num = bisect.bisect_right(self.heads, term) - 1
+        if block_num < 0:
+            return 0
+        return block_num * self.block_size + bisect.bisect_left(self.block_terms(block_num), term)
+
+    def prefix_range(self, prefix, start_at=None):
+        """
+        Numbers (start, end) of the terms starting with prefix (and >= start_at)
+        """
+        start = self.lower_bound(max(prefix, start_at or ""))
+        end = self.lower_bound(prefix_successor(prefix))
+        return start, max(start, end)
+
+    def prefix_count(self, prefix, start_at=None):
+        start, end = self.prefix_range(prefix, start_at=start_at)
+        return end - start
+
+    def lookup(self, prefix, offset=0, limit=opasConfig.DEFAULT_LIMIT_FOR_SOLR_RETURNS, order="count", start_at=None):
+        """
+        (term, count) tuples for the terms starting with prefix, in order "count" (highest first, then index order,
+          as Solr's terms.sort=count) or "index".
+        """
+        start, end = self.prefix_range(prefix, start_at=start_at)
+        if order == "index":
+            term_nums = range(min(start + offset, end), min(start + offset + limit, end))
+        else:
+            term_nums = heapq.nlargest(offset + limit, range(start, end), key=self.counts.__getitem__)[offset:]
+
+        ret_val = []
+        decoded_block_num = None
+        for term_num in term_nums:
+            block_num, pos = divmod(term_num, self.block_size)
+            if block_num != decoded_block_num:
+                block_terms = self.block_terms(block_num)
+                decoded_block_num = block_num
+            ret_val.append((block_terms[pos], self.counts[term_num]))
+
+        return ret_val
+
+def export_terms(solr_core, field, page_size=opasConfig.TERM_DICTIONARY_EXPORT_PAGE_SIZE):
+    """
+    All the terms of a field (with counts), in index order, from the Solr terms handler, a page at a time
+    """
+    lower = None
+    while True:
+        args = {"terms.sort": "index",
+                "terms.limit": page_size,
+                "terms.mincount": 1
+                }
+        if lower is not None:
+            args["terms.lower"] = lower
+            args["terms.lower.incl"] = "false"
+        results = solr_core.suggest_terms(fields=field, prefix="", handler="terms", **args)
+        page = results.get(field, [])
+        yield from page
+        if len(page) < page_size:
+            break
+        lower = page[-1][0]
+
+class TermDictionaries(opasCacheSupport.BackgroundRebuilder):
+    """
+    The term dictionaries of the configured fields of each core, rebuilt in the background
+      when the core's index version changes (checked at most every check_interval seconds).
+    """
+    def __init__(self, cores, read_version, fields=opasConfig.TERM_DICTIONARY_FIELDS, check_interval=opasConfig.TERM_DICTIONARY_CHECK_INTERVAL, preload=opasConfig.TERM_DICTIONARY_PRELOAD):
+        super().__init__("term dictionaries", {core: cores[core] for core in fields}, read_version, check_interval=check_interval, preload=preload)
+        self.fields = fields
+        self.dictionaries = {}
+        self.builds = 0
+
+    def get(self, core, field):
+        """
+        The TermDictionary of a core's field, or None if it's not configured or not built yet
+        """
+        if field not in self.fields.get(core, []):
+            return None
+
+        self.check(core)
+        return self.dictionaries.get((core, field))
+
+    def rebuild_core(self, core, version):
+        """
+        Rebuild the core's term dictionaries, unless they're of the current index version
+        """
+        for field in self.fields[core]:
+            term_dict = self.dictionaries.get((core, field))
+            # without a version to compare, keep the dictionary rather than rebuild each check interval
+            if term_dict is None or (version is not None and version != term_dict.version):
+                try:
+                    self.dictionaries[(core, field)] = TermDictionary(export_terms(self.cores[core], field), version=version)
+                except Exception as e:
+                    logger.error(f"Can't build the {core} {field} term dictionary: {e}")
+                else:
+                    self.builds += 1
+                    logger.info(f"Term dictionary {core} {field} built: {len(self.dictionaries[(core, field)])} terms (index version {version}).")
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS|doctest.NORMALIZE_WHITESPACE)
+    print ("All tests complete!")
@@ -74,6 +74,7 @@ import logging
 logger = logging.getLogger(__name__)
 import copy
 import urllib
+import urllib.parse
 import urllib.request
 os.environ['XML_CATALOG_FILES'] = urllib.request.pathname2url(r"X:\_PEPA1\catalog.xml")
 import datetime
@@ -149,11 +150,39 @@ def xml_remove_tags(root, remove_tags=[]):
     return ret_val
     
 # -------------------------------------------------------------------------------------------------------
-class FirstPageCollector:
+EXCERPT_PUNCT = ".!?)>" # the excerpt is backed off to the last of these
+EXCERPT_SINGLE_CHAR_ENCODE = {"'": "&apos;", '"': "&quot;"}
+
+def excerpt_back_off_to_punct(text):
+    """
+    Return text up to and including the last punctuation character (EXCERPT_PUNCT), with one search rather
+      than a character at a time loop.  Raises IndexError if there isn't one.
+
+    >>> excerpt_back_off_to_punct("<p>One. Two three")
+    '<p>One.'
+    """
+    ret_val = max(text.rfind(char) for char in EXCERPT_PUNCT)
+    if ret_val < 0:
+        raise IndexError("string index out of range")
+
+    return text[:ret_val + 1]
+
+class FirstPageExcerptBuilder(object):
+    """
+    Builds the first page excerpt for articles without abstracts from the events of a walk of the document
+      tree (get_first_page_excerpt_from_doc_root), with the same output as the FirstPageCollector XMLParser
+      target it replaces, but in linear time: the excerpt is kept in a list of fragments rather
+      than a string added to, and backing off to the last punctuation is done by search rather than a
+      character at a time.  The walk stops when the excerpt is complete.
+
+    >>> root = etree.fromstring('<pepkbd3><artinfo/><body><p>A first &amp; second sentence. And more</p><pb><n>1</n></pb><p>Page two</p></body></pepkbd3>')
+    >>> get_first_page_excerpt_from_doc_root(root)
+    '<abs><p>A first &amp; second sentence. And more</p><pb><n>1</n></pb><p>Page two</p></abs>'
+    """
     def __init__(self, skip_tags=["impx", "tab"], para_limit=opasConfig.MAX_EXCERPT_PARAS, char_limit=opasConfig.MAX_EXCERPT_CHARS, char_min=opasConfig.MIN_EXCERPT_CHARS):
-        self.events = []
-        self.doc = "<abs>"
+        self.doc = ["<abs>"]
         self.in_body = False
+        self.body_done = False
         self.tag_stack = []
         self.skip_tags = skip_tags
         self.para_limit = para_limit
@@ -163,20 +192,19 @@ class FirstPageCollector:
         self.char_count = 0
         self.fini = False # all closed up and ready to stop
         self.close_up = False
-        
+
     def start(self, tag, attrib):
         if tag not in self.skip_tags and self.in_body:
-            self.events.append("start %s %r" % (tag, dict(attrib)))
             att_str = ""
             for key, val in attrib.items():
                 if key in ["url"]: # only do this in special cases...if it's a title, we don't want it quoted
                     val = urllib.parse.quote_plus(val)
                 att_str += f'{key}="{val}" '
             if att_str == "":
-                self.doc += f"<{tag}>"
+                self.doc.append(f"<{tag}>")
             else:
                 att_str = att_str.rstrip()
-                self.doc += f"<{tag} {att_str}>"
+                self.doc.append(f"<{tag} {att_str}>")
             self.tag_stack.append(tag)
             
         if tag == "body":
@@ -186,63 +214,51 @@ class FirstPageCollector:
         if tag not in self.skip_tags and tag == "body" and self.in_body:
             # no pb in body.  Stop recording.
             self.in_body = False
+            self.body_done = True
             #close outer tag
-            self.doc += "</abs>"
+            self.doc.append("</abs>")
             
         if tag not in self.skip_tags and self.in_body:
-            self.events.append("end %s" % tag)
-          
             if tag == "pb" or tag == "p":
                 if tag == "p": # count paras
                     self.para_count += 1
 
                 if self.para_count > self.para_limit:
-                    msg = f"   ...Paragraph limit {self.para_limit} for excerpt reached. Para Count: {self.para_count}, Char Count: {self.char_count}"
-                    logger.debug(msg)
-                    if show_dbg_messages: print (msg)
+                    logger.debug(f"   ...Paragraph limit {self.para_limit} for excerpt reached. Para Count: {self.para_count}, Char Count: {self.char_count}")
                     self.close_up = True
     
                 if self.char_count > self.char_limit:
-                    msg = f"   ...Character limit {self.char_limit} for excerpt reached or exceeded, at end of para. Para Count: {self.para_count}, Char Count: {self.char_count}."
-                    logger.debug(msg)
-                    if show_dbg_messages: print (msg)
+                    logger.debug(f"   ...Character limit {self.char_limit} for excerpt reached or exceeded, at end of para. Para Count: {self.para_count}, Char Count: {self.char_count}.")
                     self.close_up = True
                 
                 if tag == "pb" and self.char_count > self.char_min:
                     self.close_up = True
             
                 if self.close_up:
-                    punct = r'[\.\!\?\)\>]+'
+                    # only happens once, so one join here doesn't make it quadratic
+                    doc = "".join(self.doc)
                     if tag == "p": # this could be the last para, and it could be a split para (p then p2)
                         #  back off text to last punctuation.  If you hit a tag (>), stop, can't go further.
-                        google_safe = self.doc
-                        while re.match(punct, google_safe[-1]) is None:
-                            google_safe = google_safe[:-1]
-                        self.doc = google_safe
+                        doc = excerpt_back_off_to_punct(doc)
                     
                     if tag == "pb": # this could be a pb between a split para
                         #  back off text to last punctuation.  If you hit a tag (>), stop, can't go further.
-                        google_safe_list = self.doc.split(sep="<pb>")
+                        google_safe_list = doc.split(sep="<pb>")
                         pb_tag = google_safe_list[-1]
-                        google_safe = "<pb>".join(google_safe_list[0:-1])
-                        while re.match(punct, google_safe[-1]) is None:
-                            google_safe = google_safe[:-1]
+                        google_safe = excerpt_back_off_to_punct("<pb>".join(google_safe_list[0:-1]))
     
                         # see if we need to go behind para tag (for split para)
                         google_safe2_list = google_safe.split(sep="</p>")
                         if google_safe2_list[-1] == "": #  it should be
-                            # could make more efficient just using re.split on punct. #TODO
-                            while re.match(punct, google_safe2_list[-2][-1]) is None and google_safe2_list[-2] is not "":
-                                google_safe2_list[-2] = google_safe2_list[-2][:-1]
-                            google_safe2 = '</p>'.join(google_safe2_list)
-                            self.doc = google_safe2 + "<pb>" + pb_tag
+                            google_safe2_list[-2] = excerpt_back_off_to_punct(google_safe2_list[-2])
+                            doc = '</p>'.join(google_safe2_list) + "<pb>" + pb_tag
                         else:
                             # not sure why this would be, don't do anything
-                            msg = f"Unaccounted for text when excerpting...first 50 chars of discarded text: {google_safe2_list[-1][:50]}"
-                            logger.debug(msg)
-                            if show_dbg_messages: print (msg)
+                            logger.debug(f"Unaccounted for text when excerpting...first 50 chars of discarded text: {google_safe2_list[-1][:50]}")
+
+                    self.doc = [doc]
                     
-            self.doc += f"</{tag}>"
+            self.doc.append(f"</{tag}>")
             if len(self.tag_stack) > 0:
                 self.tag_stack.pop()
                 
@@ -252,32 +268,22 @@ class FirstPageCollector:
                     self.in_body = False # skip the rest.
                     while len(self.tag_stack) > 0:
                         tag_to_close = self.tag_stack.pop()
-                        self.doc += f"</{tag_to_close}>"
-                    self.doc += "</abs>"
+                        self.doc.append(f"</{tag_to_close}>")
+                    self.doc.append("</abs>")
                     self.fini = True
             
     def data(self, data):
+        """
+        Text from the tree, which (unlike the parser's pieces of it) isn't split at character references, so
+          it's escaped here as serializing and parsing it would.
+        """
         if self.in_body:
-            if data == "&":
-                data = "&amp;" # reencode
-            elif data == "<":
-                data = "&lt;" # reencode
-            elif data == ">":
-                data = "&gt;" # reencode
-            elif data == "'":
-                data = "&apos;" # reencode    
-            elif data == '"':
-                data = "&quot;" # reencode    
-            self.events.append("data %r" % data)
+            data = EXCERPT_SINGLE_CHAR_ENCODE.get(data, None) or data.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
             self.char_count += len(data)
-            self.doc += f"{data}"
+            self.doc.append(data)
             
-    def comment(self, text):
-        self.events.append("comment %s" % text)
-        
     def close(self):
-        self.events.append("close")
-        return self.doc
+        return "".join(self.doc)
 
 # -------------------------------------------------------------------------------------------------------
 class XSLT_Transformer(object):
@@ -773,6 +779,170 @@ def xml_get_pages(xmlstr, offset=0, limit=1, inside="body", env="body", pagebrk=
 
     return ret_val
 
+rcx_xml_markup = re.compile(r"""<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!DOCTYPE[^>\[]*(?:\[.*?\])?\s*>|<(?P<close>/)?(?P<name>[A-Za-z_][\w.:\-]*)(?:[^>"']|"[^"]*"|'[^']*')*?(?P<empty>/)?>""", re.DOTALL)
+rcx_page_map_markers = re.compile(f"{opasConfig.HITMARKERSTART}|{opasConfig.HITMARKEREND}")
+
+def xml_get_page_map(xmlstr, inside="body", pagebrk="pb", pagenbr="n"):
+    """
+    Return a page map of the xml string, so pages can be extracted (xml_get_pages_from_page_map) without
+      parsing the whole document.  Offsets are character offsets in xmlstr.  Computed by the loader, and
+      stored with the document (art_pgmap).
+
+       front: [start, end] of what's in the root element before the 'inside' element
+       inside: [start, end] of the content of the 'inside' element
+       pb: [start, end, page number] of each page break which is a child of the 'inside' element
+       pb_count: count of all page breaks (at any level)
+
+    Returns None if the string can't be mapped (e.g., there's no 'inside' element).
+
+    >>> page_map = xml_get_page_map(test_xml2, inside="test")
+    >>> [pb[2] for pb in page_map["pb"]], page_map["pb_count"]
+    (['1', '2', '3', '4', '5'], 5)
+    >>> test_xml2[page_map["pb"][0][0]:page_map["pb"][0][1]]
+    '<pb><n>1</n></pb>'
+    """
+    ret_val = None
+    depth = 0
+    root_start = None
+    inside_tag_start = inside_start = inside_end = None
+    inside_depth = None
+    pb_start = pb_depth = None
+    page_breaks = []
+    pb_count = 0
+    try:
+        for m in rcx_xml_markup.finditer(xmlstr):
+            name = m.group("name")
+            if name is None: # comment, processing instruction, etc.
+                continue
+
+            if m.group("close"):
+                depth -= 1
+                if pb_start is not None and depth == pb_depth:
+                    page_breaks.append((pb_start, m.end()))
+                    pb_start = None
+                elif inside_start is not None and inside_end is None and depth == inside_depth:
+                    inside_end = m.start()
+            else:
+                if root_start is None:
+                    root_start = m.end()
+                if name == pagebrk:
+                    pb_count += 1
+                    if inside_start is not None and inside_end is None and depth == inside_depth + 1 and pb_start is None:
+                        if m.group("empty"):
+                            page_breaks.append((m.start(), m.end()))
+                        else:
+                            pb_start = m.start()
+                            pb_depth = depth
+                elif name == inside and inside_start is None and not m.group("empty"):
+                    inside_tag_start = m.start()
+                    inside_start = m.end()
+                    inside_depth = depth
+
+                if not m.group("empty"):
+                    depth += 1
+    except Exception as e:
+        logger.error(f"Error mapping pages: {e}")
+    else:
+        if inside_start is not None and inside_end is not None:
+            rcx_page_nbr = re.compile(f"<{pagenbr}(?:\\s[^>]*)?>([^<]*)")
+            pb_list = []
+            for start, end in page_breaks:
+                m = rcx_page_nbr.search(xmlstr, start, end)
+                pb_list.append([start, end, m.group(1) if m is not None else None])
+
+            ret_val = {"front": [root_start, inside_tag_start],
+                       "inside": [inside_start, inside_end],
+                       "pb": pb_list,
+                       "pb_count": pb_count
+                      }
+
+    return ret_val
+
+def xml_get_pages_from_page_map(xmlstr, page_map, offset=0, limit=1, env="body"):
+    """
+    xml_get_pages, for the 'inside' and page breaks the page map (xml_get_page_map) was made with, but by
+      slicing xmlstr at the mapped offsets rather than parsing it, so the cost depends on the size of the pages
+      rather than the document.  The elements (second entry of the returned tuple) aren't returned.
+
+    Search hit markers (Solr highlighting) in xmlstr are allowed for; the map is of the text without them.
+    Raises ValueError if the map doesn't fit xmlstr.
+
+    >>> page_map = xml_get_page_map(test_xml2, inside="test")
+    >>> ret_tuple = xml_get_pages_from_page_map(test_xml2, page_map, 2, 1)
+    >>> ret_tuple[0]
+    '<body>\\n<p id="4">Another random paragraph</p>\\n                <p id="5">Another <b>random</b> paragraph with multiple <b>subelements</b></p>\\n                <pb><n>3</n></pb>\\n</body>\\n'
+    >>> ret_tuple[2:]
+    ('3', '3')
+    >>> ret_tuple = xml_get_pages_from_page_map(test_xml2.replace("random paragraph</p>", "random #@@@paragraph@@@#</p>"), page_map, 2, 1)
+    >>> ret_tuple[0][:53]
+    '<body>\\n<p id="4">Another random #@@@paragraph@@@#</p>'
+    >>> ret_tuple[2:]
+    ('3', '3')
+    """
+    no_page_nbr = "npn"
+    ret_val = ("", [], no_page_nbr, no_page_nbr)
+    if limit is None:
+        ret_val = (xmlstr, [], no_page_nbr, no_page_nbr)
+    else:
+        if offset == 0 or offset is None:
+            offset = 1
+            offset1 = 0
+        else:
+            offset1 = offset
+        offset2 = offset1 + limit
+        if offset2 > page_map["pb_count"]: # as xml_get_pages does
+            offset2 = page_map["pb_count"] - 2
+
+        # map offsets in the text without hit markers to offsets in xmlstr
+        marker_positions = [] # (position in the text without markers, marker chars up to and including it, end marker)
+        inserted = 0
+        for m in rcx_page_map_markers.finditer(xmlstr):
+            marker_pos = m.start() - inserted
+            inserted += m.end() - m.start()
+            marker_positions.append((marker_pos, inserted, m.group(0) == opasConfig.HITMARKEREND))
+
+        def pos(map_offset):
+            # markers at the offset go with the text they mark: an end marker before it, a start marker after
+            ret_val = map_offset
+            for marker_pos, marker_inserted, end_marker in marker_positions:
+                if marker_pos < map_offset or (marker_pos == map_offset and end_marker):
+                    ret_val = map_offset + marker_inserted
+                else:
+                    break
+            return ret_val
+
+        page_breaks = page_map["pb"]
+        def page_break(n):
+            # nth (1 based) page break child of inside (like xpath [n]), or None
+            return page_breaks[n - 1] if 0 < n <= len(page_breaks) else None
+
+        for pb in (page_breaks[0], page_breaks[-1]) if page_breaks else ():
+            if not xmlstr.startswith("<", pos(pb[0])) or not xmlstr.endswith(">", 0, pos(pb[1])):
+                raise ValueError("Page map doesn't match the document")
+
+        first_pb = page_break(offset1 + 1)
+        first_pn = first_pb[2] if first_pb is not None and first_pb[2] is not None else no_page_nbr
+        last_pb = page_break(offset2)
+        last_pn = last_pb[2] if last_pb is not None and last_pb[2] is not None else no_page_nbr
+
+        new_xml = f"<{env}>\n"
+        if offset1 == 0: # all before the page break ending the last page, including the front matter
+            if last_pb is not None:
+                front_start, front_end = page_map["front"]
+                new_xml += xmlstr[pos(front_start):pos(front_end)].strip() + "\n"
+                new_xml += xmlstr[pos(page_map["inside"][0]):pos(last_pb[1])].strip() + "\n"
+        else: # from after the page break ending the page before, to the one ending the last page (or the end)
+            start_pb = page_break(offset1)
+            # as xml_get_pages: nothing if the (limited) last page is before the first, through the end if there's no last page break
+            if start_pb is not None and not 0 < offset2 <= offset1:
+                end = pos(last_pb[1]) if last_pb is not None else pos(page_map["inside"][1])
+                new_xml += xmlstr[pos(start_pb[1]):end].strip() + "\n"
+
+        new_xml += f"</{env}>\n"
+        ret_val = (new_xml, [], first_pn, last_pn)
+
+    return ret_val
+    
 def xml_get_pages_html(xmlorhtmlstr, offset=0, limit=1, inside="div[@id='body']", env="body", pagebrk="div[@class='pagebreak']", pagenbr="p[@class='pagenumber']", remove_tags=[]):
     """
     NOT CURRENTLY USED in OPAS (2020-09-14)
@@ -1173,18 +1343,28 @@ def get_first_page_excerpt_from_doc_root(elem_or_xmlstr, ret_format="HTML"):
     Note: for performance reasons, it's best practice to use this in the database
           load process rather than run-time excerpting.  (This is currently whats done.)
     """
+    builder = FirstPageExcerptBuilder(skip_tags=["impx"])
     try:
         if isinstance(elem_or_xmlstr, lxml.etree._Element):
-            xmlstr = etree.tostring(elem_or_xmlstr, encoding="unicode")        
+            root = elem_or_xmlstr
         else:
-            xmlstr = elem_or_xmlstr
-    except Exception as err:
-        logger.error(err)
-        ret_val = None
-        
-    parser = etree.XMLParser(target = FirstPageCollector(skip_tags=["impx"]), recover=True, resolve_entities=False)
-    try:
-        ret_val = etree.XML(xmlstr, parser=parser)        # doctest: +ELLIPSIS
+            root = etree.XML(elem_or_xmlstr, parser=etree.XMLParser(recover=True, resolve_entities=False))
+
+        # the events an XMLParser target would get, without serializing and reparsing the document
+        for event, elem in etree.iterwalk(root, events=("start", "end")):
+            if isinstance(elem.tag, str):
+                if event == "start":
+                    builder.start(elem.tag, elem.attrib)
+                    if elem.text:
+                        builder.data(elem.text)
+                else:
+                    builder.end(elem.tag)
+            if event == "end" and elem.tail and elem is not root:
+                builder.data(elem.tail)
+            if builder.fini or builder.body_done:
+                break # the rest isn't used
+
+        ret_val = builder.close()
     except Exception as e:
         msg = f"Error extracting summary or abstract. {e}"
         logger.error(msg)
@@ -1504,6 +1684,150 @@ def get_running_head(source_title=None, pub_year=None, vol=None, issue=None, pgr
         
     return ret_val
     
+#-----------------------------------------------------------------------------
+class XMLCatalog(object):
+    """
+    Minimal OASIS XML catalog lookup (system, public, rewriteSystem and nextCatalog entries) for the
+      catalogs in XML_CATALOG_FILES, which is how libxml2 finds the local copies of the DTDs.
+    """
+    def __init__(self, catalog_files=None):
+        if catalog_files is None:
+            catalog_files = os.environ.get("XML_CATALOG_FILES", "").split()
+        self.system_ids = {}
+        self.public_ids = {}
+        self.rewrite_system = []
+        self.catalogs = []
+        for catalog_file in catalog_files:
+            self._load(catalog_file)
+        # longest match first
+        self.rewrite_system.sort(key=lambda n: len(n[0]), reverse=True)
+
+    @staticmethod
+    def local_path(url):
+        """
+        Local file path for a path or file: URL, if the file exists (otherwise None)
+        """
+        ret_val = None
+        if url:
+            if url.startswith("file:"):
+                url = urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+            if os.path.exists(url):
+                ret_val = url
+            else:
+                url = urllib.request.url2pathname(url)
+                if os.path.exists(url):
+                    ret_val = url
+
+        return ret_val
+
+    def _load(self, catalog_file):
+        filespec = self.local_path(catalog_file)
+        if filespec is None or filespec in self.catalogs:
+            return
+        try:
+            root = etree.parse(filespec).getroot()
+        except (OSError, etree.XMLSyntaxError) as e:
+            logger.warning(f"Can't read XML catalog {filespec}: {e}")
+            return
+
+        self.catalogs.append(filespec)
+        base = os.path.dirname(filespec)
+        uri = lambda attr: os.path.join(base, urllib.request.url2pathname(elem.get(attr, "")))
+        for elem in root.iter(etree.Element):
+            tag = etree.QName(elem).localname
+            if tag == "system":
+                self.system_ids[elem.get("systemId")] = uri("uri")
+            elif tag == "public":
+                self.public_ids[elem.get("publicId")] = uri("uri")
+            elif tag == "rewriteSystem":
+                self.rewrite_system.append((elem.get("systemIdStartString"), uri("rewritePrefix")))
+            elif tag == "nextCatalog":
+                self._load(uri("catalog"))
+
+    def lookup(self, system_id, public_id=None):
+        """
+        Return the local file for the system or public id, or None if the catalogs don't have it
+        """
+        ret_val = self.system_ids.get(system_id)
+        if ret_val is None and system_id:
+            for prefix, rewrite_prefix in self.rewrite_system:
+                if system_id.startswith(prefix):
+                    ret_val = rewrite_prefix + system_id[len(prefix):]
+                    break
+        if ret_val is None and public_id:
+            ret_val = self.public_ids.get(public_id)
+
+        return ret_val
+
+class CachedDTDResolver(etree.Resolver):
+    """
+    Parser resolver keeping the DTD and entity files in memory, so after the first article a load
+      doesn't read them again.  Files are found with the XML catalog or by path; anything else
+      is left to libxml2's own loading.
+    """
+    def __init__(self, catalog=None):
+        super().__init__()
+        self.catalog = catalog if catalog is not None else XMLCatalog()
+        self.files = {} # (system_url, public_id): (filespec, contents), or (None, None) if not found
+        self.loads = 0
+        self.hits = 0
+
+    def resolve(self, system_url, public_id, context):
+        key = (system_url, public_id)
+        if key in self.files:
+            filespec, contents = self.files[key]
+            if contents is not None:
+                self.hits += 1
+        else:
+            filespec = self.catalog.lookup(system_url, public_id) or self.catalog.local_path(system_url)
+            contents = None
+            if filespec is not None:
+                try:
+                    with open(filespec, "rb") as f:
+                        contents = f.read()
+                    self.loads += 1
+                except OSError as e:
+                    logger.warning(f"Can't read {filespec} for {system_url}: {e}")
+            self.files[key] = (filespec, contents)
+
+        if contents is None:
+            return None
+
+        # the base url is the file's, so files it refers to (e.g., entity sets) are found relative to it
+        return self.resolve_string(contents, context, base_url=filespec)
+
+def new_dtd_parser(resolver=None):
+    """
+    Parser loading the DTD and resolving entities (as the data loader needs), with a CachedDTDResolver
+    """
+    ret_val = lxml.etree.XMLParser(encoding='utf-8', recover=True, resolve_entities=True, load_dtd=True)
+    ret_val.resolvers.add(resolver if resolver is not None else CachedDTDResolver())
+    return ret_val
+
+_dtd_parser = None
+
+def xml_bytes_to_etree(xml_bytes, parser=None):
+    """
+    Parse a document (bytes, encoding declaration and all) with the DTD and entities, by default with
+      a parser shared for the life of the process, so the DTD and entity files are only read once.
+    """
+    global _dtd_parser
+    if parser is None:
+        if _dtd_parser is None:
+            _dtd_parser = new_dtd_parser()
+        parser = _dtd_parser
+
+    return etree.fromstring(xml_bytes, parser)
+
+def xml_bytes_to_str(xml_bytes):
+    """
+    Decode a file read as bytes to the same string as reading it in text mode (utf-8, universal newlines)
+
+    >>> xml_bytes_to_str(b'<?xml version="1.0" encoding="UTF-8"?>\\r\\n<p>caf\\xc3\\xa9</p>\\r')
+    '<?xml version="1.0" encoding="UTF-8"?>\\n<p>caf\xe9</p>\\n'
+    """
+    return xml_bytes.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
 def xml_file_to_xmlstr(xml_file, remove_encoding=False, resolve_entities=True, dtd_validations=True):
     """
     Read XML file and convert it to an XML string, expanding all entities
@@ -1593,9 +1917,11 @@ def xml_str_to_html(elem_or_xmlstr, transformer_name=opasConfig.TRANSFORMER_XMLT
                         ret_val = ret_val.replace("%24OPAS_IMAGE_URL;", APIURL + IMAGE_API_LINK)
     return ret_val
 
-def html_to_epub(htmlstr, output_filename_base, art_id, lang="en", html_title=None, stylesheet=opasConfig.CSS_STYLESHEET): #  e.g., "./libs/styles/pep-html-preview.css"
+def html_to_epub(htmlstr, output_filename_base, art_id, lang="en", html_title=None, stylesheet=opasConfig.CSS_STYLESHEET, output_filename=None): #  e.g., "./libs/styles/pep-html-preview.css"
     """
     uses ebooklib
+
+    Writes the epub to output_filename if given, otherwise to output_filename_base + ".epub" in the temp directory.
     
     >>> htmlstr = xml_str_to_html(test_xml3)
     >>> document_id = "epubconversiontest"
@@ -1666,7 +1992,10 @@ def html_to_epub(htmlstr, output_filename_base, art_id, lang="en", html_title=No
     book.spine = ['nav', c1, c2]
     book.add_item(epub.EpubNcx())
     book.add_item(epub.EpubNav())    
-    filename = os.path.join(opasConfig.TEMPDIRECTORY, basename + '.epub')
+    if output_filename is not None:
+        filename = output_filename
+    else:
+        filename = os.path.join(opasConfig.TEMPDIRECTORY, basename + '.epub')
     epub.write_epub(filename, book)
     return filename
 
@@ -114,6 +114,7 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from starlette.requests import Request
 from starlette.responses import JSONResponse, Response, FileResponse, StreamingResponse # RedirectResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import starlette.status as httpCodes
 #from starlette.middleware.sessions import SessionMiddleware
 #from typing import Optional
@@ -146,7 +147,10 @@ import opasQueryHelper
 import opasSchemaHelper
 import opasDocPermissions
 import opasPySolrLib
-from opasPySolrLib import search_text, search_text_qs
+import opasSolrAsync
+import opasDownloadSupport
+import opasGlossarySupport
+from opasPySolrLib import search_text, search_text_qs_async
 
 # Check text server version
 text_server_ver = None
@@ -337,10 +341,34 @@ def log_endpoint(request, client_id=None, session_id=None, path_params=True):
         url = urllib.parse.unquote(f"....{request.url}")
         logger.info(f"************ URL: {url}")
 
-def log_endpoint_time(request, ts): 
+def log_endpoint_time(request, ts):
     if opasConfig.LOG_CALL_TIMING:
         logger.info(f"***{request['path']} response time: {time.time() - ts}***")
 
+# ############################################################################
+# Server events
+# ############################################################################
+@app.on_event("startup")
+async def startup_event():
+    # list the images in the background, so image requests can be resolved without file system (S3) calls
+    opasFileSupport.get_image_manifest().refresh_in_background()
+    # load the journal and volume lists into the metadata cache (also in the background)
+    opasAPISupportLib.metadata_prewarm_in_background()
+    # load the in-memory glossary, WordWheel term dictionaries and next/previous navigation index
+    #  (each unless its *_PRELOAD flag in opasConfig is off)
+    for in_memory_index in (opasGlossarySupport.glossary_index, opasPySolrLib.term_dictionaries, opasPySolrLib.navigation_index):
+        in_memory_index.load_in_background()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # write any queued usage log records before the connections are closed
+    opasCentralDBLib.log_writer.stop()
+    logger.info(f"Log writer stats at shutdown: {opasCentralDBLib.log_writer.stats()}")
+    logger.info(f"DB Pool stats at shutdown: {opasCentralDBLib.db_pool.stats()}")
+    opasCentralDBLib.db_pool.dispose()
+    await opasSolrAsync.close_all()
+    opasDownloadSupport.download_renderer.shutdown()
+
 # ############################################################################
 # EndPoints
 # ############################################################################
@@ -468,6 +496,7 @@ async def reports(response: Response,
                   limit: int=Query(100, title=opasConfig.TITLE_LIMIT, description=opasConfig.DESCRIPTION_LIMIT),
                   offset: int=Query(0, title=opasConfig.TITLE_OFFSET, description=opasConfig.DESCRIPTION_OFFSET), 
                   download:bool=Query(False, title=opasConfig.TITLE_DOWNLOAD, description=opasConfig.DESCRIPTION_DOWNLOAD), 
+                  downloadformat:str=Query("csv", title=opasConfig.TITLE_DOWNLOADFORMAT, description=opasConfig.DESCRIPTION_DOWNLOADFORMAT), 
                   client_id:int=Depends(get_client_id), 
                   client_session:str= Depends(get_client_session), 
                   api_key: APIKey = Depends(get_api_key)
@@ -500,6 +529,8 @@ async def reports(response: Response,
  
       Note as the examples above, you don't need to include special regex wildcards (it matches anywhere in the text)
 
+      With download, the report is streamed as CSV, or with downloadformat=ndjson, as one JSON object per line.
+
     ### Potential Errors
        #NA
 
@@ -637,16 +668,19 @@ async def reports(response: Response,
         select += f"{limit_clause};"
         
         if download:
-            # Download CSV of selected set.  Returns only response with download, not usual documentList
-            #   response to client
-            results = ocd.get_select_as_list(select)
-            df = pd.DataFrame(results)
-            stream = io.StringIO()
-            df.to_csv(stream, header=header, index = False)
-            response = StreamingResponse(iter([stream.getvalue()]),
-                                         media_type="text/csv"
+            # Download CSV (or NDJSON) of selected set.  Returns only response with download, not usual documentList
+            #   response to client.  Streamed from a server side cursor, so the report isn't held in memory.
+            downloadformat = downloadformat.lower()
+            if downloadformat not in opasAPISupportLib.REPORT_DOWNLOAD_FORMATS:
+                raise HTTPException(
+                    status_code=httpCodes.HTTP_400_BAD_REQUEST, 
+                    detail=f"Download format {downloadformat} not supported"
+                )
+
+            response = StreamingResponse(opasAPISupportLib.report_download_stream_async(ocd, select, ret_format=downloadformat, header=header),
+                                         media_type=opasAPISupportLib.REPORT_DOWNLOAD_FORMATS[downloadformat]
                                                )
-            response.headers["Content-Disposition"] = f"attachment; filename={report_view}.csv"
+            response.headers["Content-Disposition"] = f"attachment; filename={report_view}.{downloadformat}"
             ret_val = response
         else:
             results = ocd.get_select_as_list_of_dicts(select)
@@ -1360,40 +1394,26 @@ async def database_term_counts(response: Response,
             statusMsg = f"Bad Request: Field {termfield} underfined"
 
     if param_error == False:
-        results = {}  # results = {field1:{term:value, term:value, term:value}, field2:{term:value, term:value, term:value}}
-        terms = shlex.split(termlist)
-        for n in terms:
+        term_specs = []
+        for n in shlex.split(termlist):
             try:
                 # If specified as field:term
                 nfield, nterms = n.split(":")
-                result = opasAPISupportLib.get_term_count_list(nterms, nfield)
-            except:
+            except ValueError:
                 # just list of terms, use against termfield parameter
-                nterms = n.strip("', ")
-                try:
-                    result = opasAPISupportLib.get_term_count_list(nterms, term_field = termfield)
-                    for key, value in result.items():
-                        try:
-                            results[termfield][key] = value
-                        except:
-                            results[termfield] = {}
-                            results[termfield][key] = value
-                except Exception as e:
-                    detail = f"{e} - {result.error}. {result.error_description}"
-                    logger.warning(detail)
-                    # Solr Error
-                    raise HTTPException(
-                        status_code=result.httpcode, 
-                        detail=detail 
-                    )
-            else:
-                try:
-                    a = results[nfield]
-                    # exists, if we get here, so add it to the existing dict
-                    for key, value in result.items():
-                        results[nfield][key] = value
-                except: #  new dict entry
-                    results[nfield] = result
+                nfield, nterms = termfield, n
+            term_specs.append((nfield, nterms))
+
+        # results = {field1:{term:value, term:value, term:value}, field2:{term:value, term:value, term:value}}
+        results = await opasPySolrLib.get_term_counts_async(term_specs)
+        if isinstance(results, models.ErrorReturn):
+            detail = f"{results.error}. {results.error_description}"
+            logger.warning(detail)
+            # Solr Error
+            raise HTTPException(
+                status_code=results.httpcode, 
+                detail=detail 
+            )
 
         response_info = models.ResponseInfo( listType="termindex", # this is a mistake in the GVPi API, should be termIndex
                                              scopeQuery=[f"Terms: {termlist}"],
@@ -1629,11 +1649,11 @@ async def database_advanced_search(response: Response,
                                             req_url=request.url._url
                                             )
     # try the query
-    ret_val, ret_status = search_text_qs(solr_query_spec,
-                                         #authenticated=session_info.authenticated
-                                         session_info=session_info,
-                                         request=request
-                                         )
+    ret_val, ret_status = await search_text_qs_async(solr_query_spec,
+                                                     #authenticated=session_info.authenticated
+                                                     session_info=session_info,
+                                                     request=request
+                                                     )
 
     #  if there's a Solr server error in the call, it returns a non-200 ret_status[0]
     if ret_status[0] != httpCodes.HTTP_200_OK:
@@ -1785,37 +1805,38 @@ async def database_extendedsearch(response: Response,
             # see if highlight fields are selected
             hl = solrQueryOpts.hlFields is not None
 
+            # solrpy is blocking, so query in the threadpool rather than holding up the event loop
             try:
                 if hl:
-                    results = solr_core.query(q = solrQuery.searchQ,  
-                                              fq = solrQuery.filterQ,
-                                              q_op = solrQueryOpts.qOper.upper(), 
-                                              fields = solrQuerySpec.returnFields, 
-                                              # highlighting parameters
-                                              hl = "true",
-                                              hl_method = solrQueryOpts.hlMethod.lower(),
-                                              hl_bs_type="SENTENCE", 
-                                              hl_fl = solrQueryOpts.hlFields,
-                                              hl_fragsize = fragSize,  # from above
-                                              hl_maxAnalyzedChars=solrQueryOpts.hlMaxAnalyzedChars if solrQueryOpts.hlMaxAnalyzedChars>0 else opasConfig.SOLR_FULL_TEXT_MAX_ANALYZED_CHARS, 
-                                              hl_multiterm = solrQueryOpts.hlMultiterm, # def "true", # only if highlighting is on
-                                              hl_multitermQuery="true",
-                                              hl_highlightMultiTerm="true",
-                                              hl_weightMatches="true", 
-                                              hl_tag_post = solrQueryOpts.hlTagPost,
-                                              hl_tag_pre = solrQueryOpts.hlTagPre,
-                                              hl_snippets = solrQueryOpts.hlSnippets,
-                                              #hl_encoder = "html", # (doesn't work for standard, doesn't do anything we want in unified)
-                                              hl_usePhraseHighlighter = solrQueryOpts.hlUsePhraseHighlighter, # only if highlighting is on
-                                              #hl_q = solrQueryOpts.hlQ, # doesn't help with phrases; searches for None if it's none!
-                                              # morelikethis parameters
-                                              mlt = solrQueryOpts.moreLikeThisCount > 0, # if >0 turns on morelike this
-                                              mlt_fl = solrQueryOpts.moreLikeThisFields, 
-                                              mlt_count = solrQueryOpts.moreLikeThisCount,
-                                              # paging parameters
-                                              rows = solrQuerySpec.limit,
-                                              start = solrQuerySpec.offset
-                                              )
+                    results = await run_in_threadpool(solr_core.query, q = solrQuery.searchQ,  
+                                                                       fq = solrQuery.filterQ,
+                                                                       q_op = solrQueryOpts.qOper.upper(), 
+                                                                       fields = solrQuerySpec.returnFields, 
+                                                                       # highlighting parameters
+                                                                       hl = "true",
+                                                                       hl_method = solrQueryOpts.hlMethod.lower(),
+                                                                       hl_bs_type="SENTENCE", 
+                                                                       hl_fl = solrQueryOpts.hlFields,
+                                                                       hl_fragsize = fragSize,  # from above
+                                                                       hl_maxAnalyzedChars=solrQueryOpts.hlMaxAnalyzedChars if solrQueryOpts.hlMaxAnalyzedChars>0 else opasConfig.SOLR_FULL_TEXT_MAX_ANALYZED_CHARS, 
+                                                                       hl_multiterm = solrQueryOpts.hlMultiterm, # def "true", # only if highlighting is on
+                                                                       hl_multitermQuery="true",
+                                                                       hl_highlightMultiTerm="true",
+                                                                       hl_weightMatches="true", 
+                                                                       hl_tag_post = solrQueryOpts.hlTagPost,
+                                                                       hl_tag_pre = solrQueryOpts.hlTagPre,
+                                                                       hl_snippets = solrQueryOpts.hlSnippets,
+                                                                       #hl_encoder = "html", # (doesn't work for standard, doesn't do anything we want in unified)
+                                                                       hl_usePhraseHighlighter = solrQueryOpts.hlUsePhraseHighlighter, # only if highlighting is on
+                                                                       #hl_q = solrQueryOpts.hlQ, # doesn't help with phrases; searches for None if it's none!
+                                                                       # morelikethis parameters
+                                                                       mlt = solrQueryOpts.moreLikeThisCount > 0, # if >0 turns on morelike this
+                                                                       mlt_fl = solrQueryOpts.moreLikeThisFields, 
+                                                                       mlt_count = solrQueryOpts.moreLikeThisCount,
+                                                                       # paging parameters
+                                                                       rows = solrQuerySpec.limit,
+                                                                       start = solrQuerySpec.offset
+                                                                       )
                     solr_ret_list_items = []
                     for n in results.results:
                         rid = n["id"]
@@ -1823,18 +1844,18 @@ async def database_extendedsearch(response: Response,
                         item = models.SolrReturnItem(solrRet=n)
                         solr_ret_list_items.append(item)
                 else:
-                    results = solr_core.query(q = solrQuery.searchQ,  
-                                              fq = solrQuery.filterQ,
-                                              q_op = "AND", 
-                                              fields = solrQuerySpec.returnFields,
-                                              # morelikethis parameters
-                                              mlt = solrQueryOpts.moreLikeThisCount > 0, # if >0 turns on morelike this
-                                              mlt_fl = solrQueryOpts.moreLikeThisFields, 
-                                              mlt_count = solrQueryOpts.moreLikeThisCount,
-                                              # paging parameters
-                                              rows = solrQuerySpec.limit,
-                                              start = solrQuerySpec.offset
-                                              )
+                    results = await run_in_threadpool(solr_core.query, q = solrQuery.searchQ,  
+                                                                       fq = solrQuery.filterQ,
+                                                                       q_op = "AND", 
+                                                                       fields = solrQuerySpec.returnFields,
+                                                                       # morelikethis parameters
+                                                                       mlt = solrQueryOpts.moreLikeThisCount > 0, # if >0 turns on morelike this
+                                                                       mlt_fl = solrQueryOpts.moreLikeThisFields, 
+                                                                       mlt_count = solrQueryOpts.moreLikeThisCount,
+                                                                       # paging parameters
+                                                                       rows = solrQuerySpec.limit,
+                                                                       start = solrQuerySpec.offset
+                                                                       )
                     solr_ret_list_items = []
                     for n in results.results:
                         item = models.SolrReturnItem(solrRet=n)
@@ -2013,15 +2034,15 @@ async def database_search_paragraphs(response: Response,
     solr_query_params = solr_query_spec.solrQuery
     # solr_query_opts = solr_query_spec.solrQueryOpts
 
-    ret_val, ret_status = search_text_qs(solr_query_spec,
-                                         extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
-                                         limit=limit,
-                                         offset=offset,
-                                         req_url=request.url._url, 
-                                         #authenticated=session_info.authenticated
-                                         session_info=session_info,
-                                         request=request
-                                         )
+    ret_val, ret_status = await search_text_qs_async(solr_query_spec,
+                                                     extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
+                                                     limit=limit,
+                                                     offset=offset,
+                                                     req_url=request.url._url, 
+                                                     #authenticated=session_info.authenticated
+                                                     session_info=session_info,
+                                                     request=request
+                                                     )
 
     #  if there's a Solr server error in the call, it returns a non-200 ret_status[0]
     if ret_status[0] != httpCodes.HTTP_200_OK:
@@ -2227,13 +2248,13 @@ async def database_search_v2b( response: Response,
                                                       req_url = request.url._url
                                                       )
 
-    ret_val, ret_status = search_text_qs(solr_query_spec, 
-                                         extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
-                                         limit=limit,
-                                         offset=offset,
-                                         session_info=session_info,
-                                         request=request
-                                         )
+    ret_val, ret_status = await search_text_qs_async(solr_query_spec, 
+                                                     extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
+                                                     limit=limit,
+                                                     offset=offset,
+                                                     session_info=session_info,
+                                                     request=request
+                                                     )
 
     #  if there's a Solr server error in the call, it returns a non-200 ret_status[0]
     if ret_status[0] != httpCodes.HTTP_200_OK:
@@ -2421,13 +2442,13 @@ async def database_search_v2(response: Response,
                                                       req_url = request.url._url
                                                       )
 
-    ret_val, ret_status = search_text_qs(solr_query_spec, 
-                                         extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
-                                         limit=limit,
-                                         offset=offset,
-                                         session_info=session_info, 
-                                         request=request
-                                         )
+    ret_val, ret_status = await search_text_qs_async(solr_query_spec, 
+                                                     extra_context_len=opasConfig.DEFAULT_KWIC_CONTENT_LENGTH,
+                                                     limit=limit,
+                                                     offset=offset,
+                                                     session_info=session_info, 
+                                                     request=request
+                                                     )
 
     #  if there's a Solr server error in the call, it returns a non-200 ret_status[0]
     if ret_status[0] != httpCodes.HTTP_200_OK:
@@ -4741,24 +4762,35 @@ async def documents_image_fetch(response: Response,
                 detail=status_message
             )    
 
-    fs = opasFileSupport.FlexFileSystem(key=localsecrets.S3_KEY, secret=localsecrets.S3_SECRET, root=localsecrets.IMAGE_SOURCE_PATH)
-    filename = fs.get_image_filename(filespec=imageID) # IMAGE_SOURCE_PATH set as root above, all that we need
-    media_type='image/jpeg'
+    # resolved from the image manifest (no file system access unless the image is new since the manifest was built)
+    image_manifest = opasFileSupport.get_image_manifest()
+    image_info = await run_in_threadpool(image_manifest.get, imageID) # IMAGE_SOURCE_PATH is the manifest's root
+    if image_info is None:
+        response.status_code = httpCodes.HTTP_400_BAD_REQUEST 
+        status_message = f"Error: {imageID} not found or no filename specified"
+        logger.warning(status_message)
+        raise HTTPException(status_code=response.status_code,
+                            detail=status_message)
+
+    headers = {"ETag": image_info.etag,
+               "Last-Modified": image_info.last_modified,
+               "Cache-Control": f"max-age={opasConfig.IMAGE_CACHE_MAX_AGE}"
+              }
+
     if download == 0:
-        if filename is None:
-            response.status_code = httpCodes.HTTP_400_BAD_REQUEST 
-            status_message = f"Error: {imageID} not found or no filename specified"
-            logger.warning(status_message)
-            raise HTTPException(status_code=response.status_code,
-                                detail=status_message)
+        if image_info.not_modified(if_none_match=request.headers.get("if-none-match"),
+                                   if_modified_since=request.headers.get("if-modified-since")):
+            # the client's copy is current
+            ret_val = Response(status_code=httpCodes.HTTP_304_NOT_MODIFIED, headers=headers)
         else:
-            file_content = fs.get_image_binary(filename)
             try:
-                ret_val = response = Response(file_content, media_type=media_type)
+                headers["Content-Length"] = str(image_info.filesize)
+                # streamed in chunks (the generator is run in the threadpool)
+                ret_val = StreamingResponse(image_manifest.iter_image(image_info), media_type=image_info.media_type, headers=headers)
 
             except Exception as e:
                 response.status_code = httpCodes.HTTP_400_BAD_REQUEST 
-                status_message = f" The requested document {filename} could not be returned {e}"
+                status_message = f" The requested document {image_info.filespec} could not be returned {e}"
                 logger.warning(status_message)
                 raise HTTPException(status_code=response.status_code,
                                     detail=status_message)
@@ -4770,25 +4802,16 @@ async def documents_image_fetch(response: Response,
     else: # download == 1
         try:
             response.status_code = httpCodes.HTTP_200_OK
-            filename = fs.get_image_filename(filename)
-            if fs.key is not None:
-                fileurl = fs.fs.url(filename)
-                fname = wget.download(fileurl)
-                ret_val = FileResponse(path=fname,
-                                       status_code=response.status_code,
-                                       filename=os.path.split(fname)[1], 
-                                       media_type=media_type)
-            else:
-                fileurl = filename
-                ret_val = FileResponse(path=fileurl,
-                                       status_code=response.status_code,
-                                       filename=os.path.split(filename)[1], 
-                                       media_type=media_type)
-
+            headers["Content-Length"] = str(image_info.filesize)
+            headers["Content-Disposition"] = f'attachment; filename="{image_info.basename}"'
+            ret_val = StreamingResponse(image_manifest.iter_image(image_info),
+                                        status_code=response.status_code,
+                                        media_type=image_info.media_type,
+                                        headers=headers)
 
         except Exception as e:
             response.status_code = httpCodes.HTTP_400_BAD_REQUEST 
-            status_message = f" The requested document {filename} could not be returned {e}"
+            status_message = f" The requested document {image_info.filespec} could not be returned {e}"
             raise HTTPException(status_code=response.status_code,
                                 detail=status_message)
 
@@ -4926,9 +4949,10 @@ def documents_downloads(response: Response,
         else:
             try:
                 response.status_code = httpCodes.HTTP_200_OK
+                # streamed to the client from the download cache
                 ret_val = FileResponse(path=filename,
                                        status_code=response.status_code,
-                                       filename=os.path.split(filename)[1], 
+                                       filename=opasDownloadSupport.download_filename(documentID, file_format), 
                                        media_type=media_type)
 
             except Exception as e:
@@ -4962,7 +4986,7 @@ def database_word_wheel(response: Response,
                         field: str=Query("text", title=opasConfig.TITLE_WORDFIELD, description=opasConfig.DESCRIPTION_WORDFIELD),
                         core: str=Query("docs", title=opasConfig.TITLE_CORE, description=opasConfig.DESCRIPTION_CORE),
                         limit: int=Query(opasConfig.DEFAULT_LIMIT_FOR_SOLR_RETURNS, title=opasConfig.TITLE_LIMIT, description=opasConfig.DESCRIPTION_LIMIT),
-                        #offset: int=Query(0, title=opasConfig.TITLE_OFFSET, description=opasConfig.DESCRIPTION_OFFSET),
+                        offset: int=Query(0, title=opasConfig.TITLE_OFFSET, description=opasConfig.DESCRIPTION_OFFSET),
                         startat:str=Query(None, title="Start at this term/prefix (inconsistent at best)."), 
                         client_id:int=Depends(get_client_id), 
                          #client_session:str= Depends(get_client_session)
@@ -4998,6 +5022,10 @@ def database_word_wheel(response: Response,
        This endpoint return word counts for the words returned; it can also be used to check the number of instances of a search
        term, to determine if it's going to be effective by itself in limiting the results.
 
+       The words are listed most frequent first, and paged with limit and offset.  For the fields in
+       opasConfig.TERM_DICTIONARY_FIELDS (including the default, text), they're looked up in memory, and
+       fullCount is the number of words matching the prefix.
+
 
     ## Return Type
        models.termIndex
@@ -5026,6 +5054,7 @@ def database_word_wheel(response: Response,
                                                    core=core,
                                                    req_url=request.url, 
                                                    limit=limit,
+                                                   offset=offset,
                                                    start_at=startat)
         except ConnectionRefusedError as e:
             status_message = f"The server is not running or is currently not accepting connections: {e}"
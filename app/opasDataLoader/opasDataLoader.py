@@ -11,7 +11,6 @@ __version__     = "2021.0211.1"
 __status__      = "Development"
 
 programNameShort = "opasDataLoader"
-import lxml
 
 print(
     f""" 
@@ -34,6 +33,8 @@ print(
          --sub       Start with this subfolder of the root (can add sublevels to that)
          --key:      Do just one file with the specified PEP locator (e.g., --key AIM.076.0309A)
          --nocheck   Don't prompt whether to proceed after showing setting/option choices
+         --workers   Number of worker processes to parse the files and build the documents; the
+                     Solr adds and database inserts are batched by this process (default 1, serial)
 
         Example:
           Update all files from the root (default, pep-web-xml) down.  Starting two runs, one running the file list forward, the other backward.
@@ -47,6 +48,10 @@ print(
 
              python opasDataLoader.py -a --sub _PEPCurrent
 
+          Reload everything, with 8 worker processes
+
+             python opasDataLoader.py -a --workers 8
+
         Note:
           S3 is set up with root pep-web-xml (default).  The root must be the bucket name.
           
@@ -63,12 +68,13 @@ sys.path.append('../config')
 sys.path.append('../libs/configLib')
 
 import time
-import pymysql
 import pysolr
 import localsecrets
 import re
 import os
 import os.path
+import collections
+import concurrent.futures
 import pathlib
 
 import time
@@ -83,10 +89,8 @@ import html
 
 from optparse import OptionParser
 
-from lxml import etree
 #now uses pysolr exclusively!
 # import solrpy as solr 
-import pymysql
 
 # import config
 # import opasConfig
@@ -101,6 +105,7 @@ import opasCentralDBLib
 # import opasGenSupportLib as opasgenlib
 import localsecrets
 import opasFileSupport
+import opasLoadManifest
 
 #detect data is on *nix or windows system
 if "AWS" in localsecrets.CONFIG or re.search("/", localsecrets.IMAGE_SOURCE_PATH) is not None:
@@ -192,6 +197,296 @@ def file_is_same_as_in_solr(solrcore, filename, timestamp_str):
         
     return ret_val
 
+#------------------------------------------------------------------------------------------------------
+def file_is_unchanged_since_load(fileinfo, solrcore, solr_file_dates, manifest, fs):
+    """
+    Incremental load check, using one export of the file_last_modified values in Solr (solr_file_dates,
+      see opasSolrLoadSupport.get_all_file_dates_solr) and the load manifest, rather than a Solr query
+      for every file (file_is_same_as_in_solr).
+
+    A file is unchanged if Solr has its modification time, or if the manifest shows it has the
+      same contents as the version in Solr (i.e., the file was just touched).  Only files
+      which were touched since they were last checked are read (to hash the contents).
+    """
+    if solr_file_dates is None:
+        # no export (error); check the file in Solr
+        return file_is_same_as_in_solr(solrcore, filename=fileinfo.basename, timestamp_str=fileinfo.timestamp_str)
+
+    ret_val = False
+    loaded_timestamp_str = solr_file_dates.get(fileinfo.basename)
+    if loaded_timestamp_str is not None:
+        if loaded_timestamp_str == fileinfo.timestamp_str:
+            ret_val = True
+        elif manifest is not None:
+            if manifest.is_unchanged(fileinfo.basename, fileinfo.filesize, fileinfo.timestamp_str, loaded_timestamp_str):
+                ret_val = True
+            else:
+                # modification time changed, but maybe not the contents
+                file_hash = opasLoadManifest.content_hash(fs.get_file_contents(fileinfo.filespec))
+                if manifest.has_content(fileinfo.basename, fileinfo.filesize, file_hash, loaded_timestamp_str):
+                    # no need to hash it again next time
+                    manifest.record(fileinfo.basename, fileinfo.filesize, fileinfo.timestamp_str, file_hash, loaded_timestamp_str, filespec=fileinfo.filespec)
+                    ret_val = True
+
+    if not ret_val:
+        # confirm before loading; another run (e.g., --reverse) may have loaded it since the export
+        ret_val = file_is_same_as_in_solr(solrcore, filename=fileinfo.basename, timestamp_str=fileinfo.timestamp_str)
+
+    return ret_val
+
+#------------------------------------------------------------------------------------------------------
+def get_art_id_from_filename(basename):
+    """
+    Return the article ID (upper case) from the file basename, e.g., AIM.076.0309A(bEXP_ARCH1).XML
+
+    >>> get_art_id_from_filename("JICAP.018.0307A updated but no page breaks (bEXP_ARCH1).XML")
+    'JICAP.018.0307A'
+    """
+    artID = os.path.splitext(basename)[0]
+    # watch out for comments in file name, like:
+    #   JICAP.018.0307A updated but no page breaks (bEXP_ARCH1).XML
+    #   so skip data after a space
+    m = re.match(r"([^ ]*).*\(.*\)", artID)
+    # Note: We could also get the artID from the XML, but since it's also important
+    # the file names are correct, we'll do it here.  Also, it "could" have been left out
+    # of the artinfo (attribute), whereas the filename is always there.
+    artID = m.group(1)
+    # all IDs to upper case.
+    return artID.upper()
+
+#------------------------------------------------------------------------------------------------------
+# Parallel load (--workers N)
+#  Worker processes read and parse the files and build the Solr documents and database rows
+#  for each article; the main process is the writer stage, which batches the Solr adds and
+#  MySQL inserts.
+#------------------------------------------------------------------------------------------------------
+load_worker = {} # settings and instances for a worker process, set by init_load_worker
+
+def init_load_worker(sourceinfodb_data, include_paras, glossary_only, verbose):
+    load_worker["fs"] = opasFileSupport.FlexFileSystem(key=localsecrets.S3_KEY, secret=localsecrets.S3_SECRET, root="pep-web-xml")
+    load_worker["source_data"] = sourceinfodb_data
+    load_worker["include_paras"] = include_paras
+    load_worker["glossary_only"] = glossary_only
+    load_worker["verbose"] = verbose
+
+def build_article_load_data(filespec, basename, timestamp_str, filesize, file_updated):
+    """
+    Worker stage: read and parse the file, and build everything the writer stage stores for the article,
+      the same as the serial load does.
+
+    Returns a dict of plain (picklable) data.
+    """
+    build_start = time.time()
+    ret_val = {"filename": basename, "filespec": str(filespec), "filesize": filesize, "timestamp_str": timestamp_str, "error": None}
+    try:
+        file_bytes = load_worker["fs"].get_file_contents(filespec, binary=True)
+        fileXMLContents = opasxmllib.xml_bytes_to_str(file_bytes)
+        ret_val["content_hash"] = opasLoadManifest.content_hash(fileXMLContents)
+        artID = get_art_id_from_filename(basename)
+        msg = f"Processing file {basename} ({filesize} bytes). Art-ID:{artID}"
+        logger.info(msg)
+        if load_worker["verbose"]:
+            print (msg)
+
+        # parsed from the bytes read, with the worker's shared parser (the DTD and entity files are cached)
+        parse_start = time.time()
+        pepxml = opasxmllib.xml_bytes_to_etree(file_bytes)
+        ret_val["parse_seconds"] = time.time() - parse_start
+
+        artInfo = opasSolrLoadSupport.ArticleInfo(load_worker["source_data"], pepxml, artID, logger)
+        artInfo.filedatetime = timestamp_str
+        artInfo.filename = basename
+        artInfo.file_size = filesize
+        artInfo.file_updated = file_updated
+        try:
+            artInfo.file_classification = re.search("(?P<class>current|archive|future|free|offsite)", str(filespec), re.IGNORECASE).group("class")
+            # set it to lowercase for ease of matching later
+            if artInfo.file_classification is not None:
+                artInfo.file_classification = artInfo.file_classification.lower()
+        except Exception as e:
+            logger.warning("Could not determine file classification for %s (%s)" % (filespec, e))
+
+        ret_val["art_id"] = artInfo.art_id
+        ret_val["src_code"] = artInfo.src_code
+        ret_val["issue_id_str"] = artInfo.issue_id_str
+        ret_val["art_citeas_xml"] = artInfo.art_citeas_xml
+        ret_val["glossary_recs"] = []
+        ret_val["doc_rec"] = None
+        ret_val["author_recs"] = []
+        ret_val["api_articles_params"] = None
+        ret_val["biblio_params"] = []
+
+        glossary_file_pattern=r"ZBK.069(.*)\(bEXP_ARCH1\)\.(xml|XML)$"
+        if re.match(glossary_file_pattern, basename):
+            ret_val["glossary_recs"] = opasSolrLoadSupport.get_glossary_core_records(pepxml, artInfo, verbose=load_worker["verbose"])
+
+        if not load_worker["glossary_only"]:
+            ret_val["doc_rec"] = opasSolrLoadSupport.get_doc_core_record(pepxml, artInfo, fileXMLContents, include_paras=load_worker["include_paras"], verbose=load_worker["verbose"])
+            ret_val["author_recs"] = opasSolrLoadSupport.get_author_core_records(pepxml, artInfo, verbose=load_worker["verbose"])
+            ret_val["api_articles_params"] = opasSolrLoadSupport.get_api_articles_params(artInfo)
+
+        if artInfo.ref_count > 0:
+            ret_val["biblio_params"] = [bib_entry.__dict__ for bib_entry in opasSolrLoadSupport.get_biblio_entries(pepxml, artInfo)]
+
+    except Exception as e:
+        ret_val["error"] = f"{e}"
+
+    ret_val["build_seconds"] = time.time() - build_start
+    return opasSolrLoadSupport.plain_data(ret_val)
+
+class LoadWriter(object):
+    """
+    Writer stage for the parallel load: sends the Solr documents for the articles built by the worker
+      processes to the (buffered) Solr writers, batches the MySQL inserts, and keeps the count and
+      time for each stage.
+    """
+    def __init__(self, ocd, solr_writers, batch_size=loaderConfig.PARALLEL_LOAD_BATCH_SIZE, glossary_only=False):
+        self.ocd = ocd
+        self.solr_writers = solr_writers
+        self.batch_size = batch_size
+        self.glossary_only = glossary_only
+        self.pending = []
+        self.stage_stats = {} # stage name: [item count, seconds]
+
+    def record_stage(self, stage, count, seconds):
+        stats = self.stage_stats.setdefault(stage, [0, 0.0])
+        stats[0] += count
+        stats[1] += seconds
+
+    def add(self, load_data):
+        self.pending.append(load_data)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch = self.pending
+        self.pending = []
+        if batch == []:
+            return
+
+        self._solr_add("glossary", [rec for load_data in batch for rec in load_data["glossary_recs"]])
+        if not self.glossary_only:
+            self._solr_add("docs", [load_data["doc_rec"] for load_data in batch])
+            self._solr_add("authors", [rec for load_data in batch for rec in load_data["author_recs"]])
+            self._db_write("db articles", opasSolrLoadSupport.SQL_REPLACE_API_ARTICLES, [load_data["api_articles_params"] for load_data in batch])
+
+        biblio_params = [params for load_data in batch for params in load_data["biblio_params"]]
+        if biblio_params != []:
+            self._db_write("db biblio", opasSolrLoadSupport.SQL_REPLACE_API_BIBLIOXML, biblio_params)
+
+    def flush_solr(self):
+        for core, solr_writer in self.solr_writers.items():
+            stage_start = time.time()
+            solr_writer.flush()
+            self.record_stage(f"solr {core}", 0, time.time() - stage_start)
+
+    def _solr_add(self, core, recs):
+        if recs != []:
+            stage_start = time.time()
+            self.solr_writers[core].add(recs)
+            self.record_stage(f"solr {core}", len(recs), time.time() - stage_start)
+
+    def _db_write(self, stage, sql, rows):
+        stage_start = time.time()
+        opasSolrLoadSupport.add_rows_to_table(self.ocd, sql, rows, caller_name=f"LoadWriter {stage}", verbose=True)
+        self.record_stage(stage, len(rows), time.time() - stage_start)
+
+    def stage_report(self, elapsed_seconds=None):
+        ret_val = []
+        for stage, (count, seconds) in self.stage_stats.items():
+            rate = f"{count/seconds:.1f}/sec" if seconds > 0 else "-"
+            ret_val.append(f"   {stage:<24} {count:>10} in {seconds:10.2f} secs ({rate})")
+        if elapsed_seconds:
+            ret_val.append(f"   {'elapsed (wall clock)':<24} {elapsed_seconds:10.2f} secs")
+        return "\n".join(ret_val)
+
+def parallel_load(filenames, ocd, sourceDB, solr_docs2, solr_writers, issue_updates, fs, solr_file_dates=None, manifest=None, stop_after=0):
+    """
+    Load the files with options.workers worker processes (see build_article_load_data) and the
+      writer stage (LoadWriter) in this process.  Returns the processed and skipped file counts
+      and total reference count, and adds new articles to issue_updates, as the serial load does.
+    """
+    processed_files_count = 0
+    skipped_files = 0
+    bib_total_reference_count = 0
+    files_found = len(filenames)
+    max_pending = options.workers * loaderConfig.PARALLEL_LOAD_PENDING_PER_WORKER
+    writer = LoadWriter(ocd, solr_writers, glossary_only=options.glossary_only)
+    load_start = time.time()
+
+    def files_to_load():
+        # the serial load's checks, in the same order, so the same files are loaded
+        nonlocal processed_files_count, skipped_files
+        for n in filenames:
+            file_updated = False
+            if not options.forceRebuildAllFiles:
+                if file_is_unchanged_since_load(n, solr_docs2, solr_file_dates, manifest, fs):
+                    skipped_files += 1
+                    if options.display_verbose:
+                        print (f"Skipped - No refresh needed for {n.basename}")
+                    continue
+                else:
+                    file_updated = True
+
+            processed_files_count += 1
+            if stop_after > 0:
+                if processed_files_count > stop_after:
+                    print (f"Halfway mark reached on file list ({stop_after})...file processing stopped per halfway option")
+                    break
+
+            yield (n.filespec, n.basename, n.timestamp_str, n.filesize, file_updated)
+
+    print (f"Parallel load: {options.workers} worker processes, writing in batches of {writer.batch_size} articles.")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.workers,
+                                                initializer=init_load_worker,
+                                                initargs=(sourceDB.sourceData, options.include_paras, options.glossary_only, options.display_verbose)) as executor:
+        pending = collections.deque()
+        file_iter = files_to_load()
+        while True:
+            # keep the workers busy, but only a limited number of built articles waiting for the writer
+            for file_args in file_iter:
+                pending.append(executor.submit(build_article_load_data, *file_args))
+                if len(pending) >= max_pending:
+                    break
+
+            if not pending:
+                break
+
+            load_data = pending.popleft().result() # in file list order
+            writer.record_stage("read/parse/build", 1, load_data["build_seconds"])
+            writer.record_stage("xml parse", 1, load_data.get("parse_seconds", 0))
+            if load_data["error"] is not None:
+                errStr = f"Load error for {load_data['filename']}: {load_data['error']}"
+                logger.error(errStr)
+                print (errStr)
+                continue
+
+            stage_start = time.time()
+            if opasSolrLoadSupport.add_to_tracker_table(ocd, load_data["art_id"]): # if true, added successfully, so new!
+                # don't log to issue updates for journals that are new sources added during the annual update
+                if load_data["src_code"] not in loaderConfig.DATA_UPDATE_PREPUBLICATION_CODES_TO_IGNORE:
+                    art = f"<article id='{load_data['art_id']}'>{load_data['art_citeas_xml']}</article>"
+                    try:
+                        issue_updates[load_data["issue_id_str"]].append(art)
+                    except Exception:
+                        issue_updates[load_data["issue_id_str"]] = [art]
+            writer.record_stage("db tracker", 1, time.time() - stage_start)
+
+            bib_total_reference_count += len(load_data["biblio_params"])
+            writer.add(load_data)
+            if manifest is not None:
+                manifest.record(load_data["filename"], load_data["filesize"], load_data["timestamp_str"], load_data["content_hash"], load_data["timestamp_str"], filespec=load_data["filespec"])
+            written = writer.stage_stats["read/parse/build"][0]
+            if not options.display_verbose and written % 100 == 0:
+                print (f"Processed Files ...loaded {written} out of {files_found} possible.")
+
+    writer.flush()
+    writer.flush_solr()
+    print ("Parallel load stage throughput (worker stage time is the total for all workers):")
+    print (writer.stage_report(elapsed_seconds=time.time() - load_start))
+
+    return processed_files_count, skipped_files, bib_total_reference_count
+
 #------------------------------------------------------------------------------------------------------
 def main():
     
@@ -286,8 +581,18 @@ def main():
     if localsecrets.SOLRUSER is not None and localsecrets.SOLRPW is not None:
         if 1: # options.fulltext_core_update:
             solr_docs2 = pysolr.Solr(solrurl_docs, auth=(localsecrets.SOLRUSER, localsecrets.SOLRPW))
+            solr_authors2 = pysolr.Solr(solrurl_authors, auth=(localsecrets.SOLRUSER, localsecrets.SOLRPW))
+            solr_gloss2 = pysolr.Solr(solrurl_glossary, auth=(localsecrets.SOLRUSER, localsecrets.SOLRPW))
     else: #  no user and password needed
         solr_docs2 = pysolr.Solr(solrurl_docs)
+        solr_authors2 = pysolr.Solr(solrurl_authors)
+        solr_gloss2 = pysolr.Solr(solrurl_glossary)
+
+    # adds to the cores are buffered across articles and sent in batches (committed by Solr via commitWithin)
+    solr_writers = {"docs": opasSolrLoadSupport.SolrBatchWriter(solr_docs2, "docs", verbose=options.display_verbose),
+                    "authors": opasSolrLoadSupport.SolrBatchWriter(solr_authors2, "authors", verbose=options.display_verbose),
+                    "glossary": opasSolrLoadSupport.SolrBatchWriter(solr_gloss2, "glossary", verbose=options.display_verbose),
+                    }
 
     # Reset core's data if requested (mainly for early development)
     if options.resetCoreData:
@@ -372,7 +677,19 @@ def main():
     stop_after = 0
     cumulative_file_time_start = time.time()
     issue_updates = {}
+    solr_file_dates = None
+    manifest = None
+    if options.manifest_path:
+        manifest = opasLoadManifest.LoadManifest(options.manifest_path)
+        print (f"Load manifest: {options.manifest_path} ({len(manifest)} files)")
+
     if files_found > 0:
+        if not options.forceRebuildAllFiles:
+            # one export of the file dates in Solr, rather than a query per file
+            solr_file_dates = opasSolrLoadSupport.get_all_file_dates_solr(solr_docs2)
+            if solr_file_dates is not None:
+                print (f"Exported file dates for {len(solr_file_dates)} documents from Solr ({time.time() - cumulative_file_time_start:.2f} secs).")
+
         if options.halfway:
             stop_after = round(files_found / 2) + 5 # go a bit further
             
@@ -383,148 +700,146 @@ def main():
         # Now walk through all the filenames selected
         # ----------------------------------------------------------------------
         print (f"Load process started ({time.ctime()}).  Examining files.")
-        for n in filenames:
-            fileTimeStart = time.time()
-            file_updated = False
-            if not options.forceRebuildAllFiles:                    
-                if not options.display_verbose and processed_files_count % 100 == 0 and processed_files_count != 0:
-                    print (f"Processed Files ...loaded {processed_files_count} out of {files_found} possible.")
-
-                if not options.display_verbose and skipped_files % 100 == 0 and skipped_files != 0:
-                    print (f"Skipped {skipped_files} so far...loaded {processed_files_count} out of {files_found} possible." )
+        if options.workers > 1:
+            processed_files_count, skipped_files, bib_total_reference_count = parallel_load(filenames, ocd, sourceDB, solr_docs2, solr_writers, issue_updates, fs,
+                                                                                            solr_file_dates=solr_file_dates, manifest=manifest, stop_after=stop_after)
+        else:
+            biblio_writer = opasSolrLoadSupport.BiblioWriter(ocd, verbose=options.display_verbose)
+            cumulative_parse_seconds = 0
+            for n in filenames:
+                fileTimeStart = time.time()
+                file_updated = False
+                if not options.forceRebuildAllFiles:                    
+                    if not options.display_verbose and processed_files_count % 100 == 0 and processed_files_count != 0:
+                        print (f"Processed Files ...loaded {processed_files_count} out of {files_found} possible.")
+
+                    if not options.display_verbose and skipped_files % 100 == 0 and skipped_files != 0:
+                        print (f"Skipped {skipped_files} so far...loaded {processed_files_count} out of {files_found} possible." )
                 
-                if file_is_same_as_in_solr(solr_docs2, filename=n.basename, timestamp_str=n.timestamp_str):
-                    skipped_files += 1
-                    if options.display_verbose:
-                        print (f"Skipped - No refresh needed for {n.basename}")
-                    continue
-                else:
-                    file_updated = True
+                    if file_is_unchanged_since_load(n, solr_docs2, solr_file_dates, manifest, fs):
+                        skipped_files += 1
+                        if options.display_verbose:
+                            print (f"Skipped - No refresh needed for {n.basename}")
+                        continue
+                    else:
+                        file_updated = True
             
-            # get mod date/time, filesize, etc. for mysql database insert/update
-            processed_files_count += 1
-            if stop_after > 0:
-                if processed_files_count > stop_after:
-                    print (f"Halfway mark reached on file list ({stop_after})...file processing stopped per halfway option")
-                    break
-
-            fileXMLContents = fs.get_file_contents(n.filespec)
+                # get mod date/time, filesize, etc. for mysql database insert/update
+                processed_files_count += 1
+                if stop_after > 0:
+                    if processed_files_count > stop_after:
+                        print (f"Halfway mark reached on file list ({stop_after})...file processing stopped per halfway option")
+                        break
+
+                file_bytes = fs.get_file_contents(n.filespec, binary=True)
+                fileXMLContents = opasxmllib.xml_bytes_to_str(file_bytes)
             
-            # get file basename without build (which is in paren)
-            base = n.basename
-            artID = os.path.splitext(base)[0]
-            # watch out for comments in file name, like:
-            #   JICAP.018.0307A updated but no page breaks (bEXP_ARCH1).XML
-            #   so skip data after a space
-            m = re.match(r"([^ ]*).*\(.*\)", artID)
-            # Note: We could also get the artID from the XML, but since it's also important
-            # the file names are correct, we'll do it here.  Also, it "could" have been left out
-            # of the artinfo (attribute), whereas the filename is always there.
-            artID = m.group(1)
-            # all IDs to upper case.
-            artID = artID.upper()
-            msg = "Processing file #%s of %s: %s (%s bytes). Art-ID:%s" % (processed_files_count, files_found, base, n.filesize, artID)
-            logger.info(msg)
-            if options.display_verbose:
-                print (msg)
+                # get file basename without build (which is in paren)
+                base = n.basename
+                artID = get_art_id_from_filename(base)
+                msg = "Processing file #%s of %s: %s (%s bytes). Art-ID:%s" % (processed_files_count, files_found, base, n.filesize, artID)
+                logger.info(msg)
+                if options.display_verbose:
+                    print (msg)
     
-            # import into lxml
-            parser = lxml.etree.XMLParser(encoding='utf-8', recover=True, resolve_entities=True, load_dtd=True)
-            root = etree.fromstring(opasxmllib.remove_encoding_string(fileXMLContents), parser)
-            pepxml = root
+                # import into lxml, from the bytes read, with the shared parser (the DTD and entity files are cached)
+                parse_start = time.time()
+                root = opasxmllib.xml_bytes_to_etree(file_bytes)
+                pepxml = root
+                parse_seconds = time.time() - parse_start
+                cumulative_parse_seconds += parse_seconds
     
-            # save common document (article) field values into artInfo instance for both databases
-            artInfo = opasSolrLoadSupport.ArticleInfo(sourceDB.sourceData, pepxml, artID, logger)
-            artInfo.filedatetime = n.timestamp_str
-            artInfo.filename = base
-            artInfo.file_size = n.filesize
-            artInfo.file_updated = file_updated
-            # not a new journal, see if it's a new article.
-            if opasSolrLoadSupport.add_to_tracker_table(ocd, artInfo.art_id): # if true, added successfully, so new!
-                # don't log to issue updates for journals that are new sources added during the annual update
-                if artInfo.src_code not in loaderConfig.DATA_UPDATE_PREPUBLICATION_CODES_TO_IGNORE:
-                    art = f"<article id='{artInfo.art_id}'>{artInfo.art_citeas_xml}</article>"
-                    try:
-                        issue_updates[artInfo.issue_id_str].append(art)
-                    except Exception as e:
-                        issue_updates[artInfo.issue_id_str] = [art]
+                # save common document (article) field values into artInfo instance for both databases
+                artInfo = opasSolrLoadSupport.ArticleInfo(sourceDB.sourceData, pepxml, artID, logger)
+                artInfo.filedatetime = n.timestamp_str
+                artInfo.filename = base
+                artInfo.file_size = n.filesize
+                artInfo.file_updated = file_updated
+                # not a new journal, see if it's a new article.
+                if opasSolrLoadSupport.add_to_tracker_table(ocd, artInfo.art_id): # if true, added successfully, so new!
+                    # don't log to issue updates for journals that are new sources added during the annual update
+                    if artInfo.src_code not in loaderConfig.DATA_UPDATE_PREPUBLICATION_CODES_TO_IGNORE:
+                        art = f"<article id='{artInfo.art_id}'>{artInfo.art_citeas_xml}</article>"
+                        try:
+                            issue_updates[artInfo.issue_id_str].append(art)
+                        except Exception as e:
+                            issue_updates[artInfo.issue_id_str] = [art]
 
-            try:
-                artInfo.file_classification = re.search("(?P<class>current|archive|future|free|offsite)", str(n.filespec), re.IGNORECASE).group("class")
-                # set it to lowercase for ease of matching later
-                if artInfo.file_classification is not None:
-                    artInfo.file_classification = artInfo.file_classification.lower()
-            except Exception as e:
-                logger.warning("Could not determine file classification for %s (%s)" % (n.filespec, e))
+                try:
+                    artInfo.file_classification = re.search("(?P<class>current|archive|future|free|offsite)", str(n.filespec), re.IGNORECASE).group("class")
+                    # set it to lowercase for ease of matching later
+                    if artInfo.file_classification is not None:
+                        artInfo.file_classification = artInfo.file_classification.lower()
+                except Exception as e:
+                    logger.warning("Could not determine file classification for %s (%s)" % (n.filespec, e))
     
-            # walk through bib section and add to refs core database
+                # walk through bib section and add to refs core database
     
-            precommit_file_count += 1
-            if precommit_file_count > configLib.opasCoreConfig.COMMITLIMIT:
-                print(f"Committing info for {configLib.opasCoreConfig.COMMITLIMIT} documents/articles")
-
-            # input to the glossary
-            if 1: # options.glossary_core_update:
-                # load the glossary core if this is a glossary item
-                glossary_file_pattern=r"ZBK.069(.*)\(bEXP_ARCH1\)\.(xml|XML)$"
-                if re.match(glossary_file_pattern, n.basename):
-                    opasSolrLoadSupport.process_article_for_glossary_core(pepxml, artInfo, solr_gloss, fileXMLContents, verbose=options.display_verbose)
-                
-            # input to the full-text and authors cores
-            if not options.glossary_only: # options.fulltext_core_update:
-                # load the docs (pepwebdocs) core
-                opasSolrLoadSupport.process_article_for_doc_core(pepxml, artInfo, solr_docs2, fileXMLContents, include_paras=options.include_paras, verbose=options.display_verbose)
-                # load the authors (pepwebauthors) core.
-                opasSolrLoadSupport.process_info_for_author_core(pepxml, artInfo, solr_authors, verbose=options.display_verbose)
-                # load the database
-                opasSolrLoadSupport.add_article_to_api_articles_table(ocd, artInfo, verbose=options.display_verbose)
-                
+                precommit_file_count += 1
                 if precommit_file_count > configLib.opasCoreConfig.COMMITLIMIT:
+                    # Solr commits the docs and authors cores itself (commitWithin); write the references collected so far
                     precommit_file_count = 0
-                    solr_docs2.commit()
-                    solr_authors.commit()
-    
-            # input to the references core
-            if 1: # options.biblio_update:
-                if artInfo.ref_count > 0:
-                    bibReferences = pepxml.xpath("/pepkbd3//be")  # this is the second time we do this (also in artinfo, but not sure or which is better per space vs time considerations)
-                    if options.display_verbose:
-                        print(("   ...Processing %s references for the references database." % (artInfo.ref_count)))
-
-                    #processedFilesCount += 1
-                    bib_total_reference_count = 0
-                    ocd.open_connection(caller_name="processBibliographies")
-                    for ref in bibReferences:
-                        bib_total_reference_count += 1
-                        bib_entry = opasSolrLoadSupport.BiblioEntry(artInfo, ref)
-                        opasSolrLoadSupport.add_reference_to_biblioxml_table(ocd, artInfo, bib_entry)
+                    biblio_writer.flush()
 
-                    try:
-                        ocd.db.commit()
-                    except pymysql.Error as e:
-                        print("SQL Database -- Biblio Commit failed!", e)
-                        
-                    ocd.close_connection(caller_name="processBibliographies")
-
-            # close the file, and do the next
-            if options.display_verbose:
-                print(("   ...Time: %s seconds." % (time.time() - fileTimeStart)))
+                # input to the glossary
+                if 1: # options.glossary_core_update:
+                    # load the glossary core if this is a glossary item
+                    glossary_file_pattern=r"ZBK.069(.*)\(bEXP_ARCH1\)\.(xml|XML)$"
+                    if re.match(glossary_file_pattern, n.basename):
+                        solr_writers["glossary"].add(opasSolrLoadSupport.get_glossary_core_records(pepxml, artInfo, verbose=options.display_verbose))
+                
+                # input to the full-text and authors cores
+                if not options.glossary_only: # options.fulltext_core_update:
+                    # load the docs (pepwebdocs) core
+                    solr_writers["docs"].add([opasSolrLoadSupport.get_doc_core_record(pepxml, artInfo, fileXMLContents, include_paras=options.include_paras, verbose=options.display_verbose)])
+                    # load the authors (pepwebauthors) core.
+                    solr_writers["authors"].add(opasSolrLoadSupport.get_author_core_records(pepxml, artInfo, verbose=options.display_verbose))
+                    # load the database
+                    opasSolrLoadSupport.add_article_to_api_articles_table(ocd, artInfo, verbose=options.display_verbose)
+    
+                # input to the references core
+                if 1: # options.biblio_update:
+                    if artInfo.ref_count > 0:
+                        if options.display_verbose:
+                            print(("   ...Processing %s references for the references database." % (artInfo.ref_count)))
+
+                        # collected, and written in bulk (with the references from other articles) by biblio_writer
+                        bib_entries = opasSolrLoadSupport.get_biblio_entries(pepxml, artInfo)
+                        bib_total_reference_count += len(bib_entries)
+                        biblio_writer.add(bib_entries)
+
+                if manifest is not None:
+                    manifest.record(n.basename, n.filesize, n.timestamp_str, opasLoadManifest.content_hash(fileXMLContents), n.timestamp_str, filespec=n.filespec)
+
+                # close the file, and do the next
+                if options.display_verbose:
+                    print(("   ...Time: %s seconds (XML parse %.3f seconds)." % (time.time() - fileTimeStart, parse_seconds)))
+
+            biblio_writer.flush()
+            print (f"References: {biblio_writer.rows_written} rows written to api_biblioxml in {biblio_writer.write_seconds:.2f} secs.")
+            if processed_files_count > 0:
+                print (f"XML parse: {cumulative_parse_seconds:.2f} secs ({1000 * cumulative_parse_seconds / processed_files_count:.1f} ms/file).")
     
         print (f"Load process complete ({time.ctime()}).")
         if processed_files_count > 0:
             try:
                 print ("Performing final commit.")
                 if not options.glossary_only: # options.fulltext_core_update:
-                    solr_docs2.commit()
-                    solr_authors.commit()
+                    solr_writers["docs"].commit()
+                    solr_writers["authors"].commit()
                     # fileTracker.commit()
                 if 1: # options.glossary_core_update:
-                    solr_gloss.commit()
+                    solr_writers["glossary"].commit()
                     
             except Exception as e:
                 print(("Exception: ", e))
 
+            for solr_writer in solr_writers.values():
+                print (solr_writer.stats_str())
+
     # end of docs, authors, and/or references Adds
+    if manifest is not None:
+        manifest.close()
     
     # write updated file
     if issue_updates != {}:
@@ -609,6 +924,8 @@ if __name__ == "__main__":
                       help="Level at which events should be logged (DEBUG, INFO, WARNING, ERROR")
     #parser.add_option("--logfile", dest="logfile", default=logFilename,
                       #help="Logfile name with full path where events should be logged")
+    parser.add_option("--manifest", dest="manifest_path", default=loaderConfig.LOAD_MANIFEST_PATH,
+                      help="Local manifest (SQLite) of the loaded files, to skip files which were only touched (--manifest= to not use one).")
     parser.add_option("--nocheck", action="store_true", dest="no_check", default=False,
                       help="Don't check whether to proceed.")
     parser.add_option("--includeparas", action="store_true", dest="include_paras", default=False,
@@ -632,6 +949,8 @@ if __name__ == "__main__":
                       help="UserID for the server")
     parser.add_option("--verbose", action="store_true", dest="display_verbose", default=False,
                       help="Display status and operational timing info as load progresses.")
+    parser.add_option("--workers", dest="workers", type="int", default=1,
+                      help="Number of worker processes to parse files and build the documents (default 1: serial load).")
 
     (options, args) = parser.parse_args()
     
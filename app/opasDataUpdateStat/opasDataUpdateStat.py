@@ -31,6 +31,8 @@ print(
          vw_stat_docviews_crosstab
          vw_stat_cited_crosstab
          
+      Use --dryrun to see how many records (and which fields) would be updated, without updating.
+
       2020-10-29 Important update - Since it is used at database build/rebuild time, it now updates all records
          where views are non-zero, not just the last week.
     """
@@ -38,14 +40,18 @@ print(
 
 import sys
 sys.path.append('../config')
+sys.path.append('../libs')
 
-UPDATE_AFTER = 2500
+UPDATE_AFTER = 2500 # commit after about this many updated records
+UPDATE_BATCH_SIZE = 500 # atomic update records per request
+EXPORT_PAGE_SIZE = 10000 # rows per page (cursorMark) when exporting the current stat values from Solr
 
 import logging
 import time
 import pymysql
 import pysolr
 import localsecrets
+import opasGenSupportLib as opasgenlib
 from pydantic import BaseModel
 
 from datetime import datetime
@@ -58,6 +64,10 @@ print (start_notice)
 
 unified_article_stat = {}
 
+# the stat fields in the Solr docs core (and ArticleStat)
+STAT_FIELDS = ["art_cited_5", "art_cited_10", "art_cited_20", "art_cited_all",
+               "art_views_lastcalyear", "art_views_last12mos", "art_views_last6mos", "art_views_last1mos", "art_views_lastweek"]
+
 class ArticleStat(BaseModel):
     document_id: str = None
     art_views_update: bool = False
@@ -306,112 +316,113 @@ def load_unified_article_stat():
                 unified_article_stat[doc_id].art_views_last1mos = n.get("lastmonth", None)
                 unified_article_stat[doc_id].art_views_lastweek = n.get("lastweek", None)
                 
-def update_solr_stat_data(solrcon, all_records:bool=False):
+def export_solr_stat_data(solrcon):
+    """
+    Return the current stat field values for all the documents (articles) in Solr, by id, fetched
+      with cursorMark in pages of EXPORT_PAGE_SIZE rows (rather than a query per document).
+    """
+    ret_val = {}
+    fl = ",".join(["id"] + STAT_FIELDS)
+    print ("Exporting current stat data from Solr Docs core...")
+    for doc in opasgenlib.iter_solr_docs(solrcon, "art_level:1", fl=fl, rows=EXPORT_PAGE_SIZE):
+        ret_val[doc["id"]] = doc
+
+    print (f"...exported stat data for {len(ret_val)} documents.")
+    return ret_val
+
+def diff_stat_data(solr_stat, all_records:bool=False):
+    """
+    Compare unified_article_stat with the values in Solr (solr_stat, see export_solr_stat_data).
+
+    Returns the update records (only for documents with a changed value), and counts, including
+      counts of the changes by field.
+    """
+    update_recs = []
+    counts = {"checked": 0, "changed": 0, "unchanged": 0, "missing": 0}
+    field_changes = {field: 0 for field in STAT_FIELDS}
+    for doc_id, art_stat in unified_article_stat.items():
+        if all_records==False:
+            if not art_stat.art_views_update:
+                continue
+
+        counts["checked"] += 1
+        current = solr_stat.get(doc_id)
+        if doc_id is None or current is None:
+            logger.info(f"Document {doc_id} not in Solr...skipping")
+            counts["missing"] += 1
+            continue
+
+        upd_rec = {"id": doc_id}
+        changed = False
+        for field in STAT_FIELDS:
+            value = getattr(art_stat, field)
+            upd_rec[field] = value
+            # a field not in the Solr record is 0
+            if current.get(field, 0) != value:
+                field_changes[field] += 1
+                changed = True
+
+        if changed:
+            counts["changed"] += 1
+            update_recs.append(upd_rec)
+        else:
+            counts["unchanged"] += 1
+
+    return update_recs, counts, field_changes
+
+def update_solr_stat_data(solrcon, all_records:bool=False, dry_run:bool=False):
     """
-    Use in-place updates to update the views data
+    Use in-place (atomic) updates to update the views and citation data, for the documents
+      where it changed, sending UPDATE_BATCH_SIZE records per request.
     """
     update_count = 0
     skipped_as_update_error = 0
-    skipped_as_missing = 0
     item_count = len(unified_article_stat.items())
-    remaining_count = item_count
     print (f"Merging up to {item_count} stat records into Solr Docs core records.")
-    
-    for key, art_stat in unified_article_stat.items():
-        remaining_count -= 1
-            
-        if all_records==False:
-            if not art_stat.art_views_update:
-                continue
 
-        if remaining_count % 1000 == 0:
-            print (f"...{remaining_count} records to go")
-            
-        # set only includes those with the desired update value > 0 
-        #   (see RDS vw_stat_to_update_solr_docviews to change criteria)
-        doc_id = key
-        found = False
+    solr_stat = export_solr_stat_data(solrcon)
+    update_recs, counts, field_changes = diff_stat_data(solr_stat, all_records=all_records)
+    print (f"Checked {counts['checked']} stat records: {counts['changed']} changed; {counts['unchanged']} unchanged; {counts['missing']} not in Solr.")
+    for field, count in field_changes.items():
+        print (f"   {field:<24} {count:>10} changed")
+
+    if dry_run:
+        print ("Dry run: no updates sent to Solr.")
+        return update_count
+
+    field_updates = {field: "set" for field in STAT_FIELDS}
+    uncommitted_count = 0
+    for start in range(0, len(update_recs), UPDATE_BATCH_SIZE):
+        batch = update_recs[start:start + UPDATE_BATCH_SIZE]
         try:
-            results = solrcon.search(q = f"art_id:{doc_id}")
-            if results.raw_response["response"]["numFound"] > 0:
-                found = True
-        except Exception as e:
-            logger.warning(f"Document {doc_id} not in Solr...skipping")
-            skipped_as_missing += 1
-        else:
-            if found:
-                update_rec = False
+            solrcon.add(batch, fieldUpdates=field_updates)
+        except Exception as err:
+            # send them one at a time, so only the record(s) Solr won't take are skipped
+            logger.warning(f"Solr batch update exception ({err}); updating {len(batch)} records one at a time.")
+            for upd_rec in batch:
                 try:
-                    result = results.raw_response["response"]["docs"][0]
-                    if result["art_cited_5"] != art_stat.art_cited_5 or \
-                       result["art_cited_10"] != art_stat.art_cited_10 or \
-                       result["art_cited_20"] != art_stat.art_cited_20 or \
-                       result["art_cited_all"] != art_stat.art_cited_all or \
-                       result["art_views_lastcalyear"] != art_stat.art_views_lastcalyear or \
-                       result["art_views_last12mos"] != art_stat.art_views_last12mos or \
-                       result["art_views_last6mos"] != art_stat.art_views_last6mos or \
-                       result["art_views_last1mos"] != art_stat.art_views_last1mos or \
-                       result["art_views_lastweek"] != art_stat.art_views_lastweek:
-                        update_rec = True
-
-                except Exception as e:
-                    logger.info(f"...No data for document {doc_id}.")
-                    if 0 != art_stat.art_cited_5 or \
-                       0 != art_stat.art_cited_10 or \
-                       0 != art_stat.art_cited_20 or \
-                       0 != art_stat.art_cited_all or \
-                       0 != art_stat.art_views_lastcalyear or \
-                       0 != art_stat.art_views_last12mos or \
-                       0 != art_stat.art_views_last6mos or \
-                       0 != art_stat.art_views_last1mos or \
-                       0 != art_stat.art_views_lastweek:
-                        update_rec = True
-                    
-                if doc_id is not None and update_rec:
-                    logger.info(f"...Updating stat for {doc_id} in Solr...{remaining_count} more to check.")
-                    upd_rec = {
-                                "id":doc_id,
-                                "art_cited_5": art_stat.art_cited_5, 
-                                "art_cited_10": art_stat.art_cited_10, 
-                                "art_cited_20": art_stat.art_cited_20, 
-                                "art_cited_all": art_stat.art_cited_all, 
-                                "art_views_lastcalyear": art_stat.art_views_lastcalyear, 
-                                "art_views_last12mos": art_stat.art_views_last12mos, 
-                                "art_views_last6mos": art_stat.art_views_last6mos, 
-                                "art_views_last1mos": art_stat.art_views_last1mos, 
-                                "art_views_lastweek": art_stat.art_views_lastweek
-                    }                    
-        
-                    try:
-                        solrcon.add([upd_rec], fieldUpdates={
-                                                             "art_cited_5": 'set',
-                                                             "art_cited_10": 'set',
-                                                             "art_cited_20": 'set',
-                                                             "art_cited_all": 'set',
-                                                             "art_views_lastcalyear": 'set',
-                                                             "art_views_last12mos": 'set',
-                                                             "art_views_last6mos": 'set',
-                                                             "art_views_last1mos": 'set',
-                                                             "art_views_lastweek": 'set'
-                                                             })
-        
-                        if update_count > 0 and update_count % UPDATE_AFTER == 0:
-                            solr_docs2.commit()
-                            errStr = f"Updated {update_count} records with citation data"
-                            print (errStr)
-                            logger.warning(errStr)
-                        
-                    except Exception as err:
-                        errStr = f"Solr call exception for update on {doc_id}: {err}"
-                        print (errStr)
-                        skipped_as_update_error += 1
-                        logger.error(errStr)
-                    else:
-                        update_count += 1
+                    solrcon.add([upd_rec], fieldUpdates=field_updates)
+                except Exception as err:
+                    errStr = f"Solr call exception for update on {upd_rec['id']}: {err}"
+                    print (errStr)
+                    skipped_as_update_error += 1
+                    logger.error(errStr)
+                else:
+                    update_count += 1
+        else:
+            update_count += len(batch)
+
+        uncommitted_count += len(batch)
+        if uncommitted_count >= UPDATE_AFTER:
+            uncommitted_count = 0
+            solrcon.commit()
+            errStr = f"Updated {update_count} records with citation data"
+            print (errStr)
+            logger.warning(errStr)
 
     #  final commit
     try:
-        solr_docs2.commit()
+        solrcon.commit()
     except Exception as e:
         msg = f"Final commit error {e}"
         print(msg)
@@ -429,6 +440,8 @@ if __name__ == "__main__":
                         help="Level at which events should be logged (DEBUG, INFO, WARNING, ERROR")
     parser.add_argument("-a", "--all", dest="all_records", default=False, action="store_true",
                         help="Update records with views and any citation data (takes significantly longer)")
+    parser.add_argument("--dryrun", dest="dry_run", default=False, action="store_true",
+                        help="Compare the stat data with Solr and show the counts of changes, but don't update Solr")
     
     args = parser.parse_args()
     logger = logging.getLogger(programNameShort)
@@ -443,7 +456,7 @@ if __name__ == "__main__":
         solr_docs2 = pysolr.Solr(solrurl_docs)
     start_time = time.time()
     load_unified_article_stat()
-    updates = update_solr_stat_data(solr_docs2, args.all_records)
+    updates = update_solr_stat_data(solr_docs2, args.all_records, dry_run=args.dry_run)
     total_time = time.time() - start_time
     final_stat = f"{time.ctime()} Updated {updates} Solr records in {total_time} secs ({total_time/60} minutes))."
     print (final_stat)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import os.path
+
+folder = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if folder == "tests": # testing from within WingIDE, default folder is tests
+    sys.path.append('../libs')
+    sys.path.append('../config')
+    sys.path.append('../../app')
+else: # python running from should be within folder app
+    sys.path.append('./libs')
+    sys.path.append('./config')
+
+import time
+import unittest
+import opasCacheSupport
+from opasCacheSupport import OpasCache
+
+class TestCaches(unittest.TestCase):
+    """
+    Tests of the in-process caches
+
+    Note: tests are performed in alphabetical order, hence the function naming
+          with forced order in the names.
+
+    """
+
+    def test_0_cache_ttl(self):
+        cache = OpasCache("test", ttl=1)
+        cache.set("key", "value")
+        assert(cache.get("key") == "value")
+        time.sleep(1.1)
+        assert(cache.get("key") is None)
+
+    def test_1_cache_lru(self):
+        cache = OpasCache("test", ttl=60, max_entries=3)
+        for n in range(3):
+            cache.set(n, n)
+        cache.get(0) # now 1 is the least recently used
+        cache.set(3, 3)
+        assert(cache.get(1) is None)
+        assert(cache.get(0) == 0)
+        assert(cache.stats()["evictions"] == 1)
+
+    def test_1b_cache_max_bytes(self):
+        page = "x" * 10000
+        cache = OpasCache("test", ttl=60, backend=opasCacheSupport.LocalCacheBackend(max_entries=100, max_bytes=sys.getsizeof(page) * 5))
+        for n in range(6):
+            cache.set(n, page)
+        assert(cache.get(0) is None)
+        assert(cache.get(5) == page)
+        assert(cache.stats()["bytes"] <= sys.getsizeof(page) * 5)
+
+    def test_1c_render_cache_hits(self):
+        """
+        The hits marked in a cached render are the hits Solr marked (not other occurrences of the terms,
+          or entity references with a term's name), so the numbered anchors match the hit counts
+        """
+        import opasConfig
+        import opasPySolrLib
+        import opasXMLHelper as opasxmllib
+        text_xml = "<pepkbd3><artinfo arttype='ART' j='IJP'><artyear>1999</artyear><arttitle>On #@@@love@@@# &amp; hate</arttitle></artinfo>"
+        text_xml += "<body><p>Tom &amp; Jerry, #@@@amp@@@# and &quot;#@@@quot@@@#&quot; &lt; #@@@love@@@#, love; lt</p></body></pepkbd3>"
+        render_key = opasPySolrLib.get_render_cache_key({"art_id": "TEST.001.0001A", "file_last_modified": "2021-03-01T10:00:00Z"}, 0, None)
+        opasCacheSupport.render_cache.clear()
+        direct_html = opasxmllib.xml_str_to_html(text_xml)
+        for n in range(2):
+            hits = opasCacheSupport.render_cache.hits
+            html = opasPySolrLib.xml_str_to_html_cached(text_xml, render_key)
+            # the same as rendering with the hits (except in the head, where hits aren't marked)
+            assert(html.split("</head>")[1] == direct_html.split("</head>")[1])
+            assert(html.count(opasConfig.HITMARKERSTART) == text_xml.count(opasConfig.HITMARKERSTART))
+        assert(opasCacheSupport.render_cache.hits == hits + 1)
+
+    def test_2_session_cache_invalidate(self):
+        import models
+        from opasCentralDBLib import opasCentralDB
+        session_info = models.SessionInfo(session_id="test-session-cache-invalidate")
+        opasCacheSupport.session_cache.set(session_info.session_id, session_info)
+        assert(opasCacheSupport.session_cache.get(session_info.session_id) is not None)
+        # any update to the session in the DB invalidates the cached info
+        ocd = opasCentralDB()
+        ocd.update_session(session_info.session_id, api_client_id=2)
+        assert(opasCacheSupport.session_cache.get(session_info.session_id) is None)
+
+    def test_3_download_cache(self):
+        """
+        Concurrent requests for the same download share one render, and repeats come from the cache
+        """
+        import tempfile
+        import threading
+        import opasDownloadSupport
+        doc_xml = "<pepkbd3><artinfo><arttitle>Title</arttitle></artinfo><body><p>Download test</p></body></pepkbd3>"
+        renderer = opasDownloadSupport.DownloadRenderer(cache_path=tempfile.mkdtemp(), max_bytes=1024 * 1024, min_age=0, workers=2)
+        filenames = []
+        threads = [threading.Thread(target=lambda: filenames.append(renderer.get(doc_xml, "TEST.001.0001A", "HTML", "2021-03-01T00:00:00Z"))) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert(len(set(filenames)) == 1 and os.path.exists(filenames[0]))
+        assert(renderer.stats()["renders"] == 1)
+        assert(renderer.get(doc_xml, "TEST.001.0001A", "HTML", "2021-03-01T00:00:00Z") == filenames[0])
+        assert(renderer.stats()["hits"] == 1)
+        # an updated source file is rendered again
+        assert(renderer.get(doc_xml, "TEST.001.0001A", "HTML", "2021-03-02T00:00:00Z") != filenames[0])
+        assert(renderer.stats()["renders"] == 2)
+        # over the size limit, the least recently used file is removed
+        renderer.max_bytes = os.path.getsize(filenames[0])
+        renderer.evict()
+        assert(not os.path.exists(filenames[0]))
+        renderer.shutdown()
+
+    def test_4_background_rebuilder(self):
+        """
+        Data built from a core is rebuilt in one background thread at a time, when the core's index version
+          is due to be checked; a version that can't be read is None
+        """
+        import threading
+        class TestIndex(opasCacheSupport.BackgroundRebuilder):
+            def __init__(self, versions, **kwargs):
+                super().__init__("test index", {"docs": "docs core"}, self.read_test_version, **kwargs)
+                self.versions = versions
+                self.started = threading.Event()
+                self.release = threading.Event()
+                self.release.set()
+                self.built = []
+
+            def read_test_version(self, solr_core):
+                assert(solr_core == "docs core")
+                version = self.versions.pop(0)
+                if version is None:
+                    raise ValueError("No index version")
+                return version
+
+            def rebuild_core(self, key, version):
+                self.started.set()
+                self.release.wait()
+                self.built.append((key, version))
+
+        index = TestIndex(["1", None], check_interval=60, preload=False)
+        assert(index.load_in_background() == [])
+        index.check("docs", wait=True)
+        assert(index.built == [("docs", "1")])
+        assert(index.check("docs") is None) # checked within check_interval
+        index.trackers["docs"].check_interval = 0
+        index.check("docs", wait=True)
+        assert(index.built == [("docs", "1"), ("docs", None)])
+        # while it's rebuilding, checks don't start another rebuild
+        index = TestIndex(["1"], check_interval=0)
+        index.release.clear()
+        threads = index.load_in_background()
+        index.started.wait(5)
+        assert(index.check("docs") is threads[0])
+        index.release.set()
+        threads[0].join()
+        assert(index.built == [("docs", "1")])
+
+if __name__ == '__main__':
+    unittest.main()
+    print ("Tests Complete.")
@@ -35,6 +35,34 @@ class TestDatabase(unittest.TestCase):
         print (f"timing: {timing}")
         assert(timing < 2.3) # 10 times slower running DB/Solr on AWS
     
+    def test_2_pool_reuses_connections(self):
+        from opasCentralDBLib import db_pool
+        ocd = opasCentralDB()
+        ocd.get_article_year("FD.026.0007A") # make sure there's at least one pooled connection
+        before = db_pool.stats()
+        for n in range(10):
+            year = ocd.get_article_year("FD.026.0007A")
+            assert(year == 2020)
+        after = db_pool.stats()
+        print (f"pool stats: {after}")
+        assert(after["checkouts"] - before["checkouts"] == 10)
+        assert(after["connects"] == before["connects"])
+        assert(after["checked_out"] == 0)
+
+    def test_3_log_writer_flush(self):
+        import secrets
+        from opasCentralDBLib import log_writer, API_AUTHORS_INDEX
+        ocd = opasCentralDB()
+        session_id = secrets.token_urlsafe(16)
+        success, session_info = ocd.save_session(session_id=session_id)
+        for n in range(3):
+            ret = ocd.record_session_endpoint(session_info=session_info, api_endpoint_id=API_AUTHORS_INDEX, item_of_interest="IJP.001.0001A", status_message="Testing")
+            assert(ret == 1)
+        assert(log_writer.flush() == True)
+        count = ocd.get_select_count(f"SELECT * FROM api_session_endpoints WHERE session_id = '{session_id}';")
+        assert(count == 3)
+        ocd.end_session(session_id)
+
     def test_count_open_sessions(self):
         ocd = opasCentralDB()
         count = ocd.count_open_sessions()
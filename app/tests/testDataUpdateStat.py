@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import os.path
+
+folder = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if folder == "tests": # testing from within WingIDE, default folder is tests
+    sys.path.append('../libs')
+    sys.path.append('../config')
+    sys.path.append('../opasDataUpdateStat')
+else: # python running from should be within folder app
+    sys.path.append('./libs')
+    sys.path.append('./config')
+    sys.path.append('./opasDataUpdateStat')
+
+import unittest
+import opasDataUpdateStat
+from opasDataUpdateStat import ArticleStat, diff_stat_data
+
+class TestDataUpdateStat(unittest.TestCase):
+    """
+    Tests
+
+    Note: tests are performed in alphabetical order, hence the function naming
+          with forced order in the names.
+
+    """
+    def test_diff_stat_data(self):
+        """
+        Only the documents with a changed stat value are updated (with all the stat fields); a field
+          not in the Solr record is 0, and documents not in Solr are skipped
+        """
+        opasDataUpdateStat.unified_article_stat.clear()
+        opasDataUpdateStat.unified_article_stat.update({
+            "AIM.001.0001A": ArticleStat(art_cited_all=5, art_cited_5=2),                                   # unchanged
+            "AIM.001.0002A": ArticleStat(art_cited_all=6, art_cited_5=2),                                   # cited changed
+            "AIM.001.0003A": ArticleStat(art_views_update=True, art_views_lastweek=3, art_views_last1mos=3), # views changed
+            "AIM.001.0004A": ArticleStat(art_views_update=True, art_views_lastweek=1),                      # not in Solr
+            })
+        solr_stat = {"AIM.001.0001A": {"id": "AIM.001.0001A", "art_cited_all": 5, "art_cited_5": 2},
+                     "AIM.001.0002A": {"id": "AIM.001.0002A", "art_cited_all": 5, "art_cited_5": 2},
+                     "AIM.001.0003A": {"id": "AIM.001.0003A", "art_views_last1mos": 3},
+                     }
+
+        # by default, only the documents with views data
+        update_recs, counts, field_changes = diff_stat_data(solr_stat)
+        assert([upd_rec["id"] for upd_rec in update_recs] == ["AIM.001.0003A"])
+        assert(counts == {"checked": 2, "changed": 1, "unchanged": 0, "missing": 1})
+        assert(field_changes["art_views_lastweek"] == 1)
+        assert(field_changes["art_views_last1mos"] == 0)
+
+        update_recs, counts, field_changes = diff_stat_data(solr_stat, all_records=True)
+        assert([upd_rec["id"] for upd_rec in update_recs] == ["AIM.001.0002A", "AIM.001.0003A"])
+        assert(counts == {"checked": 4, "changed": 2, "unchanged": 1, "missing": 1})
+        assert(field_changes["art_cited_all"] == 1)
+        assert(field_changes["art_cited_5"] == 0)
+        # the update record has all the stat fields
+        assert(update_recs[0] == {"id": "AIM.001.0002A", "art_cited_5": 2, "art_cited_10": 0, "art_cited_20": 0, "art_cited_all": 6,
+                                  "art_views_lastcalyear": 0, "art_views_last12mos": 0, "art_views_last6mos": 0, "art_views_last1mos": 0, "art_views_lastweek": 0})
+        opasDataUpdateStat.unified_article_stat.clear()
+
+if __name__ == '__main__':
+    unittest.main()
+    print ("Tests Complete.")
@@ -53,6 +53,19 @@ class TestDocumentImageFetch(unittest.TestCase):
         # Confirm that the request-response cycle completed successfully.
         assert(response.ok == True)
 
+    def test_2_Image_not_modified(self):
+        full_URL = base_plus_endpoint_encoded('/v2/Documents/Image/AIM.036.0275A.FIG001/')
+        response = requests.get(full_URL, headers=headers)
+        assert(response.ok == True)
+        assert(response.headers["content-type"] == "image/jpeg")
+        etag = response.headers["etag"]
+        # the client's copy is current
+        response = requests.get(full_URL, headers={**headers, "If-None-Match": etag})
+        assert(response.status_code == 304)
+        response = requests.get(full_URL, headers={**headers, "If-Modified-Since": response.headers["last-modified"]})
+        assert(response.status_code == 304)
+        response = requests.get(full_URL, headers={**headers, "If-None-Match": '"stale"'})
+        assert(response.status_code == 200)
 
 if __name__ == '__main__':
     unittest.main()    
\ No newline at end of file
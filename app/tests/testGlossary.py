@@ -112,6 +112,26 @@ class TestGlossary(unittest.TestCase):
         response_set = r["documents"]["responseSet"] 
         assert(response_info["count"] == 1)
         print (response_set)
-        
+
+    def test_2_glossary_index(self):
+        """
+        The in-memory glossary finds the same entries as the glossary core queries
+        """
+        import opasGlossarySupport
+        from configLib.opasCoreConfig import solr_gloss2
+        glossary_index = opasGlossarySupport.GlossaryIndex()
+        tests = [("YP0017805628220.001", "ID", "term_id:YP0017805628220.001 || group_id:YP0017805628220.001"),
+                 ("wheelwright, JOSEPH BALCH (1906-99)", "Name", 'term_terms:("wheelwright, JOSEPH BALCH (1906-99)")'),
+                 ("anxiety", "Name", 'term_terms:("anxiety")'),
+                 ("ANXIETY", "Group", 'group_name:("ANXIETY" || "ANXIETY" || "anxiety")'),
+                 ("freudian slip", "Group", 'group_name_terms:("freudian slip")'),
+                 ]
+        for term_id, term_id_type, qstr in tests:
+            entries = glossary_index.find(term_id, term_id_type, rows=1000)
+            results = solr_gloss2.search(qstr, fl="term_id", rows=1000)
+            assert(set([entry["term_id"] for entry in entries]) == set([doc["term_id"] for doc in results.docs]))
+        # loaded once, until the glossary core changes
+        assert(glossary_index.loads == 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -22,8 +22,182 @@ else: # python running from should be within folder app
 from starlette.testclient import TestClient
 
 import unittest
+import time
+import re
+import urllib.parse
 from localsecrets import CONFIG
 import subprocess
+import opasSolrLoadSupport
+import opasXMLHelper as opasxmllib
+from opasCentralDBLib import opasCentralDB
+import localsecrets
+import opasConfig
+import lxml
+from lxml import etree
+
+class BenchBiblioEntry(object):
+    # stands in for opasSolrLoadSupport.BiblioEntry (same attributes), without needing an article to parse
+    def __init__(self, art_id, n):
+        self.art_id = art_id
+        self.ref_local_id = f"B{n:04}"
+        self.art_year_int = 2021
+        self.rx = None
+        self.rx_sourcecode = None
+        self.rxcf = None
+        self.author_list_str = "Author, A."
+        self.authors_xml = "<a><l>Author</l></a>"
+        self.ref_title = f"Reference title {n}"
+        self.source_type = "journal"
+        self.source_title = "Int. J. Psycho-Anal."
+        self.pgrg = "1-10"
+        self.year_of_publication = "1950"
+        self.year_of_publication_int = 1950
+        self.volume = "31"
+        self.publishers = ""
+        self.ref_entry_xml = f"<be id='B{n:04}'><t>Reference title {n}</t></be>"
+        self.ref_entry_text = f"Reference title {n}"
+
+class FirstPageCollector(object):
+    """
+    The XMLParser target opasXMLHelper used to build the first page excerpt with, before
+      FirstPageExcerptBuilder (get_first_page_excerpt_from_doc_root); the benchmark compares them.
+    """
+    def __init__(self, skip_tags=["impx", "tab"], para_limit=opasConfig.MAX_EXCERPT_PARAS, char_limit=opasConfig.MAX_EXCERPT_CHARS, char_min=opasConfig.MIN_EXCERPT_CHARS):
+        self.events = []
+        self.doc = "<abs>"
+        self.in_body = False
+        self.tag_stack = []
+        self.skip_tags = skip_tags
+        self.para_limit = para_limit
+        self.para_count = 0
+        self.char_limit = char_limit
+        self.char_min = char_min
+        self.char_count = 0
+        self.fini = False # all closed up and ready to stop
+        self.close_up = False
+        
+    def start(self, tag, attrib):
+        if tag not in self.skip_tags and self.in_body:
+            self.events.append("start %s %r" % (tag, dict(attrib)))
+            att_str = ""
+            for key, val in attrib.items():
+                if key in ["url"]: # only do this in special cases...if it's a title, we don't want it quoted
+                    val = urllib.parse.quote_plus(val)
+                att_str += f'{key}="{val}" '
+            if att_str == "":
+                self.doc += f"<{tag}>"
+            else:
+                att_str = att_str.rstrip()
+                self.doc += f"<{tag} {att_str}>"
+            self.tag_stack.append(tag)
+            
+        if tag == "body":
+            self.in_body = True
+            
+    def end(self, tag):
+        if tag not in self.skip_tags and tag == "body" and self.in_body:
+            # no pb in body.  Stop recording.
+            self.in_body = False
+            #close outer tag
+            self.doc += "</abs>"
+            
+        if tag not in self.skip_tags and self.in_body:
+            self.events.append("end %s" % tag)
+          
+            if tag == "pb" or tag == "p":
+                if tag == "p": # count paras
+                    self.para_count += 1
+
+                if self.para_count > self.para_limit:
+                    self.close_up = True
+    
+                if self.char_count > self.char_limit:
+                    self.close_up = True
+                
+                if tag == "pb" and self.char_count > self.char_min:
+                    self.close_up = True
+            
+                if self.close_up:
+                    punct = r'[\.\!\?\)\>]+'
+                    if tag == "p": # this could be the last para, and it could be a split para (p then p2)
+                        #  back off text to last punctuation.  If you hit a tag (>), stop, can't go further.
+                        google_safe = self.doc
+                        while re.match(punct, google_safe[-1]) is None:
+                            google_safe = google_safe[:-1]
+                        self.doc = google_safe
+                    
+                    if tag == "pb": # this could be a pb between a split para
+                        #  back off text to last punctuation.  If you hit a tag (>), stop, can't go further.
+                        google_safe_list = self.doc.split(sep="<pb>")
+                        pb_tag = google_safe_list[-1]
+                        google_safe = "<pb>".join(google_safe_list[0:-1])
+                        while re.match(punct, google_safe[-1]) is None:
+                            google_safe = google_safe[:-1]
+    
+                        # see if we need to go behind para tag (for split para)
+                        google_safe2_list = google_safe.split(sep="</p>")
+                        if google_safe2_list[-1] == "": #  it should be
+                            # could make more efficient just using re.split on punct. #TODO
+                            while re.match(punct, google_safe2_list[-2][-1]) is None and google_safe2_list[-2] != "":
+                                google_safe2_list[-2] = google_safe2_list[-2][:-1]
+                            google_safe2 = '</p>'.join(google_safe2_list)
+                            self.doc = google_safe2 + "<pb>" + pb_tag
+                        # (otherwise, not sure why this would be, don't do anything)
+                    
+            self.doc += f"</{tag}>"
+            if len(self.tag_stack) > 0:
+                self.tag_stack.pop()
+                
+        if self.in_body and (tag == "pb" or tag == "p"):
+            if not self.fini:
+                if self.close_up:
+                    self.in_body = False # skip the rest.
+                    while len(self.tag_stack) > 0:
+                        tag_to_close = self.tag_stack.pop()
+                        self.doc += f"</{tag_to_close}>"
+                    self.doc += "</abs>"
+                    self.fini = True
+            
+    def data(self, data):
+        if self.in_body:
+            if data == "&":
+                data = "&amp;" # reencode
+            elif data == "<":
+                data = "&lt;" # reencode
+            elif data == ">":
+                data = "&gt;" # reencode
+            elif data == "'":
+                data = "&apos;" # reencode    
+            elif data == '"':
+                data = "&quot;" # reencode    
+            self.events.append("data %r" % data)
+            self.char_count += len(data)
+            self.doc += f"{data}"
+            
+    def comment(self, text):
+        self.events.append("comment %s" % text)
+        
+    def close(self):
+        self.events.append("close")
+        return self.doc
+
+def pepfree_sample(max_count=200, keep=None):
+    """
+    (filename, tree) for up to max_count of the _PEPFree XML originals (if there's a local copy),
+      only those for which keep(tree) is true, if keep is given
+    """
+    ret_val = []
+    sample_folder = os.path.join(localsecrets.XML_ORIGINALS_PATH, "_PEPFree")
+    if os.path.isdir(sample_folder):
+        parser = lxml.etree.XMLParser(encoding='utf-8', recover=True, resolve_entities=True, load_dtd=True)
+        for dirpath, dirnames, filenames in os.walk(sample_folder):
+            for filename in filenames:
+                if filename.upper().endswith(".XML") and len(ret_val) < max_count:
+                    with open(os.path.join(dirpath, filename), encoding="utf-8") as f:
+                        pepxml = etree.fromstring(opasxmllib.remove_encoding_string(f.read()), parser)
+                    if keep is None or keep(pepxml):
+                        ret_val.append((filename, pepxml))
+    return ret_val
 
 class TestLoader(unittest.TestCase):
     """
@@ -33,6 +207,233 @@ class TestLoader(unittest.TestCase):
           with forced order in the names.
     
     """
+    def test_biblio_bulk_insert_benchmark(self):
+        """
+        Load time for the references: one REPLACE per reference (add_reference_to_biblioxml_table)
+          vs. bulk (BiblioWriter).  Both write every row; BiblioWriter writes when max_pending rows are pending.
+        """
+        ocd = opasCentralDB()
+        ref_count = 2000
+        max_pending = 500
+        art_id = "ZZBENCH.001.0001A"
+        count_sql = f"SELECT * FROM api_biblioxml WHERE art_id='{art_id}'"
+        bib_entries = [BenchBiblioEntry(art_id, n) for n in range(ref_count)]
+        ocd.do_action_query(querytxt="DELETE FROM api_biblioxml WHERE art_id=%s", queryparams=(art_id, ))
+
+        start = time.time()
+        ocd.open_connection(caller_name="test_biblio_bulk_insert_benchmark")
+        for bib_entry in bib_entries:
+            opasSolrLoadSupport.add_reference_to_biblioxml_table(ocd, None, bib_entry)
+        ocd.db.commit()
+        ocd.close_connection(caller_name="test_biblio_bulk_insert_benchmark")
+        single_row_seconds = time.time() - start
+        assert(ocd.get_select_count(count_sql) == ref_count)
+        ocd.do_action_query(querytxt="DELETE FROM api_biblioxml WHERE art_id=%s", queryparams=(art_id, ))
+
+        biblio_writer = opasSolrLoadSupport.BiblioWriter(ocd, max_pending=max_pending)
+        start = time.time()
+        # in articles of 100 references
+        for n in range(0, ref_count, 100):
+            biblio_writer.add(bib_entries[n:n + 100])
+            # written only when max_pending are pending
+            assert(len(biblio_writer.pending) == (n + 100) % max_pending)
+            assert(biblio_writer.rows_written == (n + 100) - len(biblio_writer.pending))
+        rows_written = biblio_writer.flush()
+        bulk_seconds = time.time() - start
+
+        print (f"{ref_count} references: single row inserts {single_row_seconds:.2f} secs; bulk inserts {bulk_seconds:.2f} secs")
+        assert(rows_written == 0) # nothing was left pending
+        assert(biblio_writer.rows_written == ref_count)
+        assert(ocd.get_select_count(count_sql) == ref_count)
+        ocd.do_action_query(querytxt="DELETE FROM api_biblioxml WHERE art_id=%s", queryparams=(art_id, ))
+
+    def test_biblio_insert_no_connection(self):
+        """
+        Without a database connection, add_rows_to_table logs the error and writes nothing
+        """
+        class NoConnectionDB(object):
+            db = None
+            def open_connection(self, caller_name=""):
+                return False
+            def close_connection(self, caller_name=""):
+                pass
+
+        rows = [BenchBiblioEntry("ZZBENCH.001.0001A", n).__dict__ for n in range(10)]
+        assert(opasSolrLoadSupport.add_rows_to_table(NoConnectionDB(), opasSolrLoadSupport.SQL_REPLACE_API_BIBLIOXML, rows) == 0)
+
+    def test_solr_batch_writer_errors(self):
+        """
+        SolrBatchWriter retries a batch add that fails with a server error, but not one Solr rejects as a
+          bad request (HTTP 400); when the batch can't be added, the documents are added one at a time
+        """
+        import http.server
+        import threading
+        import json
+        import pysolr
+
+        class FakeSolrHandler(http.server.BaseHTTPRequestHandler):
+            statuses = [] # the status for each update request (then 200)
+            docs_per_request = []
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                FakeSolrHandler.docs_per_request.append(len(json.loads(body))) # pysolr sends the documents as a JSON list
+                status = FakeSolrHandler.statuses.pop(0) if FakeSolrHandler.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"responseHeader": {"status": 0}}' if status == 200 else b'{"error": {"msg": "test error"}}')
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), FakeSolrHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        solrcon = pysolr.Solr(f"http://127.0.0.1:{server.server_port}/solr/test")
+        tests = [([503, 503], [2, 2, 2]),                   # retried, then added
+                 ([400], [2, 1, 1]),                        # bad request: not retried, added one at a time
+                 ([503, 503, 503, 503], [2, 2, 2, 2, 1, 1]) # retries used up, added one at a time
+                 ]
+        try:
+            for statuses, docs_per_request in tests:
+                FakeSolrHandler.statuses = list(statuses)
+                FakeSolrHandler.docs_per_request = []
+                solr_writer = opasSolrLoadSupport.SolrBatchWriter(solrcon, "test", retries=3, retry_backoff=0)
+                solr_writer.add([{"id": "ZZBENCH.001.0001A"}, {"id": "ZZBENCH.001.0002A"}])
+                assert(solr_writer.flush() == 2)
+                assert(FakeSolrHandler.docs_per_request == docs_per_request)
+                assert(solr_writer.failed_docs == 0)
+        finally:
+            server.shutdown()
+
+    def test_dtd_parser_cache(self):
+        """
+        The shared loader parser finds the DTD with the XML catalog, reads it and its entity files once,
+          and parses from bytes the same as the string (without the encoding declaration) used to be parsed
+        """
+        import tempfile
+        folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(folder, "dtd"))
+        with open(os.path.join(folder, "dtd", "test.dtd"), "w") as f:
+            f.write('<!ENTITY % isolat1 SYSTEM "isolat1.ent">\n%isolat1;\n<!ELEMENT p (#PCDATA)>\n<!ATTLIST p lang CDATA "en">\n')
+        with open(os.path.join(folder, "dtd", "isolat1.ent"), "w") as f:
+            f.write('<!ENTITY eacute "&#233;">\n')
+        with open(os.path.join(folder, "catalog.xml"), "w") as f:
+            f.write('<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog"><rewriteSystem systemIdStartString="http://example.org/dtd/" rewritePrefix="dtd/"/></catalog>')
+
+        resolver = opasxmllib.CachedDTDResolver(opasxmllib.XMLCatalog([os.path.join(folder, "catalog.xml")]))
+        parser = opasxmllib.new_dtd_parser(resolver)
+        file_bytes = b'<?xml version="1.0" encoding="UTF-8"?>\r\n<!DOCTYPE p SYSTEM "http://example.org/dtd/test.dtd">\r\n<p>caf&eacute;</p>\r\n'
+        for n in range(3):
+            pepxml = opasxmllib.xml_bytes_to_etree(file_bytes, parser=parser)
+            assert(pepxml.text == "café" and pepxml.get("lang") == "en")
+        assert(resolver.loads == 2) # the DTD and the entity file, once
+        assert(resolver.hits == 4)
+        # the same tree as parsing the file's text
+        xmlstr = opasxmllib.xml_bytes_to_str(file_bytes)
+        assert(xmlstr == file_bytes.decode("utf-8").replace("\r\n", "\n"))
+        old_parser = lxml.etree.XMLParser(encoding='utf-8', recover=True, resolve_entities=True, load_dtd=True)
+        old_parser.resolvers.add(opasxmllib.CachedDTDResolver(opasxmllib.XMLCatalog([os.path.join(folder, "catalog.xml")])))
+        assert(etree.tostring(etree.fromstring(opasxmllib.remove_encoding_string(xmlstr), old_parser)) == etree.tostring(pepxml))
+
+    def test_excerpt_benchmark(self):
+        """
+        Excerpt time per article for articles without abstracts: FirstPageCollector (as a parser target,
+          after serializing the document) vs. FirstPageExcerptBuilder (get_first_page_excerpt_from_doc_root),
+          over the _PEPFree sample of the XML originals (if there's a local copy), plus an article with
+          long front matter.  The excerpts must be identical.
+        """
+        def first_page_collector_excerpt(pepxml):
+            xmlstr = etree.tostring(pepxml, encoding="unicode")
+            parser = etree.XMLParser(target=FirstPageCollector(skip_tags=["impx"]), recover=True, resolve_entities=False)
+            try:
+                ret_val = etree.XML(xmlstr, parser=parser)
+            except Exception as e:
+                ret_val = f"Error extracting summary or abstract. {e}"
+            return ret_val
+
+        long_front_matter = "<pepkbd3><artinfo/><body><p>" + "front matter " * 40000 + "</p><pb><n>1</n></pb>" + "<p>More text.</p>" * 50 + "</body></pepkbd3>"
+        sample = [("long front matter", etree.fromstring(long_front_matter))]
+        # excerpts are only made for articles without abstracts
+        sample += pepfree_sample(keep=lambda pepxml: pepxml.xpath("//abs") == [])
+
+        collector_seconds = builder_seconds = 0
+        for name, pepxml in sample:
+            start = time.time()
+            collector_excerpt = first_page_collector_excerpt(pepxml)
+            collector_time = time.time() - start
+            start = time.time()
+            builder_excerpt = opasxmllib.get_first_page_excerpt_from_doc_root(pepxml)
+            builder_time = time.time() - start
+            if name == "long front matter":
+                print (f"Long front matter: FirstPageCollector {collector_time:.3f} secs; FirstPageExcerptBuilder {builder_time:.3f} secs")
+            else:
+                collector_seconds += collector_time
+                builder_seconds += builder_time
+            assert(builder_excerpt == collector_excerpt)
+
+        article_count = len(sample) - 1
+        if article_count > 0:
+            print (f"{article_count} articles: FirstPageCollector {1000 * collector_seconds / article_count:.2f} ms/article; FirstPageExcerptBuilder {1000 * builder_seconds / article_count:.2f} ms/article")
+
+    def test_paragraph_children_benchmark(self):
+        """
+        Paragraph child document time per article: an xpath per group (xml_xpath_return_xmlstringlist_withinheritance)
+          with add_children reparsing each paragraph vs. add_para_children, over the _PEPFree sample of
+          the XML originals (if there's a local copy), plus a long generated article.  The children must be identical.
+        """
+        import copy
+        def xpath_children(pepxml):
+            children = opasSolrLoadSupport.doc_children()
+            for parent_tag, xpath in (("p_body", "//body//p|//body//p2"),
+                                      ("p_heading", "//h1|//h2|//h3|//h4|//h5|//h6"),
+                                      ("p_quote", "//quote//p|//quote//p2"),
+                                      ("p_dream", "//dream//p|//dream//p2"),
+                                      ("p_poem", "//poem//p|//poem//p2"),
+                                      ("p_note", "//note//p|//note//p2"),
+                                      ("p_dialog", "//dialog//p|//dialog//p2"),
+                                      ("p_panel", "//panel//p|//panel//p2"),
+                                      ("p_caption", "//caption//p"),
+                                      ("p_bib", "//bib//be|//binc"),
+                                      ("p_appxs", "//appxs//p|//appxs//p2"),
+                                      ("p_summaries", "//summaries//p|//summaries//p2|//abs//p|//abs//p2")):
+                children.add_children(stringlist=opasxmllib.xml_xpath_return_xmlstringlist_withinheritance(pepxml, xpath, attr_to_find="lang"),
+                                      parent_id="ZZBENCH.001.0001A",
+                                      parent_tag=parent_tag,
+                                      default_lang="en")
+            return children.child_list
+
+        def para_children(pepxml):
+            children = opasSolrLoadSupport.doc_children()
+            children.add_para_children(pepxml, parent_id="ZZBENCH.001.0001A", default_lang="en")
+            return children.child_list
+
+        long_article = "<pepkbd3><artinfo><abs><p>Abstract</p></abs></artinfo><body><h1>Heading</h1>"
+        long_article += "<p lgrid='1' lgrx='2, 3'>Text <i>italic</i></p><quote lang='de'><p>Zitat</p></quote><dream><p>Dream</p></dream><note><p>Note <binc>Ref</binc></p></note>" * 2000
+        long_article += "</body><bib>" + "<be>Reference</be>" * 200 + "</bib></pepkbd3>"
+        sample = [("long article", etree.fromstring(long_article))] + pepfree_sample()
+
+        xpath_seconds = para_seconds = 0
+        for name, pepxml in sample:
+            # both set inherited lang attributes in the tree, so each gets its own copy
+            xpath_tree = copy.deepcopy(pepxml)
+            start = time.time()
+            xpath_child_list = xpath_children(xpath_tree)
+            xpath_time = time.time() - start
+            para_tree = copy.deepcopy(pepxml)
+            start = time.time()
+            para_child_list = para_children(para_tree)
+            para_time = time.time() - start
+            if name == "long article":
+                print (f"Long article: xpath per group {xpath_time:.3f} secs; add_para_children {para_time:.3f} secs")
+            else:
+                xpath_seconds += xpath_time
+                para_seconds += para_time
+            assert(para_child_list == xpath_child_list)
+            assert(etree.tostring(para_tree) == etree.tostring(xpath_tree))
+
+        article_count = len(sample) - 1
+        if article_count > 0:
+            print (f"{article_count} articles: xpath per group {1000 * xpath_seconds / article_count:.2f} ms/article; add_para_children {1000 * para_seconds / article_count:.2f} ms/article")
+
     def test_process_sub(self):
         result = subprocess.run([sys.executable, '../opasDataLoader/opasDataLoader.py', '--sub=_PEPFree', '--nocheck'], capture_output=True)
         out = result.stdout.decode("UTF-8")
@@ -43,6 +444,42 @@ class TestLoader(unittest.TestCase):
         print (err[-400:])
         self.assertIn(b'Load process complete', result.stdout)
 
+    def test_process_sub_workers(self):
+        """
+        The multi-process load (--workers) of a small sample of the _PEPFree files loads the same
+          documents as the serial load
+        """
+        import tempfile
+        import shutil
+        sample_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sample_root)
+        sample_folder = os.path.join(sample_root, "_PEPFree")
+        os.makedirs(sample_folder)
+        sample_count = 0
+        for dirpath, dirnames, filenames in os.walk(os.path.join(localsecrets.XML_ORIGINALS_PATH, "_PEPFree")):
+            for filename in sorted(filenames):
+                if filename.upper().endswith(".XML") and sample_count < 4:
+                    shutil.copy(os.path.join(dirpath, filename), sample_folder)
+                    sample_count += 1
+
+        if sample_count == 0:
+            self.skipTest("No local copy of the _PEPFree XML originals")
+
+        outputs = []
+        for workers in ("1", "2"):
+            result = subprocess.run([sys.executable, '../opasDataLoader/opasDataLoader.py', f'-d{sample_root}', '--sub=_PEPFree', '-a', '--nocheck', f'--workers={workers}'], capture_output=True)
+            out = result.stdout.decode("UTF-8")
+            print ("Stdout:")
+            print (out[-400:])
+            print ("Stderr:")
+            print (result.stderr.decode("UTF-8")[-400:])
+            self.assertIn('Load process complete', out)
+            self.assertIn(f'Imported {sample_count} documents', out)
+            outputs.append(out)
+
+        self.assertNotIn('Parallel load:', outputs[0])
+        self.assertIn('Parallel load: 2 worker processes', outputs[1])
+
     def test_process_newroot(self):
         if CONFIG == "Local":
             #--nocheck -d X:\_PEPA1\_PEPa1v --sub=_PEPFree
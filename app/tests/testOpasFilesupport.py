@@ -187,6 +187,32 @@ class TestFileSystemFunctions(unittest.TestCase):
         #res = opasFileSupport.get_s3_matching_files(subpath_tomatch="_PEPArchive/BAP/.*\.xml", after_revised_date="2020-09-01")
         #res = opasFileSupport.get_s3_matching_files(subpath_tomatch="_PEPCurrent/.*\.xml")
         
+    def test_8_image_manifest(self):
+        """
+        Images resolve from the manifest, with or without extension (.jpg before .gif before .tif)
+        """
+        import os
+        import tempfile
+        image_folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(image_folder, "sub"))
+        for name in ("AIM.036.0275A.FIG001.gif", "AIM.036.0275A.FIG001.jpg", "sub/IJAPS.016.0181A.FIG002.tif", "infoicon.gif"):
+            with open(os.path.join(image_folder, name), "wb") as f:
+                f.write(b"image" * 1000)
+        manifest = opasFileSupport.ImageManifest(opasFileSupport.FlexFileSystem(root=image_folder))
+        manifest.build()
+        assert(manifest.get("AIM.036.0275A.FIG001").basename == "AIM.036.0275A.FIG001.jpg")
+        assert(manifest.get("aim.036.0275a.fig001.gif").media_type == "image/gif")
+        # images in subfolders only with the subfolder in the id, as get_image_filename
+        assert(manifest.get("IJAPS.016.0181A.FIG002") is None)
+        assert(manifest.get("sub/IJAPS.016.0181A.FIG002").media_type == "image/tiff")
+        assert(manifest.get("sub/IJAPS.016.0181A.FIG002.tif").basename == "IJAPS.016.0181A.FIG002.tif")
+        assert(b"".join(manifest.iter_image(manifest.get("infoicon.gif"), chunk_size=1000)) == b"image" * 1000)
+        assert(manifest.get("AIM.036.0275A.FIG002") is None)
+        # images added after the manifest was built are found too
+        with open(os.path.join(image_folder, "AIM.036.0275A.FIG003.gif"), "wb") as f:
+            f.write(b"image")
+        assert(manifest.get("AIM.036.0275A.FIG003").filesize == 5)
+        
 if __name__ == '__main__':
     unittest.main()
     print ("Tests Complete.")
\ No newline at end of file
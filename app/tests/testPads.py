@@ -54,5 +54,23 @@ class TestPadsEndpoints(unittest.TestCase):
             assert(resp.HasCurrentAccess == False)
             #assert(r['documentList']['responseSet'][0].get("accessLimited", None) == False)
 
+    def test_0b_pads_permit_cache(self):
+        # a page of archive documents from the same years needs only one permit request per year
+        import models
+        from opasCacheSupport import permit_cache
+        pads_session_info = opasDocPermissions.authserver_login(username=PADS_TEST_ID, password=PADS_TEST_PW)
+        session_info = opasDocPermissions.get_authserver_session_info(pads_session_info.SessionId, client_id=UNIT_TEST_CLIENT_ID, pads_session_info=pads_session_info)
+        session_info.authorized_peparchive = False # force permit checks
+        items = []
+        for n in range(25):
+            items.append(models.DocumentListItem(documentID=f"AJRPP.002.{349 + n:04}A", accessClassification="current", year="2018" if n % 2 else "2019"))
+        misses_before = permit_cache.misses
+        opasDocPermissions.get_access_limitations_for_list(items, session_info=session_info)
+        # one source, two year bands, so two permit requests (prefetch misses), then all from the cache
+        assert(permit_cache.misses - misses_before <= 2)
+        opasDocPermissions.get_access_limitations_for_list(items, session_info=session_info)
+        assert(permit_cache.misses - misses_before <= 2)
+        opasDocPermissions.authserver_logout(session_info.session_id)
+
 if __name__ == '__main__':
     unittest.main()
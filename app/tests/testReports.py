@@ -48,6 +48,17 @@ class TestReports(unittest.TestCase):
         # these don't get affected by the level.
         assert (response.headers["content-disposition"] == 'attachment; filename=vw_reports_session_activity.csv')
 
+    def test01c_session_log_report_download_ndjson(self):
+        # streamed from a server side cursor; one JSON object per line
+        import json
+        full_URL = base_plus_endpoint_encoded('/v2/Reports/Session-Log?limit=1000&download=true&downloadformat=ndjson')
+        response = requests.get(full_URL, headers=headers, stream=True)
+        assert(response.ok == True)
+        assert (response.headers["content-disposition"] == 'attachment; filename=vw_reports_session_activity.ndjson')
+        rows = [json.loads(line) for line in response.iter_lines() if line]
+        assert(len(rows) >= 1 and len(rows) <= 1000)
+        assert("session_id" in rows[0])
+
     def test02_document_view__log_report(self):
         # note api_key is required, but already in headers
         full_URL = base_plus_endpoint_encoded(f'/v2/Reports/Document-View-Log?limit=10&offset=5')
@@ -6,7 +6,7 @@ import opasQueryHelper
 import opasCentralDBLib
 import starlette.status as httpCodes
 import models
-from opasPySolrLib import search_text, search_text_qs
+from opasPySolrLib import search_text, search_text_qs, search_text_qs_async
 
 import requests
 from unitTestConfig import base_plus_endpoint_encoded, headers, session_id, session_info
@@ -101,7 +101,56 @@ class TestSearchSyntax(unittest.TestCase):
             if full_count < expected_count:
                 print (f"Error checking query:{n}; count:{full_count} vs expected_count {expected_count}\n")
             assert(expected_count <= full_count)
-        
+
+    def test_02_async_search(self):
+        """
+        The async search (opasSolrAsync) returns the same results as search_text_qs
+        """
+        import asyncio
+        for n, expected_count in fulltext1[:5]:
+            solr_query_spec = opasQueryHelper.parse_search_query_parameters(fulltext1=n, art_level=1)
+            ret_val, ret_status = search_text_qs(solr_query_spec.copy(deep=True),
+                                                 limit=5,
+                                                 offset=0, 
+                                                 session_info=session_info
+                                                 )
+            ret_val_async, ret_status_async = asyncio.run(search_text_qs_async(solr_query_spec.copy(deep=True),
+                                                                               limit=5,
+                                                                               offset=0, 
+                                                                               session_info=session_info
+                                                                               ))
+            assert(ret_status_async[0] == httpCodes.HTTP_200_OK)
+            assert(ret_val_async.documentList.responseInfo.fullCount == ret_val.documentList.responseInfo.fullCount)
+            assert([n.documentID for n in ret_val_async.documentList.responseSet] == [n.documentID for n in ret_val.documentList.responseSet])
+
+    def test_02b_search_param_error(self):
+        """
+        A query spec that can't be turned into Solr parameters is a bad request, returned (not raised)
+        """
+        import opasPySolrLib
+        ret_val, ret_status = opasPySolrLib._search_text_qs_error(opasPySolrLib.SearchParamError("Search parameter error: test"))
+        assert(ret_status[0] == httpCodes.HTTP_400_BAD_REQUEST)
+        assert(ret_val.httpcode == httpCodes.HTTP_400_BAD_REQUEST)
+
+    def test_03_search_cache(self):
+        """
+        A repeated search comes from the search cache, with access info for the session making the request
+        """
+        import opasCacheSupport
+        opasCacheSupport.search_cache.clear()
+        solr_query_spec = opasQueryHelper.parse_search_query_parameters(fulltext1="text:love", art_level=1, abstract_requested=True)
+        ret_val, ret_status = search_text_qs(solr_query_spec.copy(deep=True), limit=10, offset=0, session_info=session_info)
+        hits = opasCacheSupport.search_cache.hits
+        ret_val_cached, ret_status = search_text_qs(solr_query_spec.copy(deep=True), limit=10, offset=0, session_info=session_info)
+        assert(opasCacheSupport.search_cache.hits == hits + 1)
+        assert([(n.documentID, n.accessLimited, n.abstract) for n in ret_val_cached.documentList.responseSet] == [(n.documentID, n.accessLimited, n.abstract) for n in ret_val.documentList.responseSet])
+        # no session: restricted documents are limited, from the same cache entry
+        ret_val_nosession, ret_status = search_text_qs(solr_query_spec.copy(deep=True), limit=10, offset=0, session_info=None)
+        assert(opasCacheSupport.search_cache.hits == hits + 2)
+        for n in ret_val_nosession.documentList.responseSet:
+            if n.accessClassification not in ("free", "offsite"):
+                assert(n.accessLimited == True)
+
 if __name__ == '__main__':
     unittest.main()
     print ("Tests Complete.")
\ No newline at end of file
@@ -47,6 +47,27 @@ class TestSolrAPIPrevNextDirectFunctions(unittest.TestCase):
         prev_art, match_art, next_art = opasPySolrLib.metadata_get_next_and_prev_articles(art_id="IJPSP.004.0445A")
         print (prev_art, match_art, next_art)
     
+    def test_2b_navigation_index(self):
+        """
+        The navigation index finds the same next/previous articles and volumes as the Solr queries
+        """
+        import opasNavigationIndex
+        from configLib.opasCoreConfig import solr_docs2
+        navigation_index = opasNavigationIndex.NavigationIndex(solr_docs2, read_version=opasPySolrLib.read_index_version)
+        navigation = navigation_index.build()
+        source_navigation = navigation.sources["IJPSP"]
+        prev_art, match_art, next_art = source_navigation.next_and_prev_articles("IJPSP.004.0445A")
+        results = solr_docs2.search("art_level:1 && art_sourcecode:IJPSP && art_vol:4", fl="art_id", sort="art_id asc", rows=200)
+        art_ids = [doc["art_id"] for doc in results.docs]
+        pos = art_ids.index("IJPSP.004.0445A")
+        assert(match_art["art_id"] == "IJPSP.004.0445A")
+        assert(prev_art.get("art_id") == (art_ids[pos - 1] if pos > 0 else None))
+        assert(next_art.get("art_id") == (art_ids[pos + 1] if pos + 1 < len(art_ids) else None))
+        prev_vol, match_vol, next_vol = source_navigation.next_and_prev_vols("4")
+        assert(prev_vol["value"] == "3" and match_vol["value"] == "4" and next_vol["value"] == "5")
+        # an update with no newly loaded documents keeps the index
+        assert(navigation_index.update(navigation).sources["IJPSP"].articles == source_navigation.articles)
+
     def test_3_get_document_info(self):
         opasPySolrLib.document_get_info('PEPGRANTVS.001.0009A', fields='art_year, art_id, file_classification')
         {'art_year': '2015', 'art_id': 'PEPGRANTVS.001.0009A', 'file_classification': 'free'}
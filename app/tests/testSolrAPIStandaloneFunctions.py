@@ -21,6 +21,9 @@ class TestSolrAPIStandaloneFunctions(unittest.TestCase):
         data = opasAPISupportLib.metadata_get_database_statistics(session_info)
         count = data.article_count
         assert(count >= unitTestConfig.ARTICLE_COUNT)
+        # the second call returns the snapshot computed for this index version
+        data2 = opasAPISupportLib.metadata_get_database_statistics(session_info)
+        assert(data2.snapshot_time == data.snapshot_time and data2.index_version is not None)
     
     def test_1_get_source_list_IJPSP(self):
         data = opasPySolrLib.metadata_get_volumes(source_code="IJPSP")
@@ -91,6 +94,20 @@ class TestSolrAPIStandaloneFunctions(unittest.TestCase):
         data = opasPySolrLib.metadata_get_volumes(source_type="journal")
         count = data.volumeList.responseInfo.fullCount
         assert(count >= unitTestConfig.VOL_COUNT_ALL_JOURNALS)
+
+    def test_1e_metadata_cache(self):
+        """
+        Repeated metadata requests come from the metadata cache (by arguments, not the request URL)
+        """
+        import opasCacheSupport
+        opasCacheSupport.metadata_cache.clear()
+        data = opasPySolrLib.metadata_get_volumes(source_code="AOP", req_url="/v2/Metadata/Volumes/?sourcecode=AOP")
+        hits = opasCacheSupport.metadata_cache.hits
+        data2 = opasPySolrLib.metadata_get_volumes("AOP", req_url="/v2/Metadata/Volumes/?sourcecode=aop")
+        assert(opasCacheSupport.metadata_cache.hits == hits + 1)
+        assert(data2.volumeList.responseInfo.fullCount == data.volumeList.responseInfo.fullCount)
+        assert(data2.volumeList.responseInfo.request == "/v2/Metadata/Volumes/?sourcecode=aop")
+        assert(data.volumeList.responseInfo.request == "/v2/Metadata/Volumes/?sourcecode=AOP")
         
 if __name__ == '__main__':
     unittest.main()
@@ -47,8 +47,43 @@ class TestStandalonePageExtractFunctions(unittest.TestCase):
         print ("Extract size smaller: {extract_size < orig_size}, extract size: {extract_size}, {orig_size}")
         print ("warning: test development incomplete. TODO")
         # assert (xmlpages == "")
-        
-        
+
+    def assert_page_map_pages_match(self, xmlstr, offsets, limits):
+        from lxml import etree
+        hits_xmlstr = xmlstr.replace("text<", "#@@@text@@@#<")
+        page_map = opasXMLHelper.xml_get_page_map(xmlstr)
+        for offset in offsets:
+            for limit in limits:
+                pages = opasXMLHelper.xml_get_pages(xmlstr, offset, limit)
+                map_pages = opasXMLHelper.xml_get_pages_from_page_map(xmlstr, page_map, offset, limit)
+                assert(map_pages[2:] == pages[2:])
+                assert(etree.tostring(etree.fromstring(map_pages[0].replace("\n", "")), method="c14n") == etree.tostring(etree.fromstring(pages[0].replace("\n", "")), method="c14n"))
+                hits_pages = opasXMLHelper.xml_get_pages_from_page_map(hits_xmlstr, page_map, offset, limit)
+                assert(hits_pages[0].replace("#@@@", "").replace("@@@#", "") == map_pages[0])
+
+    def test_2a_get_pages_from_page_map(self):
+        """
+        Pages sliced using the page map (stored by the loader) match those from xml_get_pages, with or without search hits
+        """
+        xmlstr = "<pepkbd3><artinfo><arttitle>Title</arttitle></artinfo><body>"
+        xmlstr += "".join([f"<p>Paragraph {n} text</p><p>More text <pb>not a page break</pb></p><pb><n>{n}</n></pb>" for n in range(1, 20)])
+        xmlstr += "<p>Last page</p></body></pepkbd3>"
+        self.assert_page_map_pages_match(xmlstr, offsets=range(0, 20), limits=(1, 3))
+
+    def test_2b_get_pages_from_page_map_last_pages(self):
+        """
+        With only top level page breaks, pages near the end of the document match xml_get_pages too
+          (which limits the last page to two before the page break count, so the extract can be empty)
+        """
+        for last_page in ("", "<p>Last page text</p>"):
+            xmlstr = "<pepkbd3><artinfo><arttitle>Title</arttitle></artinfo><body>"
+            xmlstr += "".join([f"<p>Paragraph {n} text</p><pb><n>{n}</n></pb>" for n in range(1, 4)])
+            xmlstr += f"{last_page}</body></pepkbd3>"
+            self.assert_page_map_pages_match(xmlstr, offsets=range(0, 6), limits=(1, 2, 3, 4))
+            page_map = opasXMLHelper.xml_get_page_map(xmlstr)
+            for offset, limit in ((2, 2), (3, 1), (3, 2)):
+                assert(opasXMLHelper.xml_get_pages_from_page_map(xmlstr, page_map, offset, limit)[0] == "<body>\n</body>\n")
+
 if __name__ == '__main__':
     unittest.main()
     print ("Tests Complete.")
\ No newline at end of file
@@ -69,6 +69,24 @@ class TestTermSearch(unittest.TestCase):
         for k,c in term_list.items():
             print (f"{k} - {c}")
 
+    def test_2b_batched_term_counts(self):
+        """
+        Batched term counts (any fields, lists and wildcards) match get_term_count_list, and repeats come from the term count cache
+        """
+        import asyncio
+        import opasPySolrLib
+        import opasCacheSupport
+        opasCacheSupport.term_count_cache.clear()
+        term_specs = [("text_xml", "freud, heart"), ("text_xml", "mother"), ("text_xml", "m?th*"), ("title", "mother")]
+        term_counts = opasPySolrLib.get_term_counts(term_specs)
+        assert(term_counts["text_xml"] == opasAPISupportLib.get_term_count_list(["freud, heart", "mother", "m?th*"]))
+        assert(term_counts["title"] == opasAPISupportLib.get_term_count_list("mother", term_field="title"))
+        assert(term_counts["text_xml"]["mother"] > 0)
+        hits = opasCacheSupport.term_count_cache.hits
+        term_counts_async = asyncio.run(opasPySolrLib.get_term_counts_async(term_specs))
+        assert(term_counts_async == term_counts)
+        assert(opasCacheSupport.term_count_cache.hits == hits + 5)
+
     #def test_1c_search_wildcard(self):
         #full_URL = base_plus_endpoint_encoded('/v1/Database/Search/?author=gre?nfield')
         #response = requests.get(full_URL, headers=headers)
@@ -44,7 +44,20 @@ class TestWordWheel(unittest.TestCase):
         response_set = r["termIndex"]["responseSet"] 
         assert(response_set[0]["termCount"] >= 3)
         print (response_set)
-       
+
+    def test_3a_term_dictionary(self):
+        """
+        The in-process term dictionary pages the same terms (and counts) as the Solr terms handler
+        """
+        import opasTermDictionary
+        from configLib.opasCoreConfig import solr_docs2
+        term_dict = opasTermDictionary.TermDictionary(opasTermDictionary.export_terms(solr_docs2, "art_kwds_str"))
+        assert(len(term_dict) > 0)
+        for order in ("count", "index"):
+            results = solr_docs2.suggest_terms(fields="art_kwds_str", prefix="love", handler="terms", **{"terms.limit": 15, "terms.sort": order})
+            assert(term_dict.lookup("love", limit=10, order=order) == results["art_kwds_str"][:10])
+            assert(term_dict.lookup("love", offset=5, limit=10, order=order) == results["art_kwds_str"][5:15])
+
 
 if __name__ == '__main__':
     unittest.main()